@@ -0,0 +1,179 @@
+# -- customize_action 帧程序编译器
+#
+# 把 Sim / 工作台发来的帧列表 (angles 或语义 legs) 一次性解析成紧凑的
+# 增量编码数组, 合并重复帧和共线帧, 并按请求内容哈希缓存编译结果,
+# 重复运行同一段程序时不再做 JSON 解析和语义查表。
+
+from array import array
+
+try:
+    import uhashlib as hashlib
+except ImportError:
+    import hashlib
+
+HOME = (90, 90, 90, 90, 90, 90, 90, 90)
+DEFAULT_DURATION = 500
+HOME_DURATION = 500
+
+_MAX_DELTA = 127       # int8
+_MAX_DURATION = 65535  # uint16
+
+
+def content_hash(data):
+    """Return the sha256 digest of ``data`` (bytes or str), used as cache key."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).digest()
+
+
+def _clamp(angle):
+    angle = int(angle)
+    if angle < 0:
+        return 0
+    if angle > 180:
+        return 180
+    return angle
+
+
+def _collinear(a, b, c, t1, t2):
+    """True when a -> b (t1 ms) -> c (t2 ms) moves every servo at constant speed."""
+    if t1 <= 10 or t2 <= 10:
+        # _moveServos jumps instead of interpolating for short periods
+        return False
+    for i in range(8):
+        if (c[i] - b[i]) * t1 != (b[i] - a[i]) * t2:
+            return False
+    return True
+
+
+class CompiledAction:
+    """A customize_action program resolved to angles and delta-encoded.
+
+    ``start`` holds the absolute angles of the first frame (uint8), ``deltas``
+    holds 8 int8 steps per following frame and ``durations`` one uint16 per
+    frame. ``home`` tells whether the trailing home move is still needed.
+    """
+
+    __slots__ = ('start', 'deltas', 'durations', 'home')
+
+    def __init__(self, start, deltas, durations, home):
+        self.start = start
+        self.deltas = deltas
+        self.durations = durations
+        self.home = home
+
+    def __len__(self):
+        return len(self.durations)
+
+    def duration_ms(self):
+        """Playing time including the trailing home move."""
+        return sum(self.durations) + (HOME_DURATION if self.home else 0)
+
+    def frames(self):
+        """Yield ``(duration, angles)`` per frame.
+
+        The same angles list is reused between frames, callers must copy it
+        if they keep a reference.
+        """
+        if not self.durations:
+            return
+        pose = list(self.start)
+        yield self.durations[0], pose
+        deltas = self.deltas
+        j = 0
+        for n in range(1, len(self.durations)):
+            for i in range(8):
+                pose[i] += deltas[j + i]
+            j += 8
+            yield self.durations[n], pose
+
+
+def resolve_frame(frame, resolve):
+    """Return ``(duration, angles)`` for one customize_action frame.
+
+    A missing or non-positive duration means 500 ms; angles are clamped to
+    0..180. ``resolve`` converts a semantic ``legs`` dict into 8 angles.
+    """
+    duration = frame.get('duration', DEFAULT_DURATION)
+    if duration <= 0:
+        duration = DEFAULT_DURATION
+    if 'angles' in frame:
+        angles = [_clamp(a) for a in frame['angles']]
+    else:
+        angles = [_clamp(a) for a in resolve(frame.get('legs', {}))]
+    return int(duration), angles
+
+
+def compile_action(params, resolve):
+    """Compile customize_action ``params`` into a :class:`CompiledAction`.
+
+    ``resolve`` converts a semantic ``legs`` dict into 8 angles, normally
+    ``Quad._angles_from_semantic``. Frames follow the same rules as
+    ``Quad.customize_action``, see :func:`resolve_frame`.
+    """
+    return compile_frames(resolve_frame(frame, resolve) for frame in params)
+
+
+def compile_frames(frames):
+    """Compile already resolved ``(duration, angles)`` pairs (e.g. binproto.frames)."""
+    # -- 1. merge collinear frames on the fly
+    merged = []
+    for duration, angles in frames:
+        if len(merged) >= 2:
+            t1, b = merged[-1]
+            if _collinear(merged[-2][1], b, angles, t1, duration):
+                merged[-1] = (t1 + duration, angles)
+                continue
+        merged.append((duration, angles))
+
+    # -- 2. delta encode, splitting steps that do not fit int8 / uint16
+    start = array('B', merged[0][1] if merged else HOME)
+    durations = array('H')
+    deltas = array('b')
+    if merged:
+        # 起点姿态未知, 没法插值: 第 1 份时间移到 start, 其余几份原地保持
+        duration = merged[0][0]
+        n = max((duration + _MAX_DURATION - 1) // _MAX_DURATION, 1)
+        for k in range(1, n + 1):
+            if k > 1:
+                for i in range(8):
+                    deltas.append(0)
+            durations.append(duration * k // n - duration * (k - 1) // n)
+    prev = list(start)
+    for duration, angles in merged[1:]:
+        diff = [angles[i] - prev[i] for i in range(8)]
+        big = max(abs(d) for d in diff)
+        n = max((big + _MAX_DELTA - 1) // _MAX_DELTA,
+                (duration + _MAX_DURATION - 1) // _MAX_DURATION, 1)
+        for k in range(1, n + 1):
+            for i in range(8):
+                deltas.append(diff[i] * k // n - diff[i] * (k - 1) // n)
+            durations.append(duration * k // n - duration * (k - 1) // n)
+        prev = angles
+
+    home = tuple(prev) != HOME if merged else True
+    return CompiledAction(start, deltas, durations, home)
+
+
+class ActionCache:
+    """Small LRU cache of compiled actions keyed by :func:`content_hash`."""
+
+    def __init__(self, size=8):
+        self._size = size
+        self._items = {}
+        self._order = []
+
+    def get(self, key):
+        action = self._items.get(key)
+        if action is not None and self._order[-1] != key:
+            self._order.remove(key)
+            self._order.append(key)
+        return action
+
+    def put(self, key, action):
+        if key in self._items:
+            self._order.remove(key)
+        elif len(self._order) >= self._size:
+            del self._items[self._order.pop(0)]
+        self._items[key] = action
+        self._order.append(key)
@@ -0,0 +1,79 @@
+# -- 局域网发现: UDP 广播机器人的名字、地址、固件和支持的命令
+#
+# 机器人的 IP 原来写死在 main.py 里, 工作台也要手工填写 Base URL。这里每
+# ANNOUNCE_MS 向 ANNOUNCE_PORT 广播一个 JSON 数据报 (内容同 GET /info), 工作台服务
+# (workbench/discovery.py) 收到后登记这台机器人, 超过数据报里的 ttl 秒没再收到
+# 就把它移出列表。工作台启动时向 DISCOVERY_PORT 广播查询 b'QUAD?', 机器人立即单独
+# 回复一次, 不用等下一次广播。
+#
+# 用法 (main.py, 连上 wifi 之后):
+#     from announce import Announcer
+#     robot_wifi.announcer = Announcer(robot_wifi.handle_info_request)
+
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+import utime
+
+ANNOUNCE_PORT = 8890    # 工作台在这里收广播
+DISCOVERY_PORT = 8889   # 机器人在这里收查询
+ANNOUNCE_MS = 2000
+TTL_S = 10              # 连续丢 4 次广播才算离线
+QUERY = b'QUAD?'
+BROADCAST = '255.255.255.255'
+
+
+class Announcer:
+    """Broadcasts ``payload()`` (a JSON str) and answers discovery queries.
+
+    ``poll()`` must be called from the server loop; it is cheap when
+    there is nothing to do. ``port=None`` does not listen for queries
+    (several stand-in robots on one Linux host), ``target`` is where
+    announcements go.
+    """
+
+    def __init__(self, payload, port=DISCOVERY_PORT, target=BROADCAST, target_port=ANNOUNCE_PORT,
+                 interval_ms=ANNOUNCE_MS):
+        self.payload = payload
+        self.target = (target, target_port)
+        self.interval_ms = interval_ms
+        self.sent = 0
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        except (AttributeError, OSError):
+            pass
+        self.listening = port is not None
+        if self.listening:
+            self.sock.bind(('0.0.0.0', port))
+        self.sock.setblocking(False)
+        # 第一次 poll() 立即广播
+        self._last = utime.ticks_add(utime.ticks_ms(), -interval_ms)
+
+    def _send(self, addr):
+        try:
+            self.sock.sendto(self.payload().encode('utf-8'), addr)
+            self.sent += 1
+        except OSError:
+            # 还没连上 wifi, 或者广播被拒绝: 下次再试
+            pass
+
+    def receive(self):
+        """Answer the queries waiting on the socket."""
+        while self.listening:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except OSError:
+                return
+            if data == QUERY:
+                self.queries += 1
+                self._send(addr)
+
+    def poll(self):
+        self.receive()
+        now = utime.ticks_ms()
+        if utime.ticks_diff(now, self._last) >= self.interval_ms:
+            self._last = now
+            self._send(self.target)
@@ -0,0 +1,72 @@
+"""Helpers shared by the benchmark scripts (CPython side)."""
+import http.client
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def start_stand_in(kind, port, python='micropython', env=None, udp_port=None, serial=None):
+    """Start bench/robot_stand_in.py under ``python`` and wait for its port."""
+    workdir = tempfile.mkdtemp(prefix='quad-bench-')
+    extra = []
+    if udp_port is not None or serial is not None:
+        extra.append('-' if udp_port is None else str(udp_port))
+    if serial is not None:
+        extra.append(serial)
+    proc = subprocess.Popen(
+        [python, os.path.join(HERE, 'robot_stand_in.py'), kind, str(port)] + extra,
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f'{python} robot_stand_in.py exited with {proc.returncode}')
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('stand-in robot did not start')
+
+
+def stop(proc):
+    proc.kill()
+    proc.wait()
+
+
+def request(port, method, path, body=None, timeout=5.0, host='127.0.0.1'):
+    """One request on a fresh connection, returns (status, body bytes, seconds)."""
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        return resp.status, data, time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def percentile(samples, p):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summary_ms(samples):
+    return {
+        'n': len(samples),
+        'p50': percentile(samples, 50) * 1000,
+        'p95': percentile(samples, 95) * 1000,
+        'p99': percentile(samples, 99) * 1000,
+        'max': (max(samples) if samples else float('nan')) * 1000,
+    }
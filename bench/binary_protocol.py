@@ -0,0 +1,96 @@
+# -- JSON vs binproto: bytes on the wire and parse time of /control bodies.
+#
+# Runs in-process with the robot's own modules, on the MicroPython unix port
+# (closest to the ESP32) or CPython:
+#
+#     micropython bench/binary_protocol.py
+#     python3 bench/binary_protocol.py
+#
+# "parse" is what the server does before queueing: json.loads + compile_action
+# for JSON, decode_header + compile_frames for binary. On MicroPython the heap
+# allocated per parse is reported as well.
+
+import gc
+import json
+import sys
+import time
+
+ROOT = (__file__.rsplit('/', 1)[0] if '/' in __file__ else '.') + '/..'
+sys.path.insert(0, ROOT)
+
+import binproto
+from action import compile_action, compile_frames
+
+if hasattr(time, 'ticks_us'):
+    def _now_us():
+        return time.ticks_us()
+
+    def _elapsed_us(start):
+        return time.ticks_diff(time.ticks_us(), start)
+else:
+    def _now_us():
+        return time.perf_counter()
+
+    def _elapsed_us(start):
+        return (time.perf_counter() - start) * 1e6
+
+
+def _resolve(legs):
+    return [90] * 8
+
+
+def make_frames(n):
+    frames = []
+    for k in range(n):
+        a = 60 + (k * 7) % 60
+        frames.append({"duration": 200 + (k % 5) * 100,
+                       "angles": [a, 180 - a, 90, 90, a, 180 - a, 45 + k % 90, 135 - k % 90]})
+    return frames
+
+
+def parse_json(body):
+    data = json.loads(body)
+    return compile_action(data["params"], _resolve)
+
+
+def parse_binary(body):
+    command, flags, count = binproto.decode_header(body)
+    return compile_frames(binproto.frames(body, count))
+
+
+def measure(fn, body, rounds):
+    fn(body)
+    gc.collect()
+    heap = None
+    if hasattr(gc, 'mem_alloc'):
+        before = gc.mem_alloc()
+        gc.disable()
+        fn(body)
+        heap = gc.mem_alloc() - before
+        gc.enable()
+        gc.collect()
+    start = _now_us()
+    for _ in range(rounds):
+        fn(body)
+    return _elapsed_us(start) / rounds, heap
+
+
+def main():
+    rounds = 20
+    print('{:>6} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'frames', 'format', 'bytes', 'parse us', 'heap B', 'x bytes', 'x time', 'x heap'))
+    for n in (10, 100, 500):
+        frames = make_frames(n)
+        body_json = json.dumps({"command": "customize_action", "params": frames})
+        body_bin = binproto.encode("customize_action", frames)
+        t_json, h_json = measure(parse_json, body_json, rounds)
+        t_bin, h_bin = measure(parse_binary, body_bin, rounds)
+        print('{:>6} {:>7} {:>10} {:>10.0f} {:>10} {:>10} {:>10} {:>10}'.format(
+            n, 'json', len(body_json), t_json, '-' if h_json is None else h_json, '', '', ''))
+        print('{:>6} {:>7} {:>10} {:>10.0f} {:>10} {:>10.1f} {:>10.1f} {:>10}'.format(
+            n, 'binary', len(body_bin), t_bin, '-' if h_bin is None else h_bin,
+            len(body_json) / len(body_bin), t_json / t_bin,
+            '-' if h_bin is None else '{:.1f}'.format(h_json / max(h_bin, 1))))
+
+
+main()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+How many classroom sessions one workbench instance sustains.
+
+Starts --mocks mock_robot.py instances and workbench/server.py (or
+--server workbench/server_async.py), then plays browser sessions against
+it in stages of --sessions concurrent users (e.g. 10,30,60), each stage
+for --seconds. A session is a list of requests with think time between
+them, like one student's page:
+
+* a page load (GET / with gzip; a reload revalidates with If-None-Match)
+  and GET /api/robots, as the settings panel does;
+* single /api/control commands and bursts (the same block pressed several
+  times in a row);
+* long gaits: POST /api/program with gait commands and waits, followed
+  through its event stream to the end event.
+
+Sessions are synthetic (--seed, --actions, --think-ms) or replayed with
+--replay FILE: a file written by --save, or a traffic log written by the
+server's --record (real browsers, grouped into sessions by client address
+and played with the recorded think times). Robot addresses in the
+sessions are mapped onto the mocks.
+
+Each stage reports requests per second, p50/p95/p99 latency per kind of
+request, the error rate (connection failures, timeouts, 5xx and other
+unexpected replies; 409/429 "robot busy" are counted apart) and the
+server's threads, memory and CPU read from /proc. Thresholds
+(--max-p99-ms, --max-error-rate, --min-rps, --max-rss-mb, --max-threads,
+or --baseline with an earlier --json report) make it exit 1 when a stage
+crosses them.
+
+Run from the project root:
+    python3 bench/classroom_load.py --sessions 10,30,60
+    python3 workbench/server.py --record class.jsonl      # during a lesson
+    python3 bench/classroom_load.py --replay class.jsonl --sessions 30
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from _common import ROOT, stop, summary_ms
+
+BUSY = (409, 429)
+GAITS = ('forward', 'backward', 'turn_L', 'turn_R', 'dance', 'moonwalk_L')
+POSES = ('hello', 'wave_hand', 'up_down', 'push_up', 'home')
+# 回放时跳过: 事件流由回放的 POST /api/program 自己跟踪, 遥测流是页面一直开着的
+SKIP = ('/api/program/', '/api/telemetry', '/api/stats', '/metrics')
+INTERACTIVE = ('static', 'api', 'control', 'program')
+STAGGER = 2.0           # users start spread over this many seconds
+NOISE_MS = 5.0          # baseline latency rises smaller than this are not regressions
+TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def start(args, port):
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args[0]} did not start')
+
+
+# -- sessions: {"client": ..., "actions": [{"wait", "method", "path", "body", "gzip", "revalidate"}]}
+#    "wait" is seconds after the previous request was sent, never before it finished
+
+def action(wait, method, path, body=None, gzip=False, revalidate=False):
+    return {'wait': round(wait, 3), 'method': method, 'path': path, 'body': body,
+            'gzip': gzip, 'revalidate': revalidate}
+
+
+def synthetic_session(rng, index, robots, actions, think_ms, gait_ms):
+    """One student: page load, then ``actions`` commands, bursts, gaits and reloads."""
+    robot = rng.choice(robots)
+    think = (lambda: rng.expovariate(1000 / think_ms)) if think_ms else (lambda: 0.0)
+    out = [action(0, 'GET', '/', gzip=True), action(think(), 'GET', '/api/robots')]
+    for _ in range(actions):
+        roll = rng.random()
+        if roll < 0.45:
+            command = rng.choice(GAITS + POSES)
+            out.append(action(think(), 'POST', '/api/control', {'baseUrl': robot, 'command': command}))
+        elif roll < 0.65:
+            command = rng.choice(GAITS)
+            for i in range(rng.randint(3, 6)):
+                out.append(action(think() if i == 0 else 0.0, 'POST', '/api/control',
+                                  {'baseUrl': robot, 'command': command, 'params': {'steps': 1}}))
+        elif roll < 0.85:
+            steps = []
+            for _ in range(rng.randint(2, 4)):
+                steps.append({'kind': 'command', 'command': rng.choice(GAITS)})
+                steps.append({'kind': 'wait', 'ms': gait_ms})
+            out.append(action(think(), 'POST', '/api/program', {'baseUrl': robot, 'steps': steps}))
+        elif roll < 0.95:
+            out.append(action(think(), 'GET', '/', gzip=True, revalidate=True))
+        else:
+            out.append(action(think(), 'GET', '/api/robots'))
+    return {'client': f'synthetic-{index}', 'actions': out}
+
+
+def sessions_from_log(entries):
+    """Sessions from a server --record log, one per client address; returns (sessions, skipped)."""
+    by_client = {}
+    for entry in entries:
+        by_client.setdefault(entry['client'], []).append(entry)
+    sessions, skipped = [], 0
+    for client, records in sorted(by_client.items()):
+        records.sort(key=lambda e: e['t'])
+        actions, last = [], None
+        for e in records:
+            if e['method'] not in ('GET', 'POST') or e['path'].startswith(SKIP):
+                skipped += 1
+                continue
+            body = e.get('body')
+            if body:
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    pass
+            actions.append(action(0.0 if last is None else e['t'] - last, e['method'], e['path'], body or None,
+                                  e.get('gzip', False), e.get('revalidate', False)))
+            last = e['t']
+        if actions:
+            sessions.append({'client': client, 'actions': actions})
+    return sessions, skipped
+
+
+def load_sessions(path):
+    with open(path, encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    if entries and 'actions' in entries[0]:
+        return entries, 0
+    return sessions_from_log(entries)
+
+
+def save_sessions(path, sessions):
+    with open(path, 'w', encoding='utf-8') as f:
+        for session in sessions:
+            f.write(json.dumps(session) + '\n')
+
+
+def remap(sessions, urls):
+    """Replace the robot addresses in request bodies with ``urls``, in order of first use."""
+    mapping = {}
+
+    def robot(url):
+        if url not in mapping:
+            mapping[url] = urls[len(mapping) % len(urls)]
+        return mapping[url]
+
+    out = []
+    for session in sessions:
+        actions = []
+        for a in session['actions']:
+            body = a['body']
+            if isinstance(body, dict):
+                body = dict(body)
+                if isinstance(body.get('baseUrl'), str):
+                    body['baseUrl'] = robot(body['baseUrl'])
+                if isinstance(body.get('baseUrls'), list):
+                    body['baseUrls'] = [robot(u) for u in body['baseUrls']]
+            actions.append(dict(a, body=body))
+        out.append(dict(session, actions=actions))
+    return out
+
+
+def kind(method, path):
+    path = path.split('?', 1)[0].rstrip('/')
+    if path == '/api/control':
+        return 'control'
+    if path == '/api/program' and method == 'POST':
+        return 'program'
+    return 'api' if path.startswith('/api/') else 'static'
+
+
+# -- load
+
+class User(threading.Thread):
+    """One browser: plays sessions back to back until ``deadline`` on a keep-alive connection."""
+
+    def __init__(self, port, sessions, first, deadline, think_scale, timeout, samples, rng):
+        super().__init__(daemon=True)
+        self.port = port
+        self.sessions = sessions
+        self.next = first
+        self.deadline = deadline
+        self.think_scale = think_scale
+        self.timeout = timeout
+        self.samples = samples
+        self.rng = rng
+        self.etags = {}
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+
+    def run(self):
+        time.sleep(self.rng.uniform(0, STAGGER))
+        while time.monotonic() < self.deadline:
+            session = self.sessions[self.next % len(self.sessions)]
+            self.next += 1
+            sent = time.monotonic()
+            for a in session['actions']:
+                pause = sent + a['wait'] * self.think_scale - time.monotonic()
+                if pause > 0:
+                    time.sleep(min(pause, max(0.0, self.deadline - time.monotonic())))
+                if time.monotonic() >= self.deadline:
+                    break
+                sent = time.monotonic()
+                self.play(a)
+        self.conn.close()
+
+    def record(self, what, status, started):
+        # 截止之后才完成的请求不计入 (只算这一阶段内的吞吐)
+        now = time.monotonic()
+        if now <= self.deadline:
+            self.samples.append((what, status, now - started))
+
+    def exchange(self, method, path, body, headers):
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+            data = resp.read()
+            if resp.getheader('Connection', '').lower() == 'close':
+                self.conn.close()
+            return resp.status, resp, data
+        except (OSError, http.client.HTTPException):
+            # http.client 下一次请求时重新连接
+            self.conn.close()
+            return 0, None, b''
+
+    def play(self, a):
+        what = kind(a['method'], a['path'])
+        headers = {}
+        if a['gzip']:
+            headers['Accept-Encoding'] = 'gzip'
+        if a['revalidate'] and a['path'] in self.etags:
+            headers['If-None-Match'] = self.etags[a['path']]
+        body = a['body']
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            body = body if isinstance(body, str) else json.dumps(body)
+        started = time.monotonic()
+        status, resp, data = self.exchange(a['method'], a['path'], body, headers)
+        self.record(what, status, started)
+        if what == 'static' and status == 200 and resp.getheader('ETag'):
+            self.etags[a['path']] = resp.getheader('ETag')
+        if what == 'program' and status == 202:
+            self.follow(json.loads(data)['program'], started)
+
+    def follow(self, program, started):
+        """Read the program's event stream to its end event, like the page; records a "gait"."""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        status = 0
+        try:
+            conn.request('GET', f'/api/program/{program}/events')
+            resp = conn.getresponse()
+            event = None
+            while resp.status == 200:
+                line = resp.readline()
+                if not line:
+                    break
+                if line.startswith(b'event: '):
+                    event = line[7:].strip()
+                elif line.startswith(b'data: ') and event == b'end':
+                    status = 200 if json.loads(line[6:])['state'] == 'done' else 500
+                    break
+            if resp.status == 204:
+                status = 200
+        except (OSError, http.client.HTTPException, ValueError):
+            pass
+        finally:
+            conn.close()
+        self.record('gait', status, started)
+
+
+class ProcSampler(threading.Thread):
+    """Threads, resident memory and CPU time of process ``pid`` every ``interval`` s (Linux /proc)."""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.threads = 0
+        self.rss_kb = 0
+        self._done = threading.Event()
+
+    def read(self):
+        threads = rss = 0
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        threads = int(line.split()[1])
+                    elif line.startswith('VmRSS:'):
+                        rss = int(line.split()[1])
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rpartition(')')[2].split()
+            cpu = (int(fields[11]) + int(fields[12])) / TICKS
+        except (OSError, IndexError, ValueError):
+            return None
+        return threads, rss, cpu
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            sample = self.read()
+            if sample is not None:
+                self.threads = max(self.threads, sample[0])
+                self.rss_kb = max(self.rss_kb, sample[1])
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_stage(port, pid, sessions, users, seconds, think_scale, timeout, seed):
+    samples = []
+    sampler = ProcSampler(pid)
+    before = sampler.read()
+    sampler.start()
+    started = time.monotonic()
+    deadline = started + seconds
+    rng = random.Random(seed)
+    crowd = [User(port, sessions, i, deadline, think_scale, timeout, samples, random.Random(rng.random()))
+             for i in range(users)]
+    for user in crowd:
+        user.start()
+    for user in crowd:
+        user.join()
+    sampler.stop()
+    after = sampler.read()
+    return summarize(users, samples, seconds, sampler, before, after)
+
+
+def summarize(users, samples, seconds, sampler, before, after):
+    kinds = {}
+    errors = busy = 0
+    for what, status, took in samples:
+        k = kinds.setdefault(what, {'ok': [], 'errors': 0, 'busy': 0})
+        if status in BUSY:
+            k['busy'] += 1
+            busy += 1
+        elif 200 <= status < 400:
+            k['ok'].append(took)
+        else:
+            k['errors'] += 1
+            errors += 1
+    requests = sum(1 for s in samples if s[0] != 'gait')
+    total = len(samples)
+    stage = {
+        'sessions': users, 'seconds': seconds, 'requests': requests, 'rps': round(requests / seconds, 1),
+        'errors': errors, 'error_rate': round(errors / total, 4) if total else 0.0,
+        'busy': busy, 'busy_rate': round(busy / total, 4) if total else 0.0,
+        'kinds': {}, 'server': {'threads_max': sampler.threads, 'rss_mb_max': round(sampler.rss_kb / 1024, 1)},
+    }
+    if before and after:
+        stage['server']['threads_end'] = after[0]
+        stage['server']['cpu_pct'] = round((after[2] - before[2]) / seconds * 100, 1)
+    for what, k in sorted(kinds.items()):
+        entry = {'errors': k['errors'], 'busy': k['busy']}
+        if k['ok']:
+            entry.update({name: round(value, 1) for name, value in summary_ms(k['ok']).items()})
+        else:
+            entry['n'] = 0
+        stage['kinds'][what] = entry
+    return stage
+
+
+def violations(stage, args, baseline):
+    out = []
+    if stage['error_rate'] > args.max_error_rate:
+        out.append(f"error rate {stage['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    if args.min_rps is not None and stage['rps'] < args.min_rps:
+        out.append(f"{stage['rps']} req/s < {args.min_rps}")
+    if args.max_rss_mb is not None and stage['server']['rss_mb_max'] > args.max_rss_mb:
+        out.append(f"server RSS {stage['server']['rss_mb_max']} MB > {args.max_rss_mb}")
+    if args.max_threads is not None and stage['server']['threads_max'] > args.max_threads:
+        out.append(f"server threads {stage['server']['threads_max']} > {args.max_threads}")
+    for what in INTERACTIVE:
+        p99 = stage['kinds'].get(what, {}).get('p99')
+        if args.max_p99_ms is not None and p99 is not None and p99 > args.max_p99_ms:
+            out.append(f'{what} p99 {p99:.1f} ms > {args.max_p99_ms:g}')
+    base = baseline.get(stage['sessions']) if baseline else None
+    if base is None:
+        return out
+    tol = args.tolerance
+    if stage['rps'] < base['rps'] * (1 - tol):
+        out.append(f"{stage['rps']} req/s, baseline {base['rps']}")
+    if stage['error_rate'] > base['error_rate'] + 0.01:
+        out.append(f"error rate {stage['error_rate']:.2%}, baseline {base['error_rate']:.2%}")
+    if stage['server']['rss_mb_max'] > base['server']['rss_mb_max'] * (1 + tol):
+        out.append(f"server RSS {stage['server']['rss_mb_max']} MB, baseline {base['server']['rss_mb_max']}")
+    for what in INTERACTIVE:
+        p99 = stage['kinds'].get(what, {}).get('p99')
+        was = base['kinds'].get(what, {}).get('p99')
+        if p99 is not None and was is not None and p99 > was * (1 + tol) and p99 - was > NOISE_MS:
+            out.append(f'{what} p99 {p99:.1f} ms, baseline {was:.1f}')
+    return out
+
+
+def report(stage):
+    s = stage['server']
+    print(f"\n{stage['sessions']} sessions, {stage['seconds']:g} s: {stage['rps']} req/s, "
+          f"errors {stage['error_rate']:.2%}, busy (409/429) {stage['busy_rate']:.2%}")
+    print(f"  server: {s['threads_max']} threads max, {s['rss_mb_max']} MB RSS max"
+          + (f", {s['cpu_pct']}% CPU" if 'cpu_pct' in s else ''))
+    print(f"  {'kind':<8} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'busy':>6} {'errors':>6}  (ms)")
+    for what, k in stage['kinds'].items():
+        if k['n']:
+            print(f"  {what:<8} {k['n']:>6} {k['p50']:>8.1f} {k['p95']:>8.1f} {k['p99']:>8.1f} {k['max']:>8.1f}"
+                  f" {k['busy']:>6} {k['errors']:>6}")
+        else:
+            print(f"  {what:<8} {0:>6} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {k['busy']:>6} {k['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', default='workbench/server.py', help='or workbench/server_async.py')
+    parser.add_argument('--sessions', default='10,30,60', help='concurrent users per stage, comma separated')
+    parser.add_argument('--seconds', type=float, default=20, help='length of each stage')
+    parser.add_argument('--mocks', type=int, default=8)
+    parser.add_argument('--mock-delay-ms', type=float, default=150, help='how long a mock holds each command')
+    parser.add_argument('--jitter-ms', type=float, default=10, help='random mock delay (WiFi)')
+    parser.add_argument('--robot-port', type=int, default=8710, help='first mock robot port')
+    parser.add_argument('--proxy-port', type=int, default=8709)
+    parser.add_argument('--replay', metavar='FILE', help='sessions from --save or from the server --record log')
+    parser.add_argument('--save', metavar='FILE', help='write the sessions played (to --replay later)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--actions', type=int, default=20, help='actions per synthetic session')
+    parser.add_argument('--think-ms', type=float, default=3000, help='mean think time of synthetic sessions')
+    parser.add_argument('--gait-ms', type=float, default=1500, help='wait after each gait of a program')
+    parser.add_argument('--think-scale', type=float, default=1.0,
+                        help='multiply every think time (0: back to back)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--json', metavar='FILE', help='write the report as JSON (for --baseline)')
+    parser.add_argument('--baseline', metavar='FILE', help='fail on regressions against this --json report')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative change from --baseline')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--max-p99-ms', type=float, help='for page loads, API calls, commands and program starts')
+    parser.add_argument('--min-rps', type=float)
+    parser.add_argument('--max-rss-mb', type=float)
+    parser.add_argument('--max-threads', type=int)
+    args = parser.parse_args()
+    stages = [int(n) for n in args.sessions.split(',')]
+
+    urls = [f'http://127.0.0.1:{args.robot_port + i}' for i in range(args.mocks)]
+    if args.replay:
+        sessions, skipped = load_sessions(args.replay)
+        print(f'{len(sessions)} sessions from {args.replay}'
+              + (f' ({skipped} event stream / stats requests skipped)' if skipped else ''))
+    else:
+        rng = random.Random(args.seed)
+        sessions = [synthetic_session(rng, i, [f'robot-{n}' for n in range(args.mocks)], args.actions,
+                                      args.think_ms, args.gait_ms) for i in range(max(stages))]
+    if not sessions:
+        parser.error('no sessions to play')
+    if args.save:
+        save_sessions(args.save, sessions)
+    sessions = remap(sessions, urls)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = {s['sessions']: s for s in json.load(f)['stages']}
+
+    mocks = [start(['mock_robot.py', str(args.robot_port + i), str(args.mock_delay_ms), str(args.jitter_ms)],
+                   args.robot_port + i) for i in range(args.mocks)]
+    proxy = start([args.server, '--port', str(args.proxy_port), '--discovery-port', '0', '--scan-interval', '0'],
+                  args.proxy_port)
+    results, failed = [], []
+    try:
+        print(f'{args.server}, {args.mocks} mocks ({args.mock_delay_ms:g} ms per command)')
+        for i, users in enumerate(stages):
+            stage = run_stage(args.proxy_port, proxy.pid, sessions, users, args.seconds, args.think_scale,
+                              args.timeout, args.seed + i)
+            stage['violations'] = violations(stage, args, baseline)
+            results.append(stage)
+            report(stage)
+            for v in stage['violations']:
+                print(f'  FAIL: {v}')
+                failed.append(f"{users} sessions: {v}")
+    finally:
+        for proc in mocks + [proxy]:
+            stop(proc)
+
+    ok = [s['sessions'] for s in results if not s['violations']]
+    print('\nsustained: ' + (f'{max(ok)} sessions' if ok else 'no stage within the thresholds'))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'server': args.server, 'mocks': args.mocks, 'stages': results}, f, indent=1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Robot discovery on one Linux host.
+
+Linux routes all of 127.0.0.0/8 to the loopback interface, so mock robots
+bound to 127.0.0.N stand in for robots spread over a /24. The bench starts
+--mocks mock_robot.py instances (found only by the subnet scan) and
+--announcers robot_stand_in.py instances running the real announce.py
+(sending to the workbench's UDP port instead of broadcasting), then
+workbench/server.py with the periodic scan off, and measures:
+
+* how long until every announcing robot is listed in GET /api/robots;
+* how long POST /api/robots/scan takes for 127.0.0.0/24 and what it finds;
+* how long a stopped announcer stays listed (its TTL).
+
+Run from the project root:
+    python3 bench/discovery_scan.py --python micropython
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from _common import ROOT, start_stand_in, stop
+
+
+def start(args, host, port):
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args[0]} did not start')
+
+
+def call(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request(method, path, body=None if body is None else json.dumps(body),
+                     headers={'Content-Type': 'application/json'})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def listed(port):
+    return {r['baseUrl'] for r in call(port, 'GET', '/api/robots')['robots']}
+
+
+def wait_until(predicate, timeout):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if predicate():
+            return time.monotonic() - started
+        time.sleep(0.05)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--python', default='micropython', help='interpreter for the announcing stand-ins')
+    parser.add_argument('--mocks', type=int, default=8)
+    parser.add_argument('--announcers', type=int, default=3)
+    parser.add_argument('--robot-port', type=int, default=8380, help='HTTP port of the mock robots')
+    parser.add_argument('--stand-in-port', type=int, default=8381, help='first stand-in HTTP port')
+    parser.add_argument('--udp-port', type=int, default=8390, help='workbench announcement port')
+    parser.add_argument('--proxy-port', type=int, default=8379)
+    args = parser.parse_args()
+
+    hosts = [f'127.0.0.{10 + i * 240 // max(1, args.mocks)}' for i in range(args.mocks)]
+    procs = [start(['mock_robot.py', f'{h}:{args.robot_port}'], h, args.robot_port) for h in hosts]
+    proxy = start(['workbench/server.py', '--port', str(args.proxy_port), '--discovery-port', str(args.udp_port),
+                   '--scan', '127.0.0.0/24', '--scan-port', str(args.robot_port), '--scan-interval', '0'],
+                  '127.0.0.1', args.proxy_port)
+    procs.append(proxy)
+    env = dict(os.environ, QUAD_ANNOUNCE=f'127.0.0.1:{args.udp_port}')
+    announcers = []
+    try:
+        t0 = time.monotonic()
+        for i in range(args.announcers):
+            announcers.append(start_stand_in('sync', args.stand_in_port + i, python=args.python, env=env))
+        urls = {f'http://127.0.0.1:{args.stand_in_port + i}' for i in range(args.announcers)}
+        took = wait_until(lambda: urls <= listed(args.proxy_port), 15)
+        print(f'announcements: {args.announcers} robots listed '
+              + ('never' if took is None else f'{(time.monotonic() - t0) * 1000:.0f} ms after their start'))
+
+        reply = call(args.proxy_port, 'POST', '/api/robots/scan', {})
+        scan = reply['scan']
+        print(f"scan {scan['network']}: {scan['hosts']} hosts in {scan['seconds'] * 1000:.0f} ms, "
+              f"found {scan['found']} of {args.mocks} mocks")
+        print(f"listed: {len(reply['robots'])} robots")
+
+        stop(announcers.pop())
+        gone = wait_until(lambda: len(urls & listed(args.proxy_port)) < len(urls), 30)
+        print('stopped announcer dropped ' + ('never' if gone is None else f'after {gone:.1f} s (TTL)'))
+    finally:
+        for proc in procs + announcers:
+            stop(proc)
+
+
+if __name__ == '__main__':
+    main()
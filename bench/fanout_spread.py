@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+How far apart N robots start the same command.
+
+Starts N mock_robot.py instances (each holding a command for --delay-ms)
+and workbench/server.py. "sequential" is what the page did for a fleet:
+one /api/control per robot, each after the previous reply, so robot k
+starts k round trips after the first. "fan-out" is one /api/control with
+all robots in "baseUrls"; the spread is the server's own measurement
+between the first and the last dispatch, plus the whole request time.
+
+Run from the project root:
+    python3 bench/fanout_spread.py
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from _common import ROOT, summary_ms
+
+FLEETS = (2, 4, 8, 16)
+HEADERS = {'Content-Type': 'application/json'}
+
+
+def start(args, port):
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args[0]} did not start')
+
+
+def post(conn, body):
+    conn.request('POST', '/api/control', body=json.dumps(body), headers=HEADERS)
+    resp = conn.getresponse()
+    return json.loads(resp.read())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--robot-port', type=int, default=8180, help='first mock robot port')
+    parser.add_argument('--proxy-port', type=int, default=8179)
+    parser.add_argument('--delay-ms', type=float, default=100, help='mock robot reply delay')
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    urls = [f'http://127.0.0.1:{args.robot_port + i}' for i in range(max(FLEETS))]
+    robots = [start(['mock_robot.py', str(args.robot_port + i), str(args.delay_ms)], args.robot_port + i)
+              for i in range(len(urls))]
+    proxy = start(['workbench/server.py', '--port', str(args.proxy_port)], args.proxy_port)
+    conn = http.client.HTTPConnection('127.0.0.1', args.proxy_port)
+    try:
+        print(f"{'robots':>6} {'mode':<11} {'spread p50':>10} {'spread max':>10} {'request p50':>11}  (ms)")
+        for n in FLEETS:
+            fleet = urls[:n]
+            post(conn, {'command': 'forward', 'baseUrls': fleet})     # connect the pool
+            sequential, seq_total, fan, fan_total = [], [], [], []
+            for _ in range(args.rounds):
+                t0 = time.perf_counter()
+                starts = []
+                for url in fleet:
+                    starts.append(time.perf_counter())
+                    post(conn, {'command': 'forward', 'baseUrl': url})
+                seq_total.append(time.perf_counter() - t0)
+                sequential.append(starts[-1] - starts[0])
+
+                t0 = time.perf_counter()
+                reply = post(conn, {'command': 'forward', 'baseUrls': fleet})
+                fan_total.append(time.perf_counter() - t0)
+                fan.append(reply['spread_ms'] / 1000)
+            for mode, spread, total in (('sequential', sequential, seq_total), ('fan-out', fan, fan_total)):
+                s, t = summary_ms(spread), summary_ms(total)
+                print(f"{n:>6} {mode:<11} {s['p50']:>10.2f} {s['max']:>10.2f} {t['p50']:>11.1f}")
+    finally:
+        conn.close()
+        for proc in [proxy] + robots:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
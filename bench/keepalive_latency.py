@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Latency of a 30-command program with and without HTTP keep-alive.
+
+Each command is a short customize_action (one 20 ms frame that ends in the
+home pose, so there is no trailing home move) sent to POST /control; the
+program is sent either with a new TCP connection per command or over one
+persistent connection. Runs against bench/robot_stand_in.py by default, or
+against a real robot with --robot (where the TCP handshake over 2.4 GHz WiFi
+is what keep-alive saves).
+
+On localhost a handshake is nearly free, so --rtt-ms puts a small proxy in
+front of the stand-in that delays every chunk by half the round trip and
+the first bytes of a new connection by one extra round trip (the SYN /
+SYN-ACK exchange).
+
+Run from the project root:
+    python3 bench/keepalive_latency.py --python micropython --rtt-ms 30
+    python3 bench/keepalive_latency.py --robot 192.168.2.182
+"""
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+
+from _common import start_stand_in, stop, summary_ms
+
+COMMAND = json.dumps({'command': 'customize_action', 'params': [{'duration': 20, 'angles': [90] * 8}]})
+HEADERS = {'Content-Type': 'application/json'}
+
+
+def _pipe(src, dst, delay, first_delay):
+    try:
+        first = True
+        while True:
+            data = src.recv(65536)
+            if not data:
+                break
+            time.sleep(delay + (first_delay if first else 0))
+            first = False
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        for s in (src, dst):
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def start_latency_proxy(port, upstream, rtt_ms):
+    """Forward 127.0.0.1:``port`` to ``upstream`` with an emulated round-trip time."""
+    listener = socket.create_server(('127.0.0.1', port))
+    delay = rtt_ms / 2000
+
+    def accept_loop():
+        while True:
+            client, _ = listener.accept()
+            server = socket.create_connection(upstream)
+            for s in (client, server):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=_pipe, args=(client, server, delay, rtt_ms / 1000), daemon=True).start()
+            threading.Thread(target=_pipe, args=(server, client, delay, 0), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    return listener
+
+
+def run_program(host, port, commands, keep_alive):
+    """Send the program, returns (total seconds, per-command seconds)."""
+    per_command = []
+    conn = None
+    started = time.perf_counter()
+    for _ in range(commands):
+        t0 = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+        headers = HEADERS if keep_alive else dict(HEADERS, Connection='close')
+        conn.request('POST', '/control', body=COMMAND, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f'HTTP {resp.status}')
+        if not keep_alive or resp.will_close:
+            conn.close()
+            conn = None
+        per_command.append(time.perf_counter() - t0)
+    if conn is not None:
+        conn.close()
+    return time.perf_counter() - started, per_command
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--python', default='micropython', help='interpreter for the robot stand-in')
+    parser.add_argument('--robot', help='benchmark a real robot at this address instead of the stand-in')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--commands', type=int, default=30)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--rtt-ms', type=float, default=0, help='emulated network round trip (stand-in only)')
+    args = parser.parse_args()
+
+    if args.robot:
+        cases = [('robot', args.robot, 80, None)]
+    else:
+        cases = []
+        port = args.port
+        for kind in ('sync', 'async'):
+            proc = start_stand_in(kind, port, args.python)
+            if args.rtt_ms:
+                start_latency_proxy(port + 100, ('127.0.0.1', port), args.rtt_ms)
+                cases.append((kind, '127.0.0.1', port + 100, proc))
+            else:
+                cases.append((kind, '127.0.0.1', port, proc))
+            port += 1
+
+    print(f"{'server':<6} {'keep-alive':>10} {'program ms':>11} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    try:
+        for name, host, port, _ in cases:
+            for keep_alive in (False, True):
+                totals, samples = [], []
+                for _ in range(args.rounds):
+                    total, per_command = run_program(host, port, args.commands, keep_alive)
+                    totals.append(total)
+                    samples += per_command
+                s = summary_ms(samples)
+                print(f"{name:<6} {'yes' if keep_alive else 'no':>10} {min(totals) * 1000:>11.1f} "
+                      f"{s['p50']:>8.1f} {s['p95']:>8.1f} {s['max']:>8.1f}")
+    finally:
+        for _, _, _, proc in cases:
+            if proc is not None:
+                stop(proc)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# -- Heap cost of serving the control page, before and after page.py.
+#
+# Runs in-process with the robot's own modules and a fake socket:
+#
+#     micropython bench/page_heap.py
+#     python3 bench/page_heap.py
+#
+# "before" is the old handle_get_request (index.html kept as a str, headers
+# concatenated and encoded on every GET). The number reported is the heap
+# high-water mark above the idle heap during one page load: on MicroPython
+# the bytes allocated with the GC disabled, on CPython the tracemalloc peak.
+
+import gc
+import sys
+
+ROOT = (__file__.rsplit('/', 1)[0] if '/' in __file__ else '.') + '/..'
+sys.path.insert(0, ROOT)
+sys.path.insert(0, ROOT + '/bench')
+
+from robot_stand_in import StandInQuad
+from robot_wifi import RobotWifi
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = 0
+
+    def sendall(self, data):
+        self.sent += len(data)
+
+
+def high_water(fn):
+    """Heap bytes above the starting point while ``fn()`` runs, and fn's result."""
+    gc.collect()
+    if hasattr(gc, 'mem_alloc'):
+        before = gc.mem_alloc()
+        gc.disable()
+        result = fn()
+        peak = gc.mem_alloc() - before
+        gc.enable()
+        return peak, result
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, result
+
+
+def old_page_load(html):
+    """The GET handler before page.py."""
+    sock = FakeSocket()
+    response_headers = (
+        'HTTP/1.1 200 OK\r\n'
+        'Content-Type: text/html\r\n'
+        'Access-Control-Allow-Origin: *\r\n'
+        '\r\n'
+    )
+    sock.sendall((response_headers + html).encode('utf-8'))
+    return sock.sent
+
+
+def new_page_load(server, headers):
+    sock = FakeSocket()
+    server.handle_get_request(sock, headers, True, 1)
+    return sock.sent
+
+
+def prepare_page():
+    """index.html plus a gzip variant in /tmp when this interpreter can compress."""
+    try:
+        import gzip
+    except ImportError:
+        return ROOT + '/index.html'
+    with open(ROOT + '/index.html', 'rb') as f:
+        data = f.read()
+    path = '/tmp/quad-page-bench.html'
+    with open(path, 'wb') as f:
+        f.write(data)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, 9))
+    return path
+
+
+def main():
+    html_path = prepare_page()
+    with open(html_path, 'r', encoding='utf-8') as f:
+        html = f.read()
+    server = RobotWifi(StandInQuad(), html_path=html_path)
+    etag = server.page.plain[2]
+
+    cases = [
+        ('before', lambda: old_page_load(html)),
+        ('after', lambda: new_page_load(server, {})),
+    ]
+    if server.page.gzip is not None:
+        cases.append(('after, gzip', lambda: new_page_load(server, {'accept-encoding': 'gzip, deflate'})))
+    cases.append(('after, 304', lambda: new_page_load(server, {'if-none-match': etag})))
+
+    print('{:<12} {:>10} {:>12}'.format('page load', 'bytes sent', 'heap peak B'))
+    for name, fn in cases:
+        fn()
+        peak, sent = high_water(fn)
+        print('{:<12} {:>10} {:>12}'.format(name, sent, peak))
+
+
+main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Throughput and tail latency of the workbench proxy under many clients.
+
+Starts a few mock_robot.py instances (each holding every command for
+--delay-ms, like a short motion) and then, in turn, workbench/server.py
+(ThreadingHTTPServer) and workbench/server_async.py. C asyncio clients
+each send POST /api/control in a loop for --seconds, spread over the
+robots, reusing their connection when the server allows it. Reports
+completed requests per second, p50/p99 latency of 200 replies and how
+many requests were turned away fast (429 robot busy / 503 proxy full)
+or failed.
+
+Run from the project root:
+    python3 bench/proxy_concurrency.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from _common import ROOT, summary_ms
+
+CLIENTS = (10, 100, 500)
+
+
+def start(args, port):
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args[0]} did not start')
+
+
+async def exchange(reader, writer, body):
+    writer.write(b'POST /api/control HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n'
+                 b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    version, status = lines[0].split(' ', 2)[:2]
+    fields = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        fields[name.strip().lower()] = value.strip()
+    if 'content-length' in fields:
+        await reader.readexactly(int(fields['content-length']))
+        keep = version == 'HTTP/1.1' and fields.get('connection', '').lower() != 'close'
+    else:
+        await reader.read()
+        keep = False
+    return int(status), keep
+
+
+async def client(port, body, until, result):
+    conn = None
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await asyncio.open_connection('127.0.0.1', port)
+            status, keep = await asyncio.wait_for(exchange(*conn, body), 30)
+        except Exception:
+            result['failed'] += 1
+            if conn is not None:
+                conn[1].close()
+            conn = None
+            await asyncio.sleep(0.05)
+            continue
+        if status == 200:
+            result['latency'].append(time.perf_counter() - started)
+        else:
+            result[status] = result.get(status, 0) + 1
+            # a client that was turned away backs off like the page would (Retry-After)
+            await asyncio.sleep(0.1)
+        if not keep:
+            conn[1].close()
+            conn = None
+    if conn is not None:
+        conn[1].close()
+
+
+async def load(port, robots, clients, seconds):
+    result = {'latency': [], 'failed': 0}
+    bodies = [json.dumps({'command': 'forward', 'baseUrl': f'http://127.0.0.1:{r}'}).encode() for r in robots]
+    started = time.monotonic()
+    until = started + seconds
+    await asyncio.gather(*(client(port, bodies[i % len(bodies)], until, result) for i in range(clients)))
+    result['elapsed'] = time.monotonic() - started
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--robot-port', type=int, default=8150, help='first mock robot port')
+    parser.add_argument('--robots', type=int, default=4)
+    parser.add_argument('--delay-ms', type=float, default=20, help='mock robot reply delay')
+    parser.add_argument('--proxy-port', type=int, default=8160)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--clients', type=int, nargs='*', default=CLIENTS)
+    args = parser.parse_args()
+
+    robot_ports = [args.robot_port + i for i in range(args.robots)]
+    robots = [start(['mock_robot.py', str(p), str(args.delay_ms)], p) for p in robot_ports]
+    servers = (('threaded', 'workbench/server.py'), ('asyncio', 'workbench/server_async.py'))
+    print(f'{args.robots} mock robots, {args.delay_ms:g} ms per command, {args.seconds:g} s per run')
+    print(f"{'server':<9} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+          f" {'429':>6} {'503':>6} {'failed':>6}")
+    try:
+        for name, script in servers:
+            for clients in args.clients:
+                proxy = start([script, '--port', str(args.proxy_port)], args.proxy_port)
+                try:
+                    r = asyncio.run(load(args.proxy_port, robot_ports, clients, args.seconds))
+                finally:
+                    proxy.kill()
+                    proxy.wait()
+                s = summary_ms(r['latency'])
+                print(f"{name:<9} {clients:>7} {s['n'] / r['elapsed']:>8.0f} {s['p50']:>8.1f} {s['p99']:>8.1f}"
+                      f" {s['max']:>8.1f} {r.get(429, 0):>6} {r.get(503, 0):>6}"
+                      f" {r['failed'] + sum(v for k, v in r.items() if k in (500, 502, 504)):>6}")
+    finally:
+        for proc in robots:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
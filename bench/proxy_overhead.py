@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Per-command overhead of the workbench proxy's connection to the robot.
+
+Forwards a small /control command to mock_robot.py the way
+workbench/server.py did before (urllib, a new connection per command) and
+with its RobotPool (keep-alive, pooled), plus one keep-alive connection
+straight to the mock as the floor. "via proxy" is the whole path
+browser -> workbench/server.py -> mock robot, one request at a time.
+
+Run from the project root:
+    python3 bench/proxy_overhead.py
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from _common import ROOT, summary_ms
+
+sys.path.insert(0, os.path.join(ROOT, 'workbench'))
+from server import RobotPool  # noqa: E402
+
+BODY = json.dumps({'command': 'forward'}).encode()
+HEADERS = {'Content-Type': 'application/json'}
+
+
+def start(args, port):
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args[0]} did not start')
+
+
+def timed(fn, count):
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--robot-port', type=int, default=8140)
+    parser.add_argument('--proxy-port', type=int, default=8141)
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    base_url = f'http://127.0.0.1:{args.robot_port}'
+    robot = start(['mock_robot.py', str(args.robot_port)], args.robot_port)
+    proxy = start(['workbench/server.py', '--port', str(args.proxy_port)], args.proxy_port)
+    try:
+        def before():
+            r = urllib.request.Request(base_url + '/control', data=BODY, method='POST', headers=HEADERS)
+            with urllib.request.urlopen(r, timeout=15) as resp:
+                resp.read()
+
+        pool = RobotPool()
+
+        def after():
+            pool.request(base_url, 'POST', '/control', BODY, HEADERS)
+
+        direct_conn = http.client.HTTPConnection('127.0.0.1', args.robot_port)
+
+        def direct():
+            direct_conn.request('POST', '/control', body=BODY, headers=HEADERS)
+            direct_conn.getresponse().read()
+
+        proxy_conn = http.client.HTTPConnection('127.0.0.1', args.proxy_port)
+        proxy_body = json.dumps({'command': 'forward', 'baseUrl': base_url})
+
+        def via_proxy():
+            proxy_conn.request('POST', '/api/control', body=proxy_body, headers=HEADERS)
+            proxy_conn.getresponse().read()
+
+        print(f"{'path':<22} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, fn in (('direct keep-alive', direct), ('urllib (before)', before),
+                         ('RobotPool (after)', after), ('via proxy (after)', via_proxy)):
+            fn()
+            s = summary_ms(timed(fn, args.requests))
+            print(f"{name:<22} {s['n']:>5} {s['p50']:>8.3f} {s['p95']:>8.3f} {s['p99']:>8.3f} {s['max']:>8.3f}")
+        print('pool:', json.dumps(pool.stats()))
+    finally:
+        for proc in (proxy, robot):
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Request latency of the blocking RobotWifi server vs AsyncRobotWifi.
+
+The robot side runs bench/robot_stand_in.py on the MicroPython Linux port.
+While one client keeps the robot busy with back-to-back gaits and another
+client holds an idle TCP connection open, N clients poll GET /status; we
+report their latency, how many were turned away with 503 (more open
+connections than max_connections) and how many failed or timed out.
+
+Run from the project root:
+    python3 bench/robot_server_latency.py --python micropython
+"""
+import argparse
+import json
+import socket
+import threading
+import time
+
+from _common import request, start_stand_in, stop, summary_ms
+
+MOTION = json.dumps({'command': 'forward', 'params': {'steps': 2, 't': 500}})
+
+
+def run_case(kind, clients, seconds, port, python):
+    proc = start_stand_in(kind, port, python)
+    stop_at = time.monotonic() + seconds
+    latencies = []
+    errors = [0]
+    busy = [0]
+    lock = threading.Lock()
+
+    def motion_loop():
+        while time.monotonic() < stop_at:
+            try:
+                request(port, 'POST', '/control', MOTION, timeout=seconds + 5)
+            except OSError:
+                pass
+
+    def status_loop():
+        while time.monotonic() < stop_at:
+            try:
+                status, _, cost = request(port, 'GET', '/status', timeout=2.0)
+                with lock:
+                    if status == 200:
+                        latencies.append(cost)
+                    elif status == 503:
+                        busy[0] += 1
+                    else:
+                        errors[0] += 1
+            except OSError:
+                with lock:
+                    errors[0] += 1
+            time.sleep(0.05)
+
+    # an idle client that connects and never sends anything
+    idle = socket.create_connection(('127.0.0.1', port))
+    threads = [threading.Thread(target=motion_loop, daemon=True)]
+    threads += [threading.Thread(target=status_loop, daemon=True) for _ in range(clients)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads[1:]:
+            t.join()
+    finally:
+        idle.close()
+        stop(proc)
+    return summary_ms(latencies), busy[0], errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--python', default='micropython', help='interpreter for the robot stand-in')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--clients', default='1,4,8')
+    args = parser.parse_args()
+
+    print(f"{'server':<6} {'clients':>7} {'ok':>5} {'503':>5} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    port = args.port
+    for kind in ('sync', 'async'):
+        for clients in [int(c) for c in args.clients.split(',')]:
+            s, busy, errors = run_case(kind, clients, args.seconds, port, args.python)
+            port += 1
+            print(f"{kind:<6} {clients:>7} {s['n']:>5} {busy:>5} {errors:>6} "
+                  f"{s['p50']:>8.1f} {s['p95']:>8.1f} {s['max']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# -- Linux stand-in for the robot, used by the benchmarks in this directory.
+#
+# Runs the real robot_wifi / robot_wifi_async code on the MicroPython unix
+# port, with a Quad replacement whose motions just sleep for as long as the
+# real gait would take:
+#
+#     micropython bench/robot_stand_in.py async 8080
+#
+# argv: server kind (sync | async), port, optional UDP teleop port ('-' for
+# none), optional serial device (e.g. the slave side of a pseudo-terminal)
+#
+# QUAD_ANNOUNCE=host:port in the environment sends discovery announcements
+# (announce.py) there instead of broadcasting; the stand-in does not listen
+# for queries, so several of them can run on one host.
+
+import os
+import sys
+import time
+
+ROOT = (__file__.rsplit('/', 1)[0] if '/' in __file__ else '.') + '/..'
+sys.path.insert(0, ROOT)
+
+
+def _sleep_ms(ms):
+    if hasattr(time, 'sleep_ms'):
+        time.sleep_ms(int(ms))
+    else:
+        time.sleep(ms / 1000)
+
+
+class StandInQuad:
+    """Quad look-alike: same command names and defaults, no servos.
+
+    Motions sleep in 10 ms ticks and honour cancel() like the real Quad.
+    """
+
+    def __init__(self):
+        self._servo_position = [90] * 8
+        self._cancel = False
+
+    def cancel(self, state=True):
+        self._cancel = state
+
+    def wait(self, ms=500):
+        left = int(ms)
+        while left > 0:
+            if self._cancel:
+                self._cancel = False
+                raise Exception('cancelled')
+            _sleep_ms(min(10, left))
+            left -= 10
+
+    def _angles_from_semantic(self, legs):
+        return [90] * 8
+
+    def play_action(self, action):
+        for duration, angles in action.frames():
+            self.wait(duration)
+            self._servo_position[:] = angles
+        if action.home:
+            self.wait(500)
+            self._servo_position[:] = [90] * 8
+
+    def stream_action(self, frames):
+        self.started_frames = 0
+        for frame in frames:
+            self.started_frames += 1
+            self.wait(frame.get('duration', 500))
+        self.wait(500)
+
+    def set_pose(self, angles):
+        self._servo_position[:] = angles
+
+    def pose(self, out=None):
+        if out is None:
+            out = [0] * 8
+        out[:] = self._servo_position
+        return out
+
+    def getRestState(self):
+        return False
+
+    def gait_pose(self, vx, wz, phase, pose):
+        pose[:] = [90] * 8
+        return pose
+
+    def home(self):
+        self.wait(500)
+
+    def forward(self, steps=3, t=800):
+        self.wait(steps * t)
+
+    def backward(self, steps=3, t=800):
+        self.wait(steps * t)
+
+    def turn_L(self, steps=2, t=1000):
+        self.wait(steps * t)
+
+    def turn_R(self, steps=2, t=1000):
+        self.wait(steps * t)
+
+    def dance(self, steps=3, t=2000):
+        self.wait(steps * t)
+
+    def hello(self):
+        self.wait(1800)
+
+
+def make_server(kind, udp_port=None):
+    html_path = ROOT + '/index.html'
+    if kind == 'async':
+        from robot_wifi_async import AsyncRobotWifi
+        return AsyncRobotWifi(StandInQuad(), html_path=html_path, udp_port=udp_port)
+    from robot_wifi import RobotWifi
+    return RobotWifi(StandInQuad(), html_path=html_path, udp_port=udp_port)
+
+
+if __name__ == '__main__':
+    kind = sys.argv[1] if len(sys.argv) > 1 else 'sync'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8080
+    udp_port = int(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3] != '-' else None
+    server = make_server(kind, udp_port)
+    announce = os.getenv('QUAD_ANNOUNCE')
+    if announce:
+        from announce import Announcer
+        host, _, target_port = announce.rpartition(':')
+        server.name = 'stand-in-%d' % port
+        server.ip = '127.0.0.1'
+        server.announcer = Announcer(server.handle_info_request, None, host, int(target_port))
+    if len(sys.argv) > 4:
+        from serial_link import SerialLink
+        try:
+            device = open(sys.argv[4], 'r+b', buffering=0)
+        except TypeError:
+            device = open(sys.argv[4], 'r+b')
+        SerialLink(server, device).start()
+    server.create_server(port=port)
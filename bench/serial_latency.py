@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Round-trip latency of the USB serial transport vs HTTP /control.
+
+The stand-in robot (bench/robot_stand_in.py) serves HTTP on a port and the
+serial protocol (serial_link.py) on the slave side of a pseudo-terminal;
+this script talks to the master side through workbench/proxy.py's
+SerialBridge, so both ends run the shipped code. Each request is a
+one-frame customize_action (10 ms, home pose, no trailing home move) or a
+status query, one at a time; HTTP uses one keep-alive connection.
+
+A pseudo-terminal has no baud rate, so on Linux the serial numbers are the
+protocol and parser cost only. On hardware, --robot / --serial measure the
+real link (115200 baud is about 11.5 bytes per ms).
+
+Run from the project root:
+    python3 bench/serial_latency.py --python micropython
+    python3 bench/serial_latency.py --robot 192.168.2.182 --serial /dev/ttyUSB0
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+import tty
+
+from _common import ROOT, start_stand_in, stop, summary_ms
+
+sys.path.insert(0, os.path.join(ROOT, 'workbench'))
+from proxy import SERIAL_CONTROL, SERIAL_STATUS, SerialBridge, to_binary  # noqa: E402
+
+FRAME = [{'duration': 10, 'angles': [90] * 8}]
+JSON_BODY = json.dumps({'command': 'customize_action', 'params': FRAME}).encode()
+BINARY_BODY = to_binary('customize_action', FRAME)
+
+
+def time_http(host, port, method, path, body, content_type, count):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        conn.request(method, path, body=body, headers={'Content-Type': content_type} if body else {})
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            raise RuntimeError(f'HTTP {resp.status}')
+        latencies.append(time.perf_counter() - t0)
+    conn.close()
+    return latencies
+
+
+def time_serial(bridge, kind, body, count):
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        reply = json.loads(bridge.request(body, kind))
+        if reply.get('status') != '200':
+            raise RuntimeError(f'serial reply {reply}')
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--python', default='micropython', help='interpreter for the robot stand-in')
+    parser.add_argument('--kind', default='sync', choices=('sync', 'async'))
+    parser.add_argument('--port', type=int, default=8130)
+    parser.add_argument('--robot', help='benchmark a real robot at this address (needs --serial)')
+    parser.add_argument('--serial', help='serial port of the real robot')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    proc = None
+    if args.robot:
+        host, port = args.robot, 80
+        bridge = SerialBridge(args.serial, args.baud)
+    else:
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        host, port = '127.0.0.1', args.port
+        proc = start_stand_in(args.kind, port, args.python, serial=os.ttyname(slave))
+        os.close(slave)
+        bridge = SerialBridge('pty', args.baud, fd=master)
+
+    n = args.requests
+    cases = [
+        ('http', 'status', lambda: time_http(host, port, 'GET', '/status', None, None, n)),
+        ('serial', 'status', lambda: time_serial(bridge, SERIAL_STATUS, b'', n)),
+        ('http', 'json', lambda: time_http(host, port, 'POST', '/control', JSON_BODY, 'application/json', n)),
+        ('serial', 'json', lambda: time_serial(bridge, SERIAL_CONTROL, JSON_BODY, n)),
+        ('http', 'binary', lambda: time_http(host, port, 'POST', '/control', BINARY_BODY,
+                                             'application/x-quad', n)),
+        ('serial', 'binary', lambda: time_serial(bridge, SERIAL_CONTROL, BINARY_BODY, n)),
+    ]
+    print(f"{'transport':<9} {'request':<8} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    try:
+        for transport, name, run in cases:
+            s = summary_ms(run())
+            print(f"{transport:<9} {name:<8} {s['n']:>5} {s['p50']:>8.2f} {s['p95']:>8.2f} "
+                  f"{s['p99']:>8.2f} {s['max']:>8.2f}")
+    finally:
+        if proc is not None:
+            stop(proc)
+
+
+if __name__ == '__main__':
+    main()
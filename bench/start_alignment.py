@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+How closely N robots start a fanned-out command, with and without a
+synchronized start time.
+
+Starts N mock_robot.py instances (each with its own random ticks_ms()
+offset, and --jitter-ms of random delay per request standing in for WiFi)
+and workbench/server.py. Every round sends one /api/control to
+all robots, once as a plain fan-out (each robot starts when its request
+arrives) and once with "startIn" (each robot holds until its own tick
+computed from the synchronized clock). The spread is the difference
+between the earliest and latest "started" wall clock the mocks report;
+"error" is the server's own bound (sync_error_ms).
+
+Run from the project root:
+    python3 bench/start_alignment.py
+"""
+import argparse
+import http.client
+import json
+import socket
+import subprocess
+import sys
+import time
+
+from _common import ROOT, summary_ms
+
+HEADERS = {'Content-Type': 'application/json'}
+
+
+def start(args, port):
+    proc = subprocess.Popen([sys.executable] + args, cwd=ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args[0]} did not start')
+
+
+def post(conn, body):
+    conn.request('POST', '/api/control', body=json.dumps(body), headers=HEADERS)
+    resp = conn.getresponse()
+    return json.loads(resp.read())
+
+
+def spread(reply):
+    started = [r['reply']['started'] for r in reply['robots'] if r.get('ok')]
+    return (max(started) - min(started)) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--robots', type=int, default=8)
+    parser.add_argument('--robot-port', type=int, default=8280, help='first mock robot port')
+    parser.add_argument('--proxy-port', type=int, default=8279)
+    parser.add_argument('--server', default='workbench/server.py', help='or workbench/server_async.py')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='mock robot delay jitter')
+    parser.add_argument('--start-in', type=float, default=200, help='ms ahead for the timed start')
+    parser.add_argument('--rounds', type=int, default=30)
+    args = parser.parse_args()
+
+    urls = [f'http://127.0.0.1:{args.robot_port + i}' for i in range(args.robots)]
+    robots = [start(['mock_robot.py', str(args.robot_port + i), '0', str(args.jitter_ms)], args.robot_port + i)
+              for i in range(args.robots)]
+    proxy = start([args.server, '--port', str(args.proxy_port)], args.proxy_port)
+    conn = http.client.HTTPConnection('127.0.0.1', args.proxy_port)
+    try:
+        post(conn, {'command': 'forward', 'baseUrls': urls, 'startIn': args.start_in})    # first clock sync
+        plain, timed, errors = [], [], []
+        for _ in range(args.rounds):
+            plain.append(spread(post(conn, {'command': 'forward', 'baseUrls': urls})))
+            reply = post(conn, {'command': 'forward', 'baseUrls': urls, 'startIn': args.start_in})
+            timed.append(spread(reply))
+            errors.append(reply['sync_error_ms'] / 1000)
+        print(f'{args.robots} robots, {args.jitter_ms:g} ms jitter, {args.rounds} rounds  (ms)')
+        print(f"{'mode':<10} {'spread p50':>10} {'spread max':>10}")
+        for mode, samples in (('fan-out', plain), ('startIn', timed)):
+            s = summary_ms(samples)
+            print(f"{mode:<10} {s['p50']:>10.2f} {s['max']:>10.2f}")
+        e = summary_ms(errors)
+        print(f"{'error':<10} {e['p50']:>10.2f} {e['max']:>10.2f}  (bound reported by the server)")
+    finally:
+        conn.close()
+        for proc in [proxy] + robots:
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Bytes and time per workbench page load.
+
+"before" is SimpleHTTPRequestHandler (python3 -m http.server), which is
+what workbench/server.py used for static files: the file is read from
+disk on every request, sent uncompressed, on a new connection each time.
+"after" is workbench/server.py with its StaticCache: gzip, a 304 when
+the browser revalidates with If-None-Match, and keep-alive.
+
+Run from the project root:
+    python3 bench/static_assets.py
+"""
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from _common import ROOT, summary_ms
+
+PAGES = ('/index.html', '/index-apple.html')
+
+
+def start(args, port, cwd):
+    proc = subprocess.Popen([sys.executable] + args, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'{args} did not start')
+
+
+def loads(port, path, count, headers, keep_alive):
+    """``count`` GETs of ``path``: (latencies, bytes of the last body, status)."""
+    latencies = []
+    conn = None
+    for _ in range(count):
+        t0 = time.perf_counter()
+        if conn is None:
+            conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        body = resp.read()
+        latencies.append(time.perf_counter() - t0)
+        if not keep_alive or resp.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+    return latencies, len(body), resp.status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--before-port', type=int, default=8170)
+    parser.add_argument('--after-port', type=int, default=8171)
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    workbench = os.path.join(ROOT, 'workbench')
+    before = start(['-m', 'http.server', str(args.before_port), '--bind', '127.0.0.1'], args.before_port, workbench)
+    after = start([os.path.join(workbench, 'server.py'), '--port', str(args.after_port)], args.after_port, ROOT)
+    try:
+        probe = http.client.HTTPConnection('127.0.0.1', args.after_port)
+        etags = {}
+        for path in PAGES:
+            probe.request('GET', path)
+            resp = probe.getresponse()
+            resp.read()
+            etags[path] = resp.getheader('ETag')
+        probe.close()
+
+        cases = (
+            ('before', args.before_port, {}, False),
+            ('after, identity', args.after_port, {}, True),
+            ('after, gzip', args.after_port, {'Accept-Encoding': 'gzip, deflate, br'}, True),
+            ('after, revalidate', args.after_port, 'etag', True),
+        )
+        print(f"{'page':<18} {'case':<18} {'status':>6} {'bytes':>7} {'p50 ms':>8} {'p99 ms':>8}")
+        for path in PAGES:
+            for name, port, headers, keep_alive in cases:
+                if headers == 'etag':
+                    headers = {'Accept-Encoding': 'gzip, deflate, br', 'If-None-Match': etags[path]}
+                loads(port, path, 5, headers, keep_alive)
+                latencies, size, status = loads(port, path, args.requests, headers, keep_alive)
+                s = summary_ms(latencies)
+                print(f"{path:<18} {name:<18} {status:>6} {size:>7} {s['p50']:>8.3f} {s['p99']:>8.3f}")
+    finally:
+        for proc in (before, after):
+            proc.kill()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
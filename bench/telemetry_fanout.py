@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Cost of N browser tabs watching one robot's pose telemetry.
+
+Starts the stand-in robot and workbench/server.py, opens N SSE viewers on
+/api/telemetry while the robot walks, and reports how many GET /pose
+queries the robot served (should not grow with N), the events each viewer
+got and how old a snapshot was when it reached the viewer.
+
+Run from the project root:
+    python3 bench/telemetry_fanout.py --python micropython
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from _common import ROOT, request, start_stand_in, stop, summary_ms
+
+
+def start_workbench(port, hz):
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'workbench', 'server.py'),
+                             '--port', str(port), '--telemetry-hz', str(hz)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('workbench did not start')
+
+
+def viewer(port, robot_url, hz, stop_at, events, ages):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=20)
+    conn.request('GET', f'/api/telemetry?robot={robot_url}&hz={hz}')
+    resp = conn.getresponse()
+    while time.monotonic() < stop_at:
+        line = resp.fp.readline()
+        if not line:
+            break
+        if line.startswith(b'data: '):
+            snapshot = json.loads(line[6:])
+            events.append(1)
+            ages.append(time.time() - snapshot['received'])
+    conn.close()
+
+
+def run_case(viewers, seconds, port, robot_url, robot_port, hz, viewer_hz):
+    before = json.loads(request(port, 'GET', '/api/stats')[1])
+    request(robot_port, 'POST', '/control', json.dumps({'command': 'forward', 'params': {'steps': 20}, 'async': True}))
+    events, ages = [], []
+    stop_at = time.monotonic() + seconds
+    threads = [threading.Thread(target=viewer, args=(port, robot_url, viewer_hz, stop_at, events, ages))
+               for _ in range(viewers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    request(robot_port, 'POST', '/control', json.dumps({'command': 'stop'}))
+    after = json.loads(request(port, 'GET', '/api/stats')[1])
+    polls = after['telemetry'][robot_url]['polls'] - before.get('telemetry', {}).get(robot_url, {}).get('polls', 0)
+    return polls, len(events), summary_ms(ages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--python', default='micropython', help='interpreter for the robot stand-in')
+    parser.add_argument('--port', type=int, default=8150)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--hz', type=float, default=10.0, help='robot polls per second')
+    parser.add_argument('--viewer-hz', type=float, default=5.0, help='events per second each viewer asks for')
+    parser.add_argument('--viewers', default='1,10,50')
+    args = parser.parse_args()
+
+    robot_port = args.port
+    robot_url = f'http://127.0.0.1:{robot_port}'
+    robot = start_stand_in('sync', robot_port, args.python)
+    workbench = start_workbench(args.port + 1, args.hz)
+    print(f"{'viewers':>7} {'robot polls':>11} {'polls/s':>8} {'events':>7} {'ev/viewer/s':>11} "
+          f"{'age p50 ms':>10} {'age p99 ms':>10}")
+    try:
+        for n in [int(v) for v in args.viewers.split(',')]:
+            polls, events, age = run_case(n, args.seconds, args.port + 1, robot_url, robot_port,
+                                          args.hz, args.viewer_hz)
+            print(f"{n:>7} {polls:>11} {polls / args.seconds:>8.1f} {events:>7} "
+                  f"{events / n / args.seconds:>11.1f} {age['p50']:>10.1f} {age['p99']:>10.1f}")
+            time.sleep(1)
+    finally:
+        stop(workbench)
+        stop(robot)
+
+
+if __name__ == '__main__':
+    main()
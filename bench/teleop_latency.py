@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Latency and jitter of the UDP teleop channel vs HTTP /control.
+
+The robot side runs bench/robot_stand_in.py with the teleop listener on.
+UDP: pose datagrams are sent at --rate Hz with the ack flag; the robot
+acks each datagram in the control tick that applied it, so send -> ack is
+the full command latency including waiting for the tick. Every 10th send
+is followed by a stale copy (older sequence number) that must never be
+acked. HTTP: a one-frame customize_action over a keep-alive connection,
+one request at a time. The frame is the home pose, otherwise every request
+would also include the 500 ms move back home.
+
+Run from the project root:
+    python3 bench/teleop_latency.py --python micropython
+"""
+import argparse
+import http.client
+import json
+import socket
+import statistics
+import struct
+import threading
+import time
+
+from _common import start_stand_in, stop, summary_ms
+
+MAGIC = 0x54
+POSE = 2
+ACK = 3
+ACK_REQUEST = 0x80
+HEADER_FMT = '<BBI'
+
+
+def pose_datagram(seq, angles, ack=True):
+    kind = POSE | (ACK_REQUEST if ack else 0)
+    return struct.pack(HEADER_FMT, MAGIC, kind, seq) + bytes(angles) + b'\0\0'
+
+
+def run_udp(udp_port, rate, seconds):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    sent = {}
+    acked = {}      # seq -> ack arrival times
+    stale = {}      # seq -> send time of its stale copy
+    done = threading.Event()
+
+    def receiver():
+        while not done.is_set():
+            try:
+                data, _ = sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            now = time.perf_counter()
+            magic, kind, seq = struct.unpack_from(HEADER_FMT, data)
+            if magic == MAGIC and kind == ACK:
+                acked.setdefault(seq, []).append(now)
+
+    thread = threading.Thread(target=receiver, daemon=True)
+    thread.start()
+    target = ('127.0.0.1', udp_port)
+    interval = 1 / rate
+    seq = 1000
+    next_send = time.perf_counter()
+    stop_at = next_send + seconds
+    while next_send < stop_at:
+        angles = [90 + (seq % 20)] * 8
+        sent[seq] = time.perf_counter()
+        sock.sendto(pose_datagram(seq, angles), target)
+        if seq % 10 == 0:
+            # reordered copy of an older setpoint, must be dropped
+            stale[seq - 5] = time.perf_counter()
+            sock.sendto(pose_datagram(seq - 5, [0] * 8), target)
+        seq += 1
+        next_send += interval
+        time.sleep(max(0, next_send - time.perf_counter()))
+    time.sleep(0.3)
+    done.set()
+    thread.join()
+    sock.close()
+    latencies = [acked[s][0] - sent[s] for s in sent if s in acked]
+    stale_applied = sum(1 for s, t in stale.items() if any(a > t for a in acked.get(s, ())))
+    return latencies, len(sent), stale_applied
+
+
+def run_http(port, count):
+    body = json.dumps({'command': 'customize_action', 'params': [{'duration': 10, 'angles': [90] * 8}]})
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        conn.request('POST', '/control', body=body, headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        resp.read()
+        latencies.append(time.perf_counter() - t0)
+    conn.close()
+    return latencies
+
+
+def report(name, latencies, sent):
+    s = summary_ms(latencies)
+    jitter = statistics.pstdev(latencies) * 1000 if len(latencies) > 1 else float('nan')
+    print(f"{name:<12} {sent:>6} {s['n']:>6} {s['p50']:>8.1f} {s['p95']:>8.1f} {s['p99']:>8.1f} "
+          f"{s['max']:>8.1f} {jitter:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--python', default='micropython', help='interpreter for the robot stand-in')
+    parser.add_argument('--kind', default='async', choices=('sync', 'async'))
+    parser.add_argument('--port', type=int, default=8120)
+    parser.add_argument('--udp-port', type=int, default=8888)
+    parser.add_argument('--rate', type=float, default=50.0, help='UDP setpoints per second')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--http-requests', type=int, default=100)
+    args = parser.parse_args()
+
+    proc = start_stand_in(args.kind, args.port, args.python, udp_port=args.udp_port)
+    try:
+        print(f"{'channel':<12} {'sent':>6} {'acked':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'max ms':>8} {'jitter':>8}")
+        latencies, sent, stale_applied = run_udp(args.udp_port, args.rate, args.seconds)
+        report('udp', latencies, sent)
+        time.sleep(1.5)   # let the teleop session time out and the robot go home
+        report('http', run_http(args.port, args.http_requests), args.http_requests)
+        print(f'stale datagrams applied: {stale_applied}')
+    finally:
+        stop(proc)
+
+
+if __name__ == '__main__':
+    main()
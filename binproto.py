@@ -0,0 +1,96 @@
+# -- 二进制控制协议
+#
+# JSON 的 customize_action 帧 {"duration": 400, "angles": [...8 个数...]} 每帧
+# 约 60 字节, ESP32 上 json.loads 还要为每帧分配 dict 和 list。POST /control
+# 带 Content-Type: application/x-quad 时, 请求体是下面的紧凑格式, 用
+# struct.unpack_from 直接从接收缓冲区解码, 不生成中间对象:
+#
+#     头部 6 字节 (小端):  b'Q' | version u8 | command id u8 | flags u8 | count u16
+#     customize_action:    count 帧, 每帧 10 字节: duration u16 | 8 x 角度 u8
+#     其它命令:            count 个 int16 位置参数 (如 forward 的 steps, t)
+#
+# 命令 id 是 COMMANDS 里的下标, 只能在末尾追加, 不能改顺序。回复仍然是 JSON。
+
+import struct
+
+CONTENT_TYPE = 'application/x-quad'
+MAGIC = 0x51           # 'Q', JSON 请求体不可能以它开头
+VERSION = 1
+HEADER_FMT = '<BBBBH'
+HEADER_SIZE = 6
+FRAME_FMT = '<H8B'
+FRAME_SIZE = 10
+ARG_SIZE = 2
+
+FLAG_ASYNC = 0x01      # 同 JSON 的 "async": true, 立即回复 202
+
+COMMANDS = (
+    'stop', 'home', 'customize_action',
+    'forward', 'backward', 'turn_L', 'turn_R', 'omni_walk',
+    'dance', 'front_back', 'moonwalk_L', 'up_down', 'push_up',
+    'hello', 'wave_hand', 'hide', 'scared', 'relax', 'relax2',
+    'frog_jump', 'walk', 'replay',
+)
+CUSTOMIZE_ACTION = 2
+
+
+def is_binary(body):
+    return len(body) > 0 and body[0] == MAGIC
+
+
+def decode_header(body):
+    """Return ``(command, flags, count)`` for a binary request body."""
+    if len(body) < HEADER_SIZE:
+        raise ValueError('binary request too short')
+    magic, version, command_id, flags, count = struct.unpack_from(HEADER_FMT, body)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('bad binary request header')
+    if command_id >= len(COMMANDS):
+        raise ValueError('unknown command id ' + str(command_id))
+    size = FRAME_SIZE if command_id == CUSTOMIZE_ACTION else ARG_SIZE
+    if len(body) != HEADER_SIZE + count * size:
+        raise ValueError('binary request length does not match count')
+    return COMMANDS[command_id], flags, count
+
+
+def frames(body, count):
+    """Yield ``(duration, angles)`` per packed frame.
+
+    ``angles`` is a memoryview into ``body``, valid as long as ``body`` is.
+    """
+    mv = memoryview(body)
+    off = HEADER_SIZE
+    for _ in range(count):
+        duration = mv[off] | (mv[off + 1] << 8)
+        angles = mv[off + 2:off + FRAME_SIZE]
+        for a in angles:
+            if a > 180:
+                raise ValueError('angle out of range')
+        yield duration if duration > 0 else 500, angles
+        off += FRAME_SIZE
+
+
+def args(body, count):
+    """Return the positional int16 arguments of a non-frame command."""
+    return struct.unpack_from('<' + 'h' * count, body, HEADER_SIZE)
+
+
+def encode(command, params=None, flags=0):
+    """Encode one command (JSON-style ``params``) as a binary request body.
+
+    ``params`` is the frame list for customize_action (``angles`` frames
+    only) or a tuple of positional arguments for the other commands.
+    """
+    command_id = COMMANDS.index(command)
+    if command_id == CUSTOMIZE_ACTION:
+        params = params or []
+        body = bytearray(HEADER_SIZE + FRAME_SIZE * len(params))
+        struct.pack_into(HEADER_FMT, body, 0, MAGIC, VERSION, command_id, flags, len(params))
+        off = HEADER_SIZE
+        for frame in params:
+            struct.pack_into(FRAME_FMT, body, off, frame.get('duration', 500), *frame['angles'])
+            off += FRAME_SIZE
+        return bytes(body)
+    params = tuple(params or ())
+    return (struct.pack(HEADER_FMT, MAGIC, VERSION, command_id, flags, len(params)) +
+            struct.pack('<' + 'h' * len(params), *params))
@@ -0,0 +1,118 @@
+# -- 快速启动: WiFi 关联的同时初始化舵机并回到 home
+#
+# 原来 main.py 先初始化舵机, 再在 create_connect_route 里每秒 sleep 一次等
+# wlan.isconnected(), 关联期间机器人什么也不做, 就绪时间还被取整到整秒。
+# 这里把 WiFi 拆成 "开始连接" 和 "等待连接" 两步: wlan.connect() 立即返回,
+# 关联和 DHCP 由 WiFi 驱动在后台完成, 期间主线程初始化舵机和服务器, home
+# 动作交给动作线程执行; 等待时每 CONNECT_POLL_MS 查询一次, 连不上路由器
+# (超时或密码错误) 时退回 AP 模式。BootTimer 记录每个阶段的起止时间。
+
+import utime
+
+CONNECT_POLL_MS = 50
+CONNECT_TIMEOUT_MS = 10000
+PROGRESS_MS = 1000      # 等待连接时多久打印一次进度
+LED_PIN = 2
+
+
+class BootTimer:
+    """Time-to-ready broken down by phase, in ms since the timer was created.
+
+    Phases may overlap (WiFi association runs while the servos home), so
+    each one is recorded as ``(name, begin, end)``.
+    """
+
+    def __init__(self):
+        self.t0 = utime.ticks_ms()
+        self.phases = []
+        self.ready = None
+
+    def now(self):
+        return utime.ticks_diff(utime.ticks_ms(), self.t0)
+
+    def done(self, name, began):
+        self.phases.append((name, began, self.now()))
+
+    def timed(self, name, fn, *args):
+        """Call ``fn(*args)`` and record it as phase ``name`` (usable as a job)."""
+        began = self.now()
+        try:
+            return fn(*args)
+        finally:
+            self.done(name, began)
+
+    def finish(self):
+        self.ready = self.now()
+        return self.ready
+
+    def report(self):
+        parts = ['%s %d-%d' % phase for phase in self.phases]
+        return 'boot: ' + ', '.join(parts) + ', ready %s ms' % self.ready
+
+    def to_dict(self):
+        return {"ready_ms": self.ready,
+                "phases": [{"name": n, "begin_ms": b, "end_ms": e} for n, b, e in self.phases]}
+
+
+def _led_on():
+    import machine
+    machine.PWM(machine.Pin(LED_PIN), duty=512)
+
+
+def start_station(ssid, password, ifconfig=None):
+    """Start STA association and return the WLAN without waiting for it."""
+    import network
+    wlan = network.WLAN(network.STA_IF)
+    if ifconfig:
+        # 自定义固定的 ip 在址，否则每次连接的 ip 可能会不一样
+        wlan.ifconfig(ifconfig)
+    wlan.active(True)
+    if not wlan.isconnected():
+        print('connecting to network...')
+        wlan.connect(ssid, password)
+    return wlan
+
+
+def wait_station(wlan, timeout_ms=CONNECT_TIMEOUT_MS, poll_ms=CONNECT_POLL_MS):
+    """Poll ``wlan`` until it is connected, returns its ip.
+
+    Returns None after ``timeout_ms`` (None = wait forever) or as soon as
+    the driver reports a wrong password.
+    """
+    import network
+    wrong_password = getattr(network, 'STAT_WRONG_PASSWORD', None)
+    start = utime.ticks_ms()
+    progress = start
+    while not wlan.isconnected():
+        now = utime.ticks_ms()
+        waited = utime.ticks_diff(now, start)
+        if wrong_password is not None and wlan.status() == wrong_password:
+            print('wifi: wrong password')
+            return None
+        if timeout_ms is not None and waited >= timeout_ms:
+            print('wifi: not connected after %d ms' % waited)
+            wlan.active(False)
+            return None
+        if utime.ticks_diff(now, progress) >= PROGRESS_MS:
+            progress = now
+            print("正在链接...{:.1f}s".format(waited / 1000))
+        utime.sleep_ms(poll_ms)
+    _led_on()
+    ip = wlan.ifconfig()[0]
+    print("ip:", ip)
+    return ip
+
+
+def start_ap(essid, password, ifconfig=None):
+    """Create the access point, returns its ip."""
+    import network
+    ap = network.WLAN(network.AP_IF)
+    if ifconfig:
+        ap.ifconfig(ifconfig)
+    ap.active(True)
+    ap.config(essid=essid, password=password, authmode=network.AUTH_WPA_WPA2_PSK)
+    print('Access Point created!')
+    _led_on()
+    ip = ap.ifconfig()[0]
+    print("ip:", ip)
+    return ip
@@ -19,21 +19,55 @@
 """
 
 
+from announce import Announcer
+from fastboot import BootTimer, start_ap, start_station, wait_station
 from quad import Quad
 from robot_wifi import RobotWifi
 
 ifconfig = ("192.168.2.182", "255.255.255.0", "192.168.2.1", "8.8.8.8")
+# 工作台的机器人列表里显示的名字, 多台机器人时每台起一个不同的
+name = "quad"
 
+timer = BootTimer()
+
+# 路由模式(局域网内的手机或电脑都可以通过 wifi 控制机器人)
+# 先开始连接, 关联和 DHCP 在后台进行, 同时初始化舵机和服务器
+wlan = start_station(ssid='ChinaNet-xxDzA4-5G', password='zybb9352', ifconfig=ifconfig)
+
+began = timer.now()
 robot = Quad()
 robot.init(12, 16, 25, 18, 13, 17, 26, 19)
 robot.setTrims(0, 0, 0, 0, 0, 0, 0, 0)
+timer.done('attach', began)
 
-robot_wifi = RobotWifi(robot=robot)
+began = timer.now()
+robot_wifi = RobotWifi(robot=robot, name=name)
+# 异步服务器(运动期间也能响应其他请求, 需要上传 robot_wifi_async.py)
+# from robot_wifi_async import AsyncRobotWifi
+# robot_wifi = AsyncRobotWifi(robot=robot, name=name)
+timer.done('server', began)
 
-# AP模式(没有路由使用这种模式, 这时候 esp32 变成了一个热点, 手机或电脑连接这个热点, 即可控制机器人)
-# robot_wifi.create_connect_ap(essid="Otto", password="88889999", ifconfig=ifconfig)
+# 回到 home 在动作线程上执行, 与等待 wifi 同时进行
+home = robot_wifi.jobs.submit('home', timer.timed, 'home', robot.home)
 
-# 路由模式(局域网内的手机或电脑都可以通过 wifi 控制机器人)
-robot_wifi.create_connect_route(ssid='ChinaNet-xxDzA4-5G', password='zybb9352', ifconfig=ifconfig)
+ip = wait_station(wlan)
+timer.done('wifi', 0)
+if ip is None:
+    # AP模式(连不上路由时, esp32 变成了一个热点, 手机或电脑连接这个热点, 即可控制机器人)
+    began = timer.now()
+    start_ap(essid="Otto", password="88889999", ifconfig=ifconfig)
+    timer.done('ap', began)
+robot_wifi.ip = ip or ifconfig[0]
+# 局域网发现: 定时广播名字和地址, 工作台自动列出这台机器人 (见 announce.py)
+robot_wifi.announcer = Announcer(robot_wifi.handle_info_request)
+
+# USB 串口控制 (wifi 拥挤时用, 见 serial_link.py; 启用后 Ctrl-C 不再回到 REPL)
+# from serial_link import SerialLink
+# SerialLink(robot_wifi).start()
+
+robot_wifi.jobs.wait(home)
+timer.finish()
+print(timer.report())
+robot_wifi.boot = timer
 
 robot_wifi.create_server()
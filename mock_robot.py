@@ -1,27 +1,80 @@
 #!/usr/bin/env python3
 """
 Mock Robot Server — simulates robot_wifi.py without actual hardware.
-Run:  python3 mock_robot.py
+Run:  python3 mock_robot.py [[host:]port] [delay_ms] [jitter_ms]
+(delay_ms: 每条命令回复前等待的时间, 模拟动作执行;
+ jitter_ms: 每个请求先随机等待 0..jitter_ms, 模拟 WiFi 的延迟抖动)
+GET /info, GET /clock and "at" behave like robot_wifi.py; ticks start at a random
+offset, like a robot booted at some other time.
 Then hit the 📡 button in the Sim (set robot URL to http://localhost:8080).
 """
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import json
+import random
+import sys
+import time
+
+import binproto
+from binproto import COMMANDS
+
+DELAY = 0.0
+JITTER = 0.0
+TICKS_PERIOD = 1 << 30
+TICKS_OFFSET = random.randrange(TICKS_PERIOD)
+
+
+def ticks_ms():
+    return (int(time.monotonic() * 1000) + TICKS_OFFSET) % TICKS_PERIOD
+
+
+def ticks_diff(a, b):
+    return (a - b + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
 
 HIP_MAP = {140:'forward_max', 115:'forward', 90:'neutral', 65:'backward', 40:'backward_max'}
 KNEE_MAP = {150:'retracted_max', 120:'retracted', 90:'neutral', 60:'extended', 30:'extended_max'}
 JOINT_NAMES = ['FR_Hip','FL_Hip','FL_Knee','FR_Knee','BR_Hip','BL_Hip','BR_Knee','BL_Knee']
 MAPS = [HIP_MAP,HIP_MAP,KNEE_MAP,KNEE_MAP,HIP_MAP,HIP_MAP,KNEE_MAP,KNEE_MAP]
 
+
+def decode(raw):
+    """Request body as the JSON dict; binproto bodies are decoded like robot_wifi.py does."""
+    if not binproto.is_binary(raw):
+        return json.loads(raw)
+    command, flags, count = binproto.decode_header(raw)
+    if command == 'customize_action':
+        params = [{'duration': d, 'angles': list(a)} for d, a in binproto.frames(raw, count)]
+    else:
+        params = dict(zip(('steps', 't'), binproto.args(raw, count)))
+    return {'command': command, 'params': params, 'async': bool(flags & binproto.FLAG_ASYNC)}
+
+
 class RobotHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'      # keep-alive, like robot_wifi.py
+    disable_nagle_algorithm = True     # 头和 body 分两次写, 否则要等 delayed ACK
+
     def do_POST(self):
+        if JITTER:
+            time.sleep(random.uniform(0, JITTER))
         length = int(self.headers.get('Content-Length', 0))
-        body = json.loads(self.rfile.read(length))
+        try:
+            body = decode(self.rfile.read(length))
+        except ValueError as e:
+            resp = json.dumps({"status": "400", "msg": str(e)}).encode()
+            self.send_response(400)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(resp)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(resp)
+            return
         command = body.get('command')
         params  = body.get('params')
 
         print(f"\n{'='*50}")
         print(f"📨 Command: {command}")
-        if params:
+        if isinstance(params, dict):
+            print(f"  params: {params}")
+        elif params:
             for i, frame in enumerate(params):
                 angles = frame.get('angles', [])
                 dur    = frame.get('duration', '?')
@@ -30,24 +83,56 @@ class RobotHandler(BaseHTTPRequestHandler):
                 print(f"  Frame {i+1} ({dur}ms): {' | '.join(pairs)}")
         print(f"{'='*50}")
 
-        resp = json.dumps({"status": "200", "msg": command}).encode()
+        at = body.get('at')
+        if at is not None:
+            time.sleep(max(0, ticks_diff(at, ticks_ms())) / 1000)
+        # started: 动作开始的墙钟时间 (ms), 对比多台 mock 的启动时刻用
+        started = time.time() * 1000
+        if DELAY:
+            time.sleep(DELAY)
+        resp = json.dumps({"status": "200", "msg": command, "started": started}).encode()
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(resp)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
         self.wfile.write(resp)
 
+    def do_GET(self):
+        if JITTER:
+            time.sleep(random.uniform(0, JITTER))
+        if self.path == '/clock':
+            reply = {"status": "200", "t": ticks_ms()}
+        elif self.path == '/info':
+            host, port = self.server.server_address[:2]
+            reply = {"status": "200", "robot": "quad", "name": f"mock-{host}-{port}", "ip": host, "port": port,
+                     "firmware": "mock", "commands": list(COMMANDS)}
+        else:
+            self.send_error(404)
+            return
+        resp = json.dumps(reply).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(resp)))
+        self.end_headers()
+        self.wfile.write(resp)
+
     def do_OPTIONS(self):      # CORS preflight
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def log_message(self, *_): pass   # 静默 access log
 
 if __name__ == '__main__':
-    server = HTTPServer(('0.0.0.0', 8080), RobotHandler)
-    print("🤖 Mock Robot Server running at http://localhost:8080")
-    print("   → Set robot URL in Sim to: http://localhost:8080")
+    host, _, port = (sys.argv[1] if len(sys.argv) > 1 else '8080').rpartition(':')
+    host, port = host or '0.0.0.0', int(port)
+    DELAY = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    JITTER = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0
+    server = ThreadingHTTPServer((host, port), RobotHandler)
+    print(f"🤖 Mock Robot Server running at http://localhost:{port}")
+    print(f"   → Set robot URL in Sim to: http://localhost:{port}")
     server.serve_forever()
@@ -0,0 +1,241 @@
+# -- 动作队列
+#
+# 步态函数 (Quad.forward 等) 是阻塞的 while 循环。所有动作都放进一个有界
+# 队列, 由单独的线程按顺序执行, HTTP 服务器因此可以立即返回 job id, 并在
+# 机器人运动时继续应答 OPTIONS / GET / status。Quad 的控制循环每个 tick 都会
+# sleep_ms(1) 把 CPU 让给服务器线程, 并检查 cancel 标志: stop() 会在下一个
+# tick 打断正在运行的动作, 清空队列, 然后回到安全姿态 (home)。
+
+import _thread
+import utime
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+STACK_SIZE = 16 * 1024
+QUEUE_SIZE = 8
+KEEP_FINISHED = 16
+IDLE_MS = 5
+POLL_S = 0.01
+HOLD_STEP_MS = 10
+
+# 动作时长估计 (ms), 用于 503 的 Retry-After: 步态为 (默认 steps, 默认 t)
+GAIT_DEFAULTS = {
+    'forward': (3, 800), 'backward': (3, 800),
+    'turn_L': (2, 1000), 'turn_R': (2, 1000), 'omni_walk': (2, 1000),
+    'dance': (3, 2000), 'front_back': (2, 1000), 'moonwalk_L': (4, 2000),
+    'up_down': (2, 2000), 'push_up': (2, 2000), 'wave_hand': (3, 2000),
+    'hide': (1, 2000),
+}
+FIXED_MS = {'home': 500, 'hello': 1800, 'scared': 2600, 'relax': 1500}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+
+def estimate_ms(command, params=None):
+    """Rough duration of ``command`` with /control ``params``, None when unknown."""
+    if command in FIXED_MS:
+        return FIXED_MS[command]
+    if not isinstance(params, dict):
+        params = {}
+    try:
+        if command in GAIT_DEFAULTS:
+            steps, t = GAIT_DEFAULTS[command]
+            return int(float(params.get('steps', steps)) * float(params.get('t', t)))
+        if command == 'frog_jump':
+            return int(float(params.get('steps', 3))) * 1150 + 500
+    except (TypeError, ValueError, OverflowError):
+        # 参数类型不对: 估计不了, 由动作本身报错 (job 500)
+        pass
+    return None
+
+
+def scheduled(robot, at, fn, *args):
+    """Job body for a timed start: hold until ``utime.ticks_ms()`` reaches ``at``, then ``fn(*args)``.
+
+    stop() still preempts the hold (robot.wait checks cancel); the last
+    few ms are a plain sleep_ms so the motion starts on the right tick.
+    """
+    while utime.ticks_diff(at, utime.ticks_ms()) > HOLD_STEP_MS:
+        robot.wait(HOLD_STEP_MS)
+    left = utime.ticks_diff(at, utime.ticks_ms())
+    if left > 0:
+        utime.sleep_ms(left)
+    return fn(*args)
+
+
+class Job:
+    __slots__ = ('id', 'command', 'fn', 'args', 'state', 'result', 'error',
+                 'created', 'started', 'finished', 'cancelled', 'estimate')
+
+    def __init__(self, job_id, command, fn, args):
+        self.id = job_id
+        self.command = command
+        self.fn = fn
+        self.args = args
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.created = utime.ticks_ms()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.estimate = None       # 预计时长 (ms), 未知为 None
+
+    def done(self):
+        return self.state in (DONE, ERROR, CANCELLED)
+
+    def to_dict(self):
+        info = {"job": self.id, "command": self.command, "state": self.state}
+        if self.error is not None:
+            info["msg"] = self.error
+        if self.started is not None:
+            end = self.finished if self.finished is not None else utime.ticks_ms()
+            info["elapsed_ms"] = utime.ticks_diff(end, self.started)
+        return info
+
+
+class MotionQueue:
+    """Bounded FIFO of motion jobs executed one at a time on a worker thread."""
+
+    def __init__(self, robot, size=QUEUE_SIZE, keep=KEEP_FINISHED):
+        self.robot = robot
+        self.size = size
+        self.keep = keep
+        self.running = None
+        self._pending = []
+        self._jobs = {}        # job id -> Job, pending, running and the last `keep` finished
+        self._finished = []
+        self._next_id = 1
+        self._lock = _thread.allocate_lock()
+        # 空闲时每 IDLE_MS 调用一次 (在动作线程上), 例如 teleop.Teleop.poll
+        self.idle = None
+        try:
+            _thread.stack_size(STACK_SIZE)
+        except (ValueError, AttributeError):
+            pass
+        _thread.start_new_thread(self._loop, ())
+
+    @property
+    def busy(self):
+        return self.running is not None or len(self._pending) > 0
+
+    @property
+    def queued(self):
+        return len(self._pending)
+
+    def submit(self, command, fn, *args):
+        """Queue ``fn(*args)``. Returns the Job, or None when the queue is full."""
+        return self.submit_estimated(command, None, fn, *args)
+
+    def submit_estimated(self, command, estimate, fn, *args):
+        """Like submit, with the expected duration in ms (or None)."""
+        with self._lock:
+            if len(self._pending) >= self.size:
+                return None
+            job = Job(self._next_id, command, fn, args)
+            job.estimate = estimate
+            self._next_id += 1
+            self._pending.append(job)
+            self._jobs[job.id] = job
+        return job
+
+    def remaining_ms(self):
+        """Estimated time until every queued motion is done, None when unknown."""
+        with self._lock:
+            total = 0
+            job = self.running
+            if job is not None:
+                if job.estimate is None:
+                    return None
+                total += max(0, job.estimate - utime.ticks_diff(utime.ticks_ms(), job.started))
+            for job in self._pending:
+                if job.estimate is None:
+                    return None
+                total += job.estimate
+            return total
+
+    def coalesce(self):
+        """Cancel the pending jobs (the running one continues), see RobotWifi.admission."""
+        with self._lock:
+            for job in self._pending:
+                job.cancelled = True
+                self._finish(job, CANCELLED)
+            self._pending = []
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def stop(self):
+        """Cancel pending jobs, preempt the running one and go to the home pose."""
+        with self._lock:
+            for job in self._pending:
+                job.cancelled = True
+                self._finish(job, CANCELLED)
+            self._pending = []
+            job = self.running
+            if job is not None:
+                job.cancelled = True
+                self.robot.cancel()
+            home = Job(self._next_id, 'home', self.robot.home, ())
+            self._next_id += 1
+            self._pending.append(home)
+            self._jobs[home.id] = home
+        return home
+
+    def wait(self, job):
+        """Block until ``job`` is finished (blocking servers)."""
+        while not job.done():
+            utime.sleep_ms(10)
+        return job
+
+    async def wait_async(self, job):
+        """Wait for ``job`` without blocking the event loop (asyncio servers)."""
+        while not job.done():
+            await asyncio.sleep(POLL_S)
+        return job
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = utime.ticks_ms()
+        self._finished.append(job)
+        while len(self._finished) > self.keep:
+            old = self._finished.pop(0)
+            self._jobs.pop(old.id, None)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                job = self._pending.pop(0) if self._pending else None
+                if job is not None:
+                    self.robot.cancel(False)
+                    job.state = RUNNING
+                    job.started = utime.ticks_ms()
+                    self.running = job
+            if job is None:
+                if self.idle is not None:
+                    try:
+                        self.idle()
+                    except Exception as e:
+                        print("idle hook error:", e)
+                utime.sleep_ms(IDLE_MS)
+                continue
+            state = DONE
+            try:
+                job.result = job.fn(*job.args)
+            except Exception as e:
+                if job.cancelled:
+                    state = CANCELLED
+                else:
+                    state = ERROR
+                    job.error = str(e)
+                    print("Error executing command:", e)
+            with self._lock:
+                self.running = None
+                self._finish(job, state)
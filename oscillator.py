@@ -61,6 +61,9 @@ class Oscillator:
         self._currentMillis = 0
         self._stop = True  # Oscillation mode. If true, the servo is stopped
         self._rev = False  # Reverse mode
+        self._last = 90  # Last commanded angle, without trim
+        self._tap = None  # Recorder fed with every servo write (see recorder.py)
+        self._tap_index = 0
 
     # -- Attach an oscillator to a servo
     # -- Input: pin is the pin were the servo is connected
@@ -112,6 +115,18 @@ class Oscillator:
     # -- Manual set of the position
     def SetPosition(self, position):
         self._servo.write(position + self._trim)
+        self._last = position
+        if self._tap is not None:
+            self._tap.write(self._tap_index, position)
+
+    # -- Last commanded position (degrees, without trim)
+    def GetPosition(self):
+        return self._last
+
+    # -- Report every servo write to tap.write(index, angle), None to stop
+    def SetTap(self, tap, index=0):
+        self._tap = tap
+        self._tap_index = index
 
     # -- SetTrim
     def SetTrim(self, trim):
@@ -156,6 +171,9 @@ class Oscillator:
                 if self._rev:
                     self._pos = -self._pos
                 self._servo.write(self._pos + 90 + self._trim)
+                self._last = self._pos + 90
+                if self._tap is not None:
+                    self._tap.write(self._tap_index, self._pos + 90)
 
             # -- Increment the phase
             # -- It is always increased, when the oscillator is stop
@@ -0,0 +1,97 @@
+# -- 控制页面 (index.html) 直接从 flash 分块发送
+#
+# 原来 RobotWifi 启动时把整个 index.html 读成字符串, 每次 GET 再拼接响应头并
+# encode, 每次打开页面都要分配好几 KB。这里只在启动时记下文件大小和 ETag,
+# 发送时用一个复用的小缓冲区 readinto 分块读文件:
+#   * 有 index.html.gz (gzip -9 -k index.html 预先压缩后上传) 且浏览器支持
+#     gzip 时, 发送压缩版本;
+#   * 请求头 If-None-Match 与 ETag 相同时回复 304, 不读文件。
+
+import os
+
+try:
+    import uhashlib as hashlib
+except ImportError:
+    import hashlib
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+
+CHUNK_SIZE = 512
+
+
+def _file_etag(path, buf):
+    h = hashlib.sha256()
+    mv = memoryview(buf)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(mv[:n])
+    return '"' + binascii.hexlify(h.digest()[:8]).decode() + '"'
+
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+
+class Page:
+    """A static file served in fixed-size chunks, optionally gzip-precompressed."""
+
+    def __init__(self, path, content_type='text/html; charset=utf-8', chunk_size=CHUNK_SIZE):
+        self.content_type = content_type
+        self._buf = bytearray(chunk_size)
+        # 每个版本: (文件路径, 字节数, ETag)
+        self.plain = (path, os.stat(path)[6], _file_etag(path, self._buf))
+        gz = path + '.gz'
+        self.gzip = (gz, os.stat(gz)[6], _file_etag(gz, self._buf)) if _exists(gz) else None
+
+    def select(self, headers):
+        """Return the variant ``(path, size, etag)`` and whether it is gzip encoded."""
+        if self.gzip is not None and 'gzip' in headers.get('accept-encoding', ''):
+            return self.gzip, True
+        return self.plain, False
+
+    def head(self, headers):
+        """Response head for a GET with request ``headers``.
+
+        Returns ``(response, path)``: ``path`` is the file whose bytes must
+        follow the head, or None for a 304 (the client copy is current).
+        """
+        (path, size, etag), gzipped = self.select(headers)
+        common = (
+            'ETag: ' + etag + '\r\n'
+            'Cache-Control: no-cache\r\n'
+            'Vary: Accept-Encoding\r\n'
+            'Access-Control-Allow-Origin: *\r\n'
+        )
+        if etag in headers.get('if-none-match', ''):
+            return 'HTTP/1.1 304 Not Modified\r\n' + common + '\r\n', None
+        return (
+            'HTTP/1.1 200 OK\r\n'
+            'Content-Type: ' + self.content_type + '\r\n' +
+            ('Content-Encoding: gzip\r\n' if gzipped else '') +
+            common +
+            'Content-Length: ' + str(size) + '\r\n'
+            '\r\n'
+        ), path
+
+    def chunks(self, path):
+        """Yield the file in memoryview chunks of one reused buffer.
+
+        Each chunk is only valid until the next one is requested.
+        """
+        mv = memoryview(self._buf)
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(self._buf)
+                if not n:
+                    break
+                yield mv[:n]
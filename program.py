@@ -0,0 +1,177 @@
+# -- 机器人端程序存储 & 解释器
+#
+# 工作台把整段积木程序 (动作调用, customize_action 帧, 循环, 等待) 上传一次,
+# 按名字和校验和保存在 flash 上; 之后只需按名字运行, 循环和等待都在机器人
+# 本地执行, 不再每一步都走一次 WiFi 往返。
+#
+# 程序格式:
+#     {"checksum": "...", "steps": [
+#         {"kind": "command", "command": "forward", "params": {"steps": 2, "t": 800}},
+#         {"kind": "command", "command": "customize_action", "params": [...帧...]},
+#         {"kind": "wait", "ms": 500},
+#         {"kind": "repeat", "times": 3, "steps": [...]}
+#     ]}
+
+import json
+import os
+from action import compile_action, content_hash
+
+PROGRAM_DIR = 'programs'
+_NAME_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-'
+MAX_DEPTH = 8
+INDEX_NAME = 'index'    # programs/index.json 是校验和索引, 不能用作程序名
+
+
+def call_command(robot, command, params=None):
+    """Call a public ``robot`` method the way ``/control`` does.
+
+    ``params`` may be None (no arguments), a dict (keyword arguments, e.g.
+    ``{"steps": 2, "t": 800}``) or anything else (passed as the single
+    positional argument, e.g. the frame list of customize_action).
+    """
+    if not command or command[0] == '_':
+        raise ValueError('invalid command: ' + str(command))
+    method = getattr(robot, command)
+    if params is None:
+        return method()
+    if isinstance(params, dict):
+        return method(**params)
+    return method(params)
+
+
+def valid_name(name):
+    if not name or len(name) > 32 or name == INDEX_NAME:
+        return False
+    for c in name:
+        if c not in _NAME_CHARS:
+            return False
+    return True
+
+
+def prepare(steps, resolve, depth=0):
+    """Validate ``steps`` and compile customize_action frames in place."""
+    if depth > MAX_DEPTH:
+        raise ValueError('program nested too deep')
+    for step in steps:
+        kind = step.get('kind', 'command')
+        if kind == 'wait':
+            step['ms'] = int(step.get('ms', 0))
+        elif kind == 'repeat':
+            step['times'] = int(step.get('times', 1))
+            prepare(step.get('steps', []), resolve, depth + 1)
+        elif kind == 'command':
+            command = step.get('command')
+            if not command or command[0] == '_':
+                raise ValueError('invalid command: ' + str(command))
+            if command == 'customize_action':
+                step['action'] = compile_action(step.get('params') or [], resolve)
+        else:
+            raise ValueError('unknown step kind: ' + str(kind))
+    return steps
+
+
+def run_program(robot, steps):
+    """Run prepared ``steps`` on ``robot``."""
+    for step in steps:
+        kind = step.get('kind', 'command')
+        if kind == 'wait':
+            if step['ms'] > 0:
+                robot.wait(step['ms'])
+        elif kind == 'repeat':
+            body = step.get('steps', [])
+            for _ in range(step['times']):
+                run_program(robot, body)
+        elif 'action' in step:
+            robot.play_action(step['action'])
+        else:
+            call_command(robot, step['command'], step.get('params'))
+
+
+class ProgramStore:
+    """Named programs on flash, with a checksum per program.
+
+    The checksum is chosen by the client (e.g. a hash of the program JSON);
+    when it is missing the sha256 of the uploaded body is used. Uploading a
+    program whose checksum matches the stored one is a no-op.
+    """
+
+    def __init__(self, robot, directory=PROGRAM_DIR):
+        self.robot = robot
+        self.directory = directory
+        self._index_path = directory + '/' + INDEX_NAME + '.json'
+        self._loaded = {}    # name -> (checksum, prepared steps)
+        try:
+            os.mkdir(directory)
+        except OSError:
+            pass
+        try:
+            with open(self._index_path, 'r') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _path(self, name):
+        return self.directory + '/' + name + '.json'
+
+    def checksum(self, name):
+        return self.index.get(name)
+
+    def names(self):
+        return list(self.index)
+
+    def save(self, name, body):
+        """Store the raw upload ``body``. Return False when it was unchanged."""
+        if not valid_name(name):
+            raise ValueError('invalid program name: ' + str(name))
+        data = json.loads(body)
+        checksum = data.get('checksum')
+        if not checksum:
+            checksum = ''.join('%02x' % b for b in content_hash(body))
+        if self.index.get(name) == checksum:
+            return False
+        steps = prepare(data.get('steps', []), self.robot._angles_from_semantic)
+
+        tmp = self._path(name) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+        os.rename(tmp, self._path(name))
+        self.index[name] = checksum
+        self._save_index()
+        self._loaded[name] = (checksum, steps)
+        return True
+
+    def delete(self, name):
+        if name not in self.index:
+            return False
+        del self.index[name]
+        self._loaded.pop(name, None)
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+        self._save_index()
+        return True
+
+    def load(self, name):
+        checksum = self.index.get(name)
+        if checksum is None:
+            raise KeyError(name)
+        loaded = self._loaded.get(name)
+        if loaded is not None and loaded[0] == checksum:
+            return loaded[1]
+        with open(self._path(name), 'rb') as f:
+            data = json.loads(f.read())
+        steps = prepare(data.get('steps', []), self.robot._angles_from_semantic)
+        self._loaded[name] = (checksum, steps)
+        return steps
+
+    def run(self, name):
+        run_program(self.robot, self.load(name))
+
+    def _save_index(self):
+        with open(self._index_path, 'w') as f:
+            json.dump(self.index, f)
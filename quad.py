@@ -2,6 +2,8 @@
 
 from micropython import const
 import oscillator, utime, math
+import recorder
+from action import HOME, compile_action, resolve_frame
 
 # -- Constants
 FORWARD = const(1)
@@ -35,6 +37,10 @@ def DEG2RAD(g):
     return (g * math.pi) / 180
 
 
+class MotionCancelled(Exception):
+    """Raised at the next control tick after Quad.cancel()."""
+
+
 class Quad:
     def __init__(self):
         self._servo_totals = 8
@@ -49,6 +55,8 @@ class Quad:
         self._increment = [0] * self._servo_totals
         self._isOttoResting = True
         self._reverse = [False] * 8
+        self._recorder = None
+        self._cancel = False
 
     def deinit(self):
         self.detachServos()
@@ -89,6 +97,25 @@ class Quad:
         self._servo[6].SetTrim(0 if BRL is None else BRL)
         self._servo[7].SetTrim(0 if BLL is None else BLL)
 
+    # -- Cancellation: cancel() stops the running motion at its next control tick
+    def cancel(self, state=True):
+        self._cancel = state
+
+    def _checkpoint(self):
+        if self._cancel:
+            self._cancel = False
+            for i in range(0, self._servo_totals):
+                self._servo_position[i] = self._servo[i].GetPosition()
+            raise MotionCancelled()
+
+    def wait(self, ms=500):
+        """Hold the current pose for ``ms`` milliseconds (cancellable)."""
+        end = utime.ticks_add(utime.ticks_ms(), int(ms))
+        while utime.ticks_diff(end, utime.ticks_ms()) > 0:
+            self._checkpoint()
+            utime.sleep_ms(min(10, max(1, utime.ticks_diff(end, utime.ticks_ms()))))
+        self._checkpoint()
+
     # -- Basic Motion Functions
     def _moveServos(self, period, servo_target):
         self.attachServos()
@@ -103,8 +130,9 @@ class Quad:
                 self._partial_time = utime.ticks_ms() + 10
                 for i in range(0, self._servo_totals):
                     self._servo[i].SetPosition(int(self._servo_position[i] + (iteration * self._increment[i])))
+                self._checkpoint()
                 while utime.ticks_ms() < self._partial_time:
-                    pass  # pause
+                    utime.sleep_ms(1)  # pause (yields to the server thread, see motion.py)
                 iteration += 1
         else:
             for i in range(0, self._servo_totals):
@@ -133,6 +161,8 @@ class Quad:
         while x <= period[0] * cycle + ref:
             for i in range(0, self._servo_totals):
                 self._servo[i].refresh()
+            self._checkpoint()
+            utime.sleep_ms(1)
             x = float(utime.ticks_ms())
 
     def _execute(self, amplitude, offset, period, phase, steps=1.0):
@@ -261,6 +291,7 @@ class Quad:
                 self._servo[2].refresh()
                 self._servo[7].refresh()
 
+            self._checkpoint()
             utime.sleep(0.001)
 
     def forward(self, steps=3, t=800):
@@ -459,7 +490,7 @@ class Quad:
             self._moveServos(200, state2)
             self._moveServos(200, state3)
 
-        utime.sleep_ms(300)
+        self.wait(300)
         self._moveServos(200, state4)
 
     def wave_hand(self, steps=3, t=2000):
@@ -489,7 +520,7 @@ class Quad:
 
         self._moveServos(600, sentado)
         self._moveServos(1000, salto)
-        utime.sleep_ms(1000)
+        self.wait(1000)
 
     def relax(self):
         # 1. Right Front (0, 2)
@@ -502,11 +533,11 @@ class Quad:
         step4 = [30, 150, 160, 20, 150, 30, 20, 160]
 
         self._moveServos(300, step1)
-        utime.sleep_ms(100)
+        self.wait(100)
         self._moveServos(300, step2)
-        utime.sleep_ms(100)
+        self.wait(100)
         self._moveServos(300, step3)
-        utime.sleep_ms(100)
+        self.wait(100)
         self._moveServos(300, step4)
     def relax2(self):
         # Time intervals: 100ms movement, 100ms delay
@@ -532,27 +563,27 @@ class Quad:
 
         # RF
         self._moveServos(t, rf_retract)
-        utime.sleep_ms(delay)
+        self.wait(delay)
         self._moveServos(t, rf_extend)
-        utime.sleep_ms(delay)
+        self.wait(delay)
 
         # LF
         self._moveServos(t, lf_retract)
-        utime.sleep_ms(delay)
+        self.wait(delay)
         self._moveServos(t, lf_extend)
-        utime.sleep_ms(delay)
+        self.wait(delay)
 
         # LB
         self._moveServos(t, lb_retract)
-        utime.sleep_ms(delay)
+        self.wait(delay)
         self._moveServos(t, lb_extend)
-        utime.sleep_ms(delay)
+        self.wait(delay)
 
         # RB
         self._moveServos(t, rb_retract)
-        utime.sleep_ms(delay)
+        self.wait(delay)
         self._moveServos(t, rb_extend)
-        utime.sleep_ms(delay)
+        self.wait(delay)
 
     def frog_jump(self, steps=3):
         hi = 40 # Squat amount
@@ -642,19 +673,116 @@ class Quad:
           Format B (raw semantic, for debugging):
             {'duration': 400, 'legs': {'FR': {'hip':'forward','knee':'retracted'}, ...}}
 
+        Frames are compiled first (see action.compile_action), then played.
         After executing all frames, robot returns to home position.
         """
-        for frame in params:
-            duration = frame.get('duration', 500)
-            if duration <= 0:
-                duration = 500
-            if 'angles' in frame:
-                angles = frame['angles']
-            else:
-                angles = self._angles_from_semantic(frame.get('legs', {}))
+        self.play_action(compile_action(params, self._angles_from_semantic))
+
+    def stream_action(self, frames):
+        """Like customize_action, but runs each frame as soon as ``frames`` yields it.
+
+        Used for programs that are still arriving over the network, see
+        request_stream.FrameFeed.
+        """
+        last = None
+        for frame in frames:
+            duration, last = resolve_frame(frame, self._angles_from_semantic)
+            self._moveServos(duration, last)
+        # Safe return to home (skipped when the last frame already is home)
+        if last is None or tuple(last) != HOME:
+            self._moveServos(500, [90] * 8)
+
+    def play_action(self, action):
+        """Play a CompiledAction produced by action.compile_action."""
+        for duration, angles in action.frames():
             self._moveServos(duration, angles)
-        # Safe return to home
-        self._moveServos(500, [90] * 8)
+        # Safe return to home (skipped when the last frame already is home)
+        if action.home:
+            self._moveServos(500, [90] * 8)
+
+
+    # ----------------------------------------------------------------
+    # Motion recording / replay
+    # ----------------------------------------------------------------
+
+    def start_recording(self, path='motion.rec'):
+        """Record every servo write to ``path`` until stop_recording()."""
+        self.stop_recording()
+        self._recorder = recorder.Recorder(path)
+        for i in range(0, self._servo_totals):
+            self._servo[i].SetTap(self._recorder, i)
+
+    def stop_recording(self):
+        if self._recorder is None:
+            return 0
+        for i in range(0, self._servo_totals):
+            self._servo[i].SetTap(None)
+        self._recorder.close()
+        records = self._recorder.records
+        self._recorder = None
+        return records
+
+    def replay(self, path='motion.rec'):
+        """Play a recording back exactly, without any gait math."""
+        self.attachServos()
+        if self.getRestState():
+            self.setRestState(False)
+        pose = recorder.replay(self._servo, path, self._checkpoint)
+        for i in range(0, self._servo_totals):
+            self._servo_position[i] = pose[i]
+
+    # ----------------------------------------------------------------
+    # Teleoperation (see teleop.py)
+    # ----------------------------------------------------------------
+
+    def pose(self, out=None):
+        """Last commanded angle of every servo (without trim), cheap enough to poll."""
+        if out is None:
+            out = [0] * self._servo_totals
+        for i in range(0, self._servo_totals):
+            out[i] = self._servo[i].GetPosition()
+        return out
+
+    def set_pose(self, angles):
+        """Write 8 servo angles immediately, no interpolation."""
+        self.attachServos()
+        if self.getRestState():
+            self.setRestState(False)
+        for i in range(0, self._servo_totals):
+            self._servo[i].SetPosition(angles[i])
+            self._servo_position[i] = angles[i]
+
+    def gait_pose(self, vx, wz, phase, pose):
+        """Fill ``pose`` with the walking gait at ``phase`` (radians).
+
+        ``vx`` (forward, negative is backward) and ``wz`` (turn, positive is
+        left) are in -1..1. The gait is the one of forward(); backward and
+        turn_L / turn_R correspond to reversing the hips of both / one side.
+        With vx = wz = 0 it is the standing pose of the gait.
+        """
+        x_amp = 15
+        z_amp = 15 if vx or wz else 0
+        ap = 10
+        hi = 15
+        front_x = 6
+        right = max(-1.0, min(1.0, vx - wz))
+        left = max(-1.0, min(1.0, vx + wz))
+        amplitude = [x_amp * right, x_amp * left, z_amp, z_amp,
+                     x_amp * right, x_amp * left, z_amp, z_amp]
+        offset = [0 + ap - front_x,
+                  0 - ap + front_x,
+                  0 - hi,
+                  0 + hi,
+                  0 - ap - front_x,
+                  0 + ap + front_x,
+                  0 + hi,
+                  0 - hi
+                  ]
+        phase0 = [0, 0, 90, 90,
+                  180, 180, 90, 90]
+        for i in range(0, self._servo_totals):
+            pose[i] = int(90 + offset[i] + amplitude[i] * math.sin(phase + DEG2RAD(phase0[i])))
+        return pose
 
 
 # end
@@ -0,0 +1,123 @@
+# -- 动作录制 & 回放
+#
+# Recorder 挂在 Oscillator 的舵机输出上 (SetPosition / refresh), 把
+# (与上一帧的毫秒间隔, 8 个舵机角度) 追加写入 flash 上的二进制文件。
+# replay() 直接把文件里的角度送给舵机, 不再做任何步态计算。
+#
+# 文件格式 (小端):
+#     头部 8 字节:  b'QREC' | version u8 | servos u8 | reserved u16
+#     每条记录 10 字节: tick 间隔 u16 (ms) | 8 x 角度 u8
+
+import struct
+import utime
+
+MAGIC = b'QREC'
+VERSION = 1
+SERVOS = 8
+HEADER_FMT = '<4sBBH'
+HEADER_SIZE = 8
+RECORD_SIZE = 2 + SERVOS
+BUFFER_RECORDS = 64
+
+
+class Recorder:
+    """Buffered binary writer for servo poses.
+
+    Every servo write goes through :meth:`write`; writes that happen in the
+    same millisecond are collected into one pose, which is emitted as a record
+    once time moves on. Records are packed into a fixed-size buffer that is
+    written to flash only when full, so the control loop never waits on a
+    small write.
+    """
+
+    def __init__(self, path, buffer_records=BUFFER_RECORDS):
+        self.path = path
+        self.records = 0
+        self._f = open(path, 'wb')
+        self._f.write(struct.pack(HEADER_FMT, MAGIC, VERSION, SERVOS, 0))
+        self._buf = bytearray(RECORD_SIZE * buffer_records)
+        self._mv = memoryview(self._buf)
+        self._pos = 0
+        self._pose = bytearray([90] * SERVOS)
+        self._prev = bytearray([90] * SERVOS)
+        self._dirty = False
+        self._pending = 0
+        self._last = None
+
+    def write(self, index, angle):
+        """Tap for Oscillator: servo ``index`` was commanded to ``angle``."""
+        now = utime.ticks_ms()
+        if self._dirty and utime.ticks_diff(now, self._pending) > 0:
+            self._emit()
+        if angle < 0:
+            angle = 0
+        elif angle > 180:
+            angle = 180
+        self._pose[index] = int(angle)
+        if not self._dirty:
+            self._pending = now
+            self._dirty = True
+
+    def _emit(self):
+        delta = 0 if self._last is None else utime.ticks_diff(self._pending, self._last)
+        # -- gaps longer than a u16 are stored as extra records holding the previous pose
+        while delta > 0xFFFF:
+            self._append(0xFFFF, self._prev)
+            delta -= 0xFFFF
+        self._append(delta, self._pose)
+        self._prev[:] = self._pose
+        self._last = self._pending
+        self._dirty = False
+
+    def _append(self, delta, pose):
+        buf = self._buf
+        pos = self._pos
+        buf[pos] = delta & 0xFF
+        buf[pos + 1] = delta >> 8
+        buf[pos + 2:pos + RECORD_SIZE] = pose
+        self._pos = pos + RECORD_SIZE
+        self.records += 1
+        if self._pos == len(buf):
+            self._f.write(buf)
+            self._pos = 0
+
+    def close(self):
+        if self._f is None:
+            return
+        if self._dirty:
+            self._emit()
+        if self._pos:
+            self._f.write(self._mv[:self._pos])
+            self._pos = 0
+        self._f.close()
+        self._f = None
+
+
+def replay(servos, path, checkpoint=None, buffer_records=BUFFER_RECORDS):
+    """Stream the recording at ``path`` to ``servos`` (a list of Oscillator).
+
+    ``checkpoint`` is called before every record (Quad uses it to cancel).
+    Returns the last pose played as a list of 8 angles.
+    """
+    buf = bytearray(RECORD_SIZE * buffer_records)
+    pose = [90] * SERVOS
+    with open(path, 'rb') as f:
+        magic, version, servo_count, _ = struct.unpack(HEADER_FMT, f.read(HEADER_SIZE))
+        if magic != MAGIC or version != VERSION or servo_count != SERVOS:
+            raise ValueError('not a recording: ' + path)
+        deadline = utime.ticks_ms()
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            for off in range(0, n - n % RECORD_SIZE, RECORD_SIZE):
+                deadline = utime.ticks_add(deadline, buf[off] | (buf[off + 1] << 8))
+                if checkpoint is not None:
+                    checkpoint()
+                wait = utime.ticks_diff(deadline, utime.ticks_ms())
+                if wait > 0:
+                    utime.sleep_ms(wait)
+                for i in range(SERVOS):
+                    pose[i] = buf[off + 2 + i]
+                    servos[i].SetPosition(pose[i])
+    return pose
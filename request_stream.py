@@ -0,0 +1,215 @@
+# -- 流式 HTTP 请求解析
+#
+# RobotWifi 原来只 recv(1024) 一次, 超过约 1 KB 的 customize_action 请求体会被
+# 截断。这里:
+#   * read_head() 用 recv_into 把请求头读进预先分配好的缓冲区, 取出
+#     Content-Length; keep-alive 连接上多收到的字节 (流水线的下一个请求)
+#     由调用方传回下一次 read_head;
+#   * FrameScanner 边收边扫描请求体, "params" 数组里的每一帧一收完整就单独
+#     json.loads, 不需要整个请求体在内存里;
+#   * FrameFeed 是扫描器和动作线程之间的有界队列, 第 1 帧到了就可以开始动,
+#     后面的帧还在路上。
+# 内存占用只和缓冲区大小有关, 与程序长度无关。
+
+import json
+
+FRAME_MAX = 512        # 单帧 JSON 最大字节数
+ENVELOPE_MAX = 512     # params 数组以外部分的最大字节数
+FEED_SIZE = 8          # 已解析但还没执行的帧数上限
+
+_QUOTE = 0x22
+_BACKSLASH = 0x5C
+_OPEN = (0x7B, 0x5B)   # { [
+_CLOSE = (0x7D, 0x5D)  # } ]
+_BLANK = (0x20, 0x09, 0x0D, 0x0A, 0x2C)  # 空白和逗号
+
+
+def read_head(sock, buf, pending=b''):
+    """Receive request headers into ``buf`` (a preallocated bytearray).
+
+    ``pending`` holds bytes already received on a keep-alive connection
+    (the start of a pipelined request). Returns ``(method, path, version,
+    headers, body)`` where ``headers`` has lowercase names and ``body``
+    holds the bytes that arrived after the headers, or None when the client
+    closed without sending anything.
+    """
+    mv = memoryview(buf)
+    n = len(pending)
+    if n > len(buf):
+        raise ValueError('request headers too large')
+    mv[:n] = pending
+    end = bytes(pending).find(b'\r\n\r\n')
+    while end < 0:
+        if n == len(buf):
+            raise ValueError('request headers too large')
+        got = sock.recv_into(mv[n:])
+        if not got:
+            if n == 0:
+                return None
+            raise ValueError('connection closed in headers')
+        start = n - 3 if n > 3 else 0
+        n += got
+        end = bytes(mv[start:n]).find(b'\r\n\r\n')
+        if end >= 0:
+            end += start
+    lines = bytes(mv[:end]).decode('utf-8').split('\r\n')
+    method, path, version = lines[0].split()
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method, path, version, headers, bytes(mv[end + 4:n])
+
+
+def keep_alive(version, headers):
+    """HTTP/1.1 keeps the connection unless "Connection: close", HTTP/1.0 only on request."""
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+def content_length(headers):
+    try:
+        return int(headers.get('content-length', 0))
+    except ValueError:
+        return 0
+
+
+class FrameScanner:
+    """Incremental scanner for a /control body with a ``params`` frame array.
+
+    ``feed()`` the body in chunks of any size. Each object inside
+    ``"params": [...]`` is decoded on its own as soon as its closing brace
+    arrives and appended to ``frames``. ``head`` is the envelope known when
+    the array starts (e.g. the command; keys after "params" are not in it),
+    ``envelope()`` the whole body without frames once everything was fed.
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.head = None
+        self._prefix = bytearray()
+        self._suffix = bytearray()
+        self._frame = bytearray()
+        self._state = 0          # 0: before params, 1: inside params, 2: after params
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+
+    def feed(self, data):
+        for b in data:
+            if self._state == 1:
+                self._feed_array(b)
+                continue
+            out = self._prefix if self._state == 0 else self._suffix
+            if len(out) >= ENVELOPE_MAX:
+                raise ValueError('request envelope too large')
+            if self._in_str:
+                out.append(b)
+                self._scan_string(b)
+                continue
+            if b == _QUOTE:
+                self._in_str = True
+            elif self._state == 0 and b == 0x5B and self._depth == 1 and self._at_params():
+                self._state = 1
+                self.head = json.loads(bytes(self._prefix) + b'[]}')
+                continue
+            elif b in _OPEN:
+                self._depth += 1
+            elif b in _CLOSE:
+                self._depth -= 1
+            out.append(b)
+
+    def _at_params(self):
+        prefix = bytes(self._prefix).rstrip()
+        return prefix.endswith(b':') and prefix[:-1].rstrip().endswith(b'"params"')
+
+    def _scan_string(self, b):
+        if self._esc:
+            self._esc = False
+        elif b == _BACKSLASH:
+            self._esc = True
+        elif b == _QUOTE:
+            self._in_str = False
+
+    def _feed_array(self, b):
+        frame = self._frame
+        if self._in_str:
+            frame.append(b)
+            self._scan_string(b)
+            return
+        if not frame:
+            if b == 0x7B:
+                frame.append(b)
+                self._depth = 1
+            elif b == 0x5D:
+                self._state = 2
+                self._depth = 1
+            elif b not in _BLANK:
+                raise ValueError('params must be a list of frames')
+            return
+        if len(frame) >= FRAME_MAX:
+            raise ValueError('frame too large')
+        frame.append(b)
+        if b == _QUOTE:
+            self._in_str = True
+        elif b in _OPEN:
+            self._depth += 1
+        elif b in _CLOSE:
+            self._depth -= 1
+            if self._depth == 0:
+                self.frames.append(json.loads(bytes(frame)))
+                self._frame = bytearray()
+
+    def envelope(self):
+        if self._state == 0:
+            return json.loads(bytes(self._prefix))
+        if self._state == 1:
+            raise ValueError('params not terminated')
+        return json.loads(bytes(self._prefix) + b'[]' + bytes(self._suffix))
+
+
+class FrameFeed:
+    """Bounded FIFO of frames between the request reader and the motion worker."""
+
+    def __init__(self, size=FEED_SIZE):
+        self.size = size
+        self.closed = False
+        self.failed = None
+        self._items = []
+
+    def put(self, frame):
+        """Queue ``frame``; returns False when the feed is full."""
+        if len(self._items) >= self.size:
+            return False
+        self._items.append(frame)
+        return True
+
+    def close(self, error=None):
+        self.failed = error
+        self.closed = True
+
+    def frames(self, wait):
+        """Yield frames until closed; ``wait(ms)`` is used while the feed is empty."""
+        while True:
+            if self._items:
+                yield self._items.pop(0)
+            elif self.failed is not None:
+                raise ValueError(self.failed)
+            elif self.closed:
+                return
+            else:
+                wait(2)
+
+
+def pump(scanner, feed, job):
+    """Move decoded frames into ``feed``. Returns True when nothing is left over."""
+    frames = scanner.frames
+    if job.done():
+        # 动作已经结束 (例如被 stop 打断), 剩下的帧直接丢弃
+        del frames[:]
+        return True
+    while frames and feed.put(frames[0]):
+        frames.pop(0)
+    return not frames
@@ -1,128 +1,826 @@
 
-import machine
-import usocket as socket
-import network
-import time
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+try:
+    import uselect as select
+except ImportError:
+    import select
 import json
+import utime
+import binproto
+from fastboot import start_ap, start_station, wait_station
+from announce import TTL_S
+from action import ActionCache, compile_action, compile_frames, content_hash
+from motion import MotionQueue, CANCELLED, ERROR, estimate_ms, scheduled
+from page import Page
+from teleop import TELEOP_PORT, Teleop
+from program import ProgramStore, call_command
+from request_stream import FrameFeed, FrameScanner, content_length, keep_alive, pump, read_head
+
+IDLE_TIMEOUT = 5        # keep-alive 连接空闲多久后关闭 (秒)
+REQUEST_TIMEOUT = 5     # 读一个请求的超时 (秒)
+MAX_REQUESTS = 100      # 每个连接最多处理的请求数
+MAX_CONNECTIONS = 4     # 同时保持的连接数上限, ESP32 的 socket 数很有限
+BACKLOG = 4             # listen() 的 backlog: 内核里排队等 accept 的连接数
+POLL_MS = 500
+WAIT_POLL_MS = 10       # 有请求在等动作结束时的 poll 间隔
+RETRY_MS = 1000         # 剩余时间未知时的 Retry-After
+MAX_HOLD_MS = 10000     # "at" 定时启动最多提前这么久
+FIRMWARE = "1.4"        # GET /info 和发现广播里的固件版本, HTTP 接口变化时加一
+
+# 动作进行中又收到同步动作命令时 (admission; "async": true 的命令总是排进 MotionQueue):
+#   "reject"   立即回复 503, 带 Retry-After 和预计剩余时间 (默认)
+#   "coalesce" 取消还在排队的命令, 只保留最新的一个
+#   "queue"    排进 MotionQueue, 队列满了才 503
+ADMISSION = "reject"
+
+
+def run_name(path):
+    """The program name of a /programs/<name>/run path, else None."""
+    if not (path.startswith("/programs/") and path.endswith("/run")):
+        return None
+    name = path[10:-4]
+    return name if name and "/" not in name else None
 
 
 class RobotWifi:
 
-    def __init__(self, robot, html_path='index.html'):
+    def __init__(self, robot, html_path='index.html', buffer_size=1024, max_body=16 * 1024,
+                 timeout=REQUEST_TIMEOUT, idle_timeout=IDLE_TIMEOUT, max_requests=MAX_REQUESTS,
+                 max_connections=MAX_CONNECTIONS, udp_port=TELEOP_PORT, admission=ADMISSION,
+                 name="quad"):
         self.robot = robot
-        with open(html_path, 'r', encoding='utf-8') as file:
-            self.html = file.read()
+        # 名字和地址出现在 GET /info 和发现广播里 (见 announce.py); ip 由 main.py 在连上 wifi 后设置
+        self.name = name
+        self.ip = None
+        self.port = 80
+        self.udp_port = udp_port
+        self.announcer = None
+        # USB 串口控制 (见 serial_link.py), SerialLink.start() 设置, 在服务循环里处理
+        self.serial = None
+        # 请求头接收缓冲区, 也用来分块接收大的请求体 (见 request_stream.py)
+        self._buf = bytearray(buffer_size)
+        self.max_body = max_body
+        # HTTP/1.1 keep-alive: 超时和上限
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.max_connections = max_connections
+        self.admission = admission
+        # customize_action 编译缓存, 以请求体哈希为键
+        self.actions = ActionCache()
+        # flash 上的命名程序 (见 program.py)
+        self.programs = ProgramStore(robot)
+        # 动作队列: 所有动作都在这里排队执行 (见 motion.py)
+        self.jobs = MotionQueue(robot)
+        # UDP 遥控通道 (见 teleop.py), udp_port=None 时不开启
+        self.teleop = None
+        if udp_port is not None:
+            self.teleop = Teleop(robot, self.jobs, udp_port)
+            self.jobs.idle = self.teleop.poll
+        # 控制页面不再整个读进内存, 发送时从 flash 分块读取 (见 page.py)
+        self.page = Page(html_path)
+        # GET /pose 复用的角度列表
+        self._pose = [90] * 8
+        # 启动各阶段耗时 (fastboot.BootTimer), 由 main.py 设置, 出现在 /status 里
+        self.boot = None
 
     # 创建并启动热点
     def create_connect_ap(self, essid, password, ifconfig=None):
         """AP 模式: 手机和esp32直连(不通过路由)"""
-        ap = network.WLAN(network.AP_IF)
-        if ifconfig:
-            ap.ifconfig(ifconfig)
-        ap.active(True)
-        ap.config(essid=essid, password=password, authmode=network.AUTH_WPA_WPA2_PSK)
-        print('Access Point created!')
-        machine.PWM(machine.Pin(2), duty=512)
-        ip = ap.ifconfig()[0]
-        print("ip:", ip)
-        return ip
+        return start_ap(essid, password, ifconfig)
 
     def create_connect_route(self, ssid, password, ifconfig=None):
-        """STA 模式: esp32连路由，手机连路由"""
-        wlan = network.WLAN(network.STA_IF)
-        if ifconfig:
-            # 自定义固定的 ip 在址，否则每次连接的 ip 可能会不一样
-            wlan.ifconfig(ifconfig)
-        wlan.active(True)
-        if not wlan.isconnected():
-            print('connecting to network...')
-            wlan.connect(ssid, password)
-            i = 1
-            while not wlan.isconnected():
-                print("正在链接...{}".format(i))
-                i += 1
-                time.sleep(1)
-        ip = wlan.ifconfig()[0]
-        machine.PWM(machine.Pin(2), duty=512)
-        print("ip:", ip)
-        return ip
+        """STA 模式: esp32连路由，手机连路由 (一直等到连上, 快速启动见 fastboot.py)"""
+        return wait_station(start_station(ssid, password, ifconfig), timeout_ms=None)
 
     def handle_post_request(self, post_data):
-        data = json.loads(post_data)
-        command = data.get("command")
-        params  = data.get("params")       # optional: used by customize_action
-        if command:
+        """Parse a /control body and queue its motion.
+
+        Returns ``(job, None)`` when the caller should wait for ``job``, or
+        ``(None, response)`` when the answer is already known (asynchronous
+        request, stop, queue full, bad request).
+
+        Body: {"command": "forward", "params": {...}, "async": false, "at": 123456}
+        With "async": true the reply is 202 with a job id, see GET /jobs/<id>.
+        "at" is a local utime.ticks_ms() value (see GET /clock): the motion
+        is admitted now and starts at that tick.
+        "command": "stop" preempts the running motion and goes home.
+        """
+        # 同一段 customize_action 程序重复运行时, 直接使用缓存的编译结果
+        key = content_hash(post_data)
+        cached = self.actions.get(key)
+        if cached is not None:
+            action, wait = cached
+            return self.queue_job("customize_action", wait, action.duration_ms(),
+                                  self.robot.play_action, action)
+        if binproto.is_binary(post_data):
+            return self.handle_binary_request(post_data, key)
+
+        try:
+            data = json.loads(post_data)
+            command = data.get("command")
+            params  = data.get("params")       # optional: used by customize_action
+            wait = not data.get("async", False)
+            at = data.get("at")
+            if command == "customize_action" and params is not None:
+                action = compile_action(params, self.robot._angles_from_semantic)
+                if at is None:
+                    # 带 "at" 的请求体每次都不同, 不放进缓存
+                    self.actions.put(key, (action, wait))
+                return self.queue_job(command, wait, action.duration_ms(), self.robot.play_action, action, at=at)
+        except Exception as e:
+            err = "Error executing command:" + str(e)
+            print(err)
+            return None, self.json_response(json.dumps({"status": "500", "msg": err}))
+
+        if not command:
+            return None, self.json_response(json.dumps({"status": "400", "msg": "missing command"}),
+                                            '400 Bad Request')
+        if command == "stop":
+            print(command)
+            home = self.jobs.stop()
+            return None, self.json_response(json.dumps({"status": "200", "msg": command, "job": home.id}))
+        print(command)
+        return self.queue_job(command, wait, estimate_ms(command, params),
+                              call_command, self.robot, command, params, at=at)
+
+    def handle_binary_request(self, post_data, key):
+        """/control with a binproto body (Content-Type: application/x-quad).
+
+        Frames are decoded straight from the receive buffer, no JSON objects
+        are created. Same return value as handle_post_request.
+        """
+        try:
+            command, flags, count = binproto.decode_header(post_data)
+            wait = not flags & binproto.FLAG_ASYNC
+            if command == "customize_action":
+                action = compile_frames(binproto.frames(post_data, count))
+                self.actions.put(key, (action, wait))
+                return self.queue_job(command, wait, action.duration_ms(), self.robot.play_action, action)
+            if command == "stop":
+                home = self.jobs.stop()
+                return None, self.json_response(json.dumps({"status": "200", "msg": command, "job": home.id}))
+            args = binproto.args(post_data, count)
+            fn = getattr(self.robot, command)
+        except (ValueError, AttributeError) as e:
+            return None, self.json_response(json.dumps({"status": "400", "msg": str(e)}),
+                                            '400 Bad Request')
+        print(command)
+        return self.queue_job(command, wait, estimate_ms(command, dict(zip(("steps", "t"), args))), fn, *args)
+
+    def motion_active(self):
+        """True while a motion runs or waits (遥控让出, 不算在内)."""
+        running = self.jobs.running
+        return self.jobs.queued > 0 or (running is not None and running.command != "teleop")
+
+    def busy_motion_response(self):
+        """503 with Retry-After and the estimated time until the robot is free."""
+        remaining = self.jobs.remaining_ms()
+        running = self.jobs.running
+        retry = RETRY_MS if remaining is None else remaining
+        return self.json_response(json.dumps({
+            "status": "503",
+            "msg": "busy",
+            "command": running.command if running is not None else None,
+            "remaining_ms": remaining,
+        }), '503 Service Unavailable', 'Retry-After: %d\r\n' % ((retry + 999) // 1000))
+
+    def queue_job(self, command, wait, estimate, fn, *args, at=None):
+        """Admit and queue a motion, see handle_post_request for the return value."""
+        job, response = self.admit(command, wait, estimate, fn, *args, at=at)
+        if job is None or wait:
+            return job, response
+        return None, self.json_response(json.dumps({"status": "202", "msg": command, "job": job.id}),
+                                        '202 Accepted')
+
+    def admit(self, command, wait, estimate, fn, *args, at=None):
+        """Admit a motion according to ``self.admission`` and queue it.
+
+        The admission policy only applies to synchronous requests (``wait``);
+        asynchronous ones are queued unless the queue is full. Returns
+        ``(job, None)``, or ``(None, response)`` when the motion was refused.
+
+        ``estimate`` is the expected duration in ms (None when unknown).
+        ``at`` is the local ticks_ms() to start at (None: as soon as possible).
+        """
+        if at is not None:
             try:
-                print(command)
-                method = getattr(self.robot, command)
-                method(params) if params is not None else method()
-                return json.dumps({"status": "200", "msg": command})
-            except Exception as e:
-                err = "Error executing command:" + str(e)
-                print(err)
-                return json.dumps({"status": "500", "msg": err})
+                hold = utime.ticks_diff(int(at), utime.ticks_ms())
+            except (TypeError, ValueError, OverflowError):
+                hold = MAX_HOLD_MS + 1
+            if hold > MAX_HOLD_MS:
+                return None, self.json_response(json.dumps({"status": "400", "msg": "bad start time"}),
+                                                '400 Bad Request')
+            args = (self.robot, int(at), fn) + args
+            fn = scheduled
+            if estimate is not None:
+                estimate += max(0, hold)
+        # 异步命令已经拿到 job id 就返回, 不占连接, 总是排队 (队列满才 503)
+        if wait and self.admission != "queue" and self.motion_active():
+            if self.admission == "reject":
+                return None, self.busy_motion_response()
+            # coalesce: 只保留最新的命令, 排队中的命令被取消
+            self.jobs.coalesce()
+        job = self.jobs.submit_estimated(command, estimate, fn, *args)
+        if job is None:
+            return None, self.json_response(json.dumps({"status": "503", "msg": "queue full"}),
+                                            '503 Service Unavailable')
+        return job, None
 
-    def handle_get_request(self):
-        response_headers = (
-            'HTTP/1.1 200 OK\r\n'
-            'Content-Type: text/html\r\n'
-            'Access-Control-Allow-Origin: *\r\n'
-            '\r\n'
-        )
-        return response_headers + self.html
+    def job_response(self, job):
+        """Response for a finished job of a synchronous request."""
+        if job.state == ERROR:
+            result = {"status": "500", "msg": "Error executing command:" + job.error}
+        elif job.state == CANCELLED:
+            result = {"status": "409", "msg": "cancelled: " + job.command}
+        else:
+            result = {"status": "200", "msg": job.command}
+        result["job"] = job.id
+        return self.json_response(json.dumps(result))
+
+    def handle_program_request(self, method, name, post_data):
+        """/programs 路由: 上传 (按校验和幂等), 查询校验和, 删除。"""
+        store = self.programs
+        try:
+            if method == "GET" and not name:
+                return json.dumps({"status": "200", "programs": store.index})
+            if method == "GET":
+                checksum = store.checksum(name)
+                if checksum is None:
+                    return json.dumps({"status": "404", "msg": "no program " + name})
+                return json.dumps({"status": "200", "name": name, "checksum": checksum})
+            if method == "POST":
+                if store.save(name, post_data):
+                    return json.dumps({"status": "201", "name": name, "checksum": store.checksum(name)})
+                return json.dumps({"status": "200", "name": name, "checksum": store.checksum(name),
+                                   "msg": "unchanged"})
+            if method == "DELETE":
+                if store.delete(name):
+                    return json.dumps({"status": "200", "msg": name})
+                return json.dumps({"status": "404", "msg": "no program " + name})
+        except Exception as e:
+            err = "Error in program " + name + ":" + str(e)
+            print(err)
+            return json.dumps({"status": "500", "msg": err})
+        return json.dumps({"status": "405", "msg": method})
+
+    def handle_run_request(self, name, post_data):
+        """POST /programs/<name>/run, queued like /control (body may set "async")."""
+        if self.programs.checksum(name) is None:
+            return None, self.json_response(json.dumps({"status": "404", "msg": "no program " + name}))
+        wait = True
+        if post_data:
+            try:
+                wait = not json.loads(post_data).get("async", False)
+            except ValueError:
+                pass
+        print("run program", name)
+        return self.queue_job("program:" + name, wait, None, self.programs.run, name)
+
+    def handle_job_request(self, job_id):
+        """GET /jobs/<id>: 异步动作的状态。"""
+        try:
+            job = self.jobs.get(int(job_id))
+        except ValueError:
+            job = None
+        if job is None:
+            return json.dumps({"status": "404", "msg": "no job " + job_id})
+        result = job.to_dict()
+        result["status"] = "200"
+        return json.dumps(result)
+
+    def handle_status_request(self):
+        """GET /status: 当前是否在执行动作。"""
+        running = self.jobs.running
+        return json.dumps({
+            "status": "200",
+            "busy": self.jobs.busy,
+            "command": running.command if running is not None else None,
+            "job": running.id if running is not None else None,
+            "queued": self.jobs.queued,
+            "teleop": None if self.teleop is None else
+                      {"received": self.teleop.received, "dropped": self.teleop.dropped},
+            "boot": None if self.boot is None else self.boot.to_dict(),
+        })
+
+    def handle_info_request(self):
+        """GET /info: 名字、地址、固件和支持的命令, 也是发现广播的内容。"""
+        return json.dumps({
+            "status": "200",
+            "robot": "quad",
+            "name": self.name,
+            "ip": self.ip,
+            "port": self.port,
+            "udp": self.udp_port,
+            "firmware": FIRMWARE,
+            "commands": binproto.COMMANDS,
+            "ttl": TTL_S,
+        })
+
+    def handle_clock_request(self):
+        """GET /clock: 本地 ticks_ms(), 工作台用它估计时钟偏差 (见 "at")。"""
+        return '{"status": "200", "t": %d}' % utime.ticks_ms()
+
+    def handle_pose_request(self):
+        """GET /pose: 舵机当前角度和动作状态 (工作台按固定频率轮询)。"""
+        running = self.jobs.running
+        return json.dumps({
+            "status": "200",
+            "t": utime.ticks_ms(),
+            "angles": self.robot.pose(self._pose),
+            "command": running.command if running is not None else None,
+            "job": running.id if running is not None else None,
+            "queued": self.jobs.queued,
+            "rest": self.robot.getRestState(),
+        })
+
+    def handle_get_request(self, client_socket, headers, keep, served):
+        """Send the control page, streamed from flash in chunks (or a 304)."""
+        response, path = self.page.head(headers)
+        client_socket.sendall(self.frame_response(response, keep, served))
+        if path is not None:
+            for chunk in self.page.chunks(path):
+                client_socket.sendall(chunk)
 
     def handle_options_request(self):
         """Handle CORS preflight from browser (e.g. Sim on localhost)."""
         return (
             'HTTP/1.1 200 OK\r\n'
             'Access-Control-Allow-Origin: *\r\n'
-            'Access-Control-Allow-Methods: POST, GET, OPTIONS\r\n'
+            'Access-Control-Allow-Methods: POST, GET, DELETE, OPTIONS\r\n'
             'Access-Control-Allow-Headers: Content-Type\r\n'
             'Content-Length: 0\r\n'
             '\r\n'
         )
 
-    def handle_request(self, client_socket):
-        request = client_socket.recv(1024)
-        request_str = request.decode('utf-8')
-        request_lines = request_str.split('\r\n')
-        method, path, _ = request_lines[0].split()
+    def read_body(self, client_socket, post_data, length):
+        """Receive the rest of the body announced by Content-Length."""
+        if length > self.max_body:
+            raise ValueError('body too large')
+        while len(post_data) < length:
+            chunk = client_socket.recv(length - len(post_data))
+            if not chunk:
+                break
+            post_data += chunk
+        return post_data
+
+    def is_stream_request(self, method, path, headers, length):
+        """大的 JSON /control 请求体边收边执行, 不整段读进内存。"""
+        return (method == "POST" and path == "/control" and length > len(self._buf) and
+                not headers.get("content-type", "").startswith(binproto.CONTENT_TYPE))
+
+    def start_stream(self, stream, head):
+        """Queue a streamed customize_action once its envelope ``head`` is known.
+
+        "async" and "at" count when they come before "params" (or when the
+        frames were held, see open_stream). Sets ``stream.job`` or, when the
+        request is refused, ``stream.response``.
+        """
+        command = head.get("command")
+        if command != "customize_action":
+            msg = "only customize_action can be streamed" if command else "missing command"
+            stream.response = self.json_response(json.dumps({"status": "400", "msg": msg}), '400 Bad Request')
+            return
+        stream.wait = not head.get("async", False)
+        print("customize_action (stream)")
+        stream.job, stream.response = self.admit("customize_action", stream.wait, None, self.robot.stream_action,
+                                                 stream.feed.frames(self.robot.wait), at=head.get("at"))
+
+    def open_stream(self, stream):
+        """Called when "params" starts.
+
+        If "command" comes after "params", the frames are held in the
+        scanner and stream_pump starts the motion once the body is complete.
+        """
+        head = stream.scanner.head
+        if "command" in head:
+            self.start_stream(stream, head)
+        elif stream.length <= self.max_body:
+            stream.held = True
+        else:
+            # 帧不能无限地攒在内存里
+            msg = '"command" must come before "params" in bodies over ' + str(self.max_body) + ' bytes'
+            stream.response = self.json_response(json.dumps({"status": "400", "msg": msg}), '400 Bad Request')
+
+    def stream_data(self, stream, chunk):
+        """Scan the next part of a streamed body."""
+        stream.received += len(chunk)
+        if stream.response is not None or stream.error is not None:
+            # 已经拒绝了: 剩下的请求体只收不看, 否则客户端会收到 RST
+            return
+        try:
+            stream.scanner.feed(chunk)
+            if stream.job is None and not stream.held and stream.scanner.head is not None:
+                self.open_stream(stream)
+        except ValueError as e:
+            stream.error = str(e)
+
+    def stream_pump(self, stream):
+        """Hand decoded frames to the motion job; True when none are left waiting."""
+        if stream.held and stream.finished():
+            stream.held = False
+            if stream.error is None:
+                try:
+                    self.start_stream(stream, stream.scanner.envelope())
+                except ValueError as e:
+                    stream.error = str(e)
+        if stream.job is None:
+            return True
+        return pump(stream.scanner, stream.feed, stream.job)
+
+    def finish_stream(self, stream):
+        """Close the feed of a finished, fully pumped stream.
+
+        Returns the response, or None when the caller should wait for
+        ``stream.job`` (a broken body makes the job fail with the error).
+        """
+        stream.feed.close(stream.error)
+        if stream.response is not None:
+            return stream.response
+        if stream.job is None:
+            msg = stream.error or "missing params"
+            return self.json_response(json.dumps({"status": "400", "msg": msg}), '400 Bad Request')
+        if stream.error is None:
+            try:
+                envelope = stream.scanner.envelope()
+            except ValueError:
+                envelope = {}
+            if not stream.wait or envelope.get("async", False):
+                return self.json_response(json.dumps(
+                    {"status": "202", "msg": stream.job.command, "job": stream.job.id}), '202 Accepted')
+        return None
+
+    def read_stream(self, conn):
+        """Receive the next part of the body streaming on ``conn`` (the socket is readable).
+
+        Returns False when the connection must be closed.
+        """
+        stream = conn.stream
+        mv = memoryview(self._buf)
+        try:
+            n = conn.sock.recv_into(mv[:min(len(mv), stream.length - stream.received)])
+        except OSError:
+            n = 0
+        if n:
+            self.stream_data(stream, mv[:n])
+        else:
+            stream.error = "connection closed"
+        return self.advance_stream(conn)
+
+    def advance_stream(self, conn):
+        """Pump the frames of ``conn.stream``; answer or park the request once the body is in.
+
+        Frames are decoded as they arrive and handed to the motion worker
+        through a bounded FrameFeed, so frame 1 runs while later frames are
+        still on the wire and memory use does not grow with the program.
+        While the feed is full the socket is not polled; like a parked
+        request, the stream never blocks the other connections.
+        Returns False when the connection must be closed.
+        """
+        stream = conn.stream
+        if not self.stream_pump(stream):
+            if not stream.paused:
+                # 动作线程还没取走的帧: 先不收后面的数据
+                stream.paused = True
+                self._poller.unregister(conn.sock)
+            return True
+        if stream.paused:
+            stream.paused = False
+            conn.last = utime.ticks_ms()
+            self._poller.register(conn.sock, select.POLLIN)
+        if not stream.finished():
+            return True
+        conn.stream = None
+        conn.keep = conn.keep and stream.received >= stream.length
+        response = self.finish_stream(stream)
+        if response is None:
+            conn.job = stream.job
+            return True
+        conn.served += 1
+        conn.sock.sendall(self.frame_response(response, conn.keep, conn.served))
+        return conn.keep
+
+    def pump_stream(self, conn):
+        """Poll loop side of a streamed request: frames move on even when no data arrives."""
+        try:
+            ok = self.advance_stream(conn)
+        except OSError:
+            ok = False
+        if not ok:
+            self.close_client(conn)
+        elif conn.job is not None:
+            self._poller.unregister(conn.sock)
+        elif conn.stream is None and conn.pending:
+            self.serve_connection(conn, 0)
+
+    def json_response(self, result, status='200 OK', headers=''):
+        return (
+            'HTTP/1.1 ' + status + '\r\n'
+            'Content-Type: application/json\r\n'
+            'Access-Control-Allow-Origin: *\r\n' +
+            headers +
+            '\r\n'
+        ) + result
+
+    def is_motion_request(self, method, path):
+        """会让舵机动起来 (进入动作队列) 的请求。"""
+        return method == "POST" and (path == "/control" or run_name(path) is not None)
 
+    def submit(self, method, path, post_data):
+        """Queue a motion request, see handle_post_request for the return value."""
+        if path == "/control":
+            return self.handle_post_request(post_data)
+        return self.handle_run_request(run_name(path), post_data)
+
+    def respond(self, method, path, post_data):
+        """Route one parsed request and return the full response string.
+
+        Motion requests block until their job is finished (unless asynchronous).
+        Returns None when the answer is the control page, which the caller
+        streams with handle_get_request.
+        """
         if method == "OPTIONS":
-            response = self.handle_options_request()
-
-        elif method == "POST" and path == "/control":
-            post_data = request_lines[-1]
-            body = json.loads(post_data)
-            result = self.handle_post_request(json.dumps(body))
-            response = (
-                'HTTP/1.1 200 OK\r\n'
-                'Content-Type: application/json\r\n'
-                'Access-Control-Allow-Origin: *\r\n'
-                '\r\n'
-            ) + result
+            return self.handle_options_request()
+
+        if self.is_motion_request(method, path):
+            job, response = self.submit(method, path, post_data)
+            if job is not None:
+                response = self.job_response(self.jobs.wait(job))
+            return response
+
+        if path == "/programs" or path.startswith("/programs/"):
+            return self.json_response(self.handle_program_request(method, path[10:], post_data))
+
+        if method == "GET" and path.startswith("/jobs/"):
+            return self.json_response(self.handle_job_request(path[6:]))
+
+        if method == "GET" and path == "/status":
+            return self.json_response(self.handle_status_request())
+
+        if method == "GET" and path == "/pose":
+            return self.json_response(self.handle_pose_request())
+
+        if method == "GET" and path == "/clock":
+            return self.json_response(self.handle_clock_request())
+
+        if method == "GET" and path == "/info":
+            return self.json_response(self.handle_info_request())
+
+        return None
 
+    def frame_response(self, response, keep_alive, served=0):
+        """Encode ``response`` with Content-Length and Connection headers added."""
+        data = response.encode('utf-8')
+        end = data.find(b'\r\n\r\n')
+        head = data[:end]
+        extra = ''
+        if b'\r\nContent-Length:' not in head and not head.startswith(b'HTTP/1.1 304'):
+            extra += '\r\nContent-Length: ' + str(len(data) - end - 4)
+        if keep_alive:
+            extra += '\r\nConnection: keep-alive\r\nKeep-Alive: timeout=%d, max=%d' % (
+                self.idle_timeout, self.max_requests - served)
         else:
-            response = self.handle_get_request()
+            extra += '\r\nConnection: close'
+        return head + extra.encode('utf-8') + data[end:]
 
-        client_socket.send(response.encode('utf-8'))
-        client_socket.close()
+    def busy_response(self):
+        """Sent (then closed) when max_connections connections are already open."""
+        return self.frame_response(self.json_response(
+            json.dumps({"status": "503", "msg": "too many connections"}), '503 Service Unavailable',
+            'Retry-After: 1\r\n'), False)
+
+    def handle_request(self, conn):
+        """Read and answer one request on ``conn`` (a Connection).
+
+        Returns False when the connection must be closed. A motion request
+        that waits for its job does not block the server: it is parked in
+        ``conn.job`` and answered by finish_parked once the job is done. A
+        large /control body is kept in ``conn.stream``, see advance_stream.
+        """
+        client_socket = conn.sock
+        try:
+            request = read_head(client_socket, self._buf, conn.pending)
+            if request is None:
+                # 客户端关闭了连接 (或者连上后什么都没发)
+                return False
+            method, path, version, headers, post_data = request
+            length = content_length(headers)
+            served = conn.served + 1
+            keep = keep_alive(version, headers) and served < self.max_requests
+            if self.is_stream_request(method, path, headers, length):
+                # 大的请求体: 挂在 conn.stream 上, 由 poll 循环边收边交给动作线程
+                conn.pending = post_data[length:]
+                conn.stream = BodyStream(length)
+                conn.keep = keep
+                self.stream_data(conn.stream, post_data[:length])
+                return self.advance_stream(conn)
+            if length > 0:
+                post_data = self.read_body(client_socket, post_data, length)
+            conn.pending = post_data[length:]
+            post_data = post_data[:length]
+            if self.is_motion_request(method, path):
+                job, response = self.submit(method, path, post_data)
+                if job is not None:
+                    conn.job = job
+                    conn.keep = keep
+                    return True
+            else:
+                response = self.respond(method, path, post_data)
+            if response is None:
+                self.handle_get_request(client_socket, headers, keep, served)
+            else:
+                client_socket.sendall(self.frame_response(response, keep, served))
+            conn.served = served
+            return keep
+        except Exception as e:
+            print("request error:", e)
+            return False
+
+    def finish_parked(self, conn):
+        """Answer the parked motion request of ``conn``; False means close."""
+        job = conn.job
+        conn.job = None
+        conn.served += 1
+        try:
+            conn.sock.sendall(self.frame_response(self.job_response(job), conn.keep, conn.served))
+        except OSError:
+            return False
+        return conn.keep
 
     # 创建HTTP服务器
-    def create_server(self):
+    def create_server(self, port=80, backlog=BACKLOG):
+        self.port = port
         # 创建 TCP/IP 套接字
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # 设置套接字选项，允许地址重用
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
         # 绑定套接字到本地地址和端口
-        server_socket.bind(('', 80))
-        # 开始监听传入连接，能够同时处理的最大连接数为 128
-        server_socket.listen(128)
+        server_socket.bind(('', port))
+        # 开始监听传入连接; backlog 不宜太大, 忙的时候宁可让客户端尽快失败重试
+        server_socket.listen(backlog)
         print('HTTP server started!')
 
+        # 用 poll 同时等待新连接和所有 keep-alive 连接, 空闲的连接不会挡住别人;
+        # 等动作结束的请求先挂起 (Connection.job), 期间照常应答 OPTIONS / status
+        self._poller = poller = select.poll()
+        poller.register(server_socket, select.POLLIN)
+        self._clients = clients = {}    # socket -> Connection
+        self._fds = fds = {}            # CPython 的 poll 返回 fd, MicroPython 返回 socket 对象
+        if hasattr(server_socket, 'fileno'):
+            fds[server_socket.fileno()] = server_socket
+        announcer = self.announcer
+        if announcer is not None and announcer.listening:
+            # 发现查询和 HTTP 请求一起 poll, 查询立即回复
+            poller.register(announcer.sock, select.POLLIN)
+            if hasattr(announcer.sock, 'fileno'):
+                fds[announcer.sock.fileno()] = announcer.sock
+        serial = self.serial
+        if serial is not None:
+            # 串口的帧也在这个循环里处理, 不会和 HTTP 请求同时进入处理函数
+            poller.register(serial.stream, select.POLLIN)
+            if hasattr(serial.stream, 'fileno'):
+                fds[serial.stream.fileno()] = serial.stream
+        while True:
+            parked = [c for c in clients.values() if c.job is not None]
+            streams = [c for c in clients.values() if c.stream is not None]
+            waiting = parked or streams or (serial is not None and serial.parked)
+            for obj, event in poller.poll(WAIT_POLL_MS if waiting else POLL_MS):
+                sock = fds.get(obj, obj)
+                if sock is server_socket:
+                    # 接受一个客户端连接
+                    client_socket, addr = server_socket.accept()
+                    if len(clients) >= self.max_connections:
+                        self.reject(client_socket)
+                        continue
+                    client_socket.settimeout(self.timeout)
+                    clients[client_socket] = Connection(client_socket)
+                    if hasattr(client_socket, 'fileno'):
+                        fds[client_socket.fileno()] = client_socket
+                    poller.register(client_socket, select.POLLIN)
+                elif announcer is not None and sock is announcer.sock:
+                    announcer.receive()
+                elif serial is not None and sock is serial.stream:
+                    if not serial.receive():
+                        poller.unregister(serial.stream)
+                        serial = None
+                elif sock in clients and clients[sock].job is None:
+                    # 处理客户端请求
+                    self.serve_connection(clients[sock], event)
+            # 流式请求体: 动作线程取走了帧就继续收
+            for conn in streams:
+                if conn.stream is not None and conn.sock in clients:
+                    self.pump_stream(conn)
+            # 动作结束了的挂起请求: 回复, 然后继续处理这个连接上流水线的请求
+            for conn in parked:
+                if conn.job.done():
+                    if self.finish_parked(conn):
+                        poller.register(conn.sock, select.POLLIN)
+                        conn.last = utime.ticks_ms()
+                        if conn.pending:
+                            self.serve_connection(conn, 0)
+                    else:
+                        self.close_client(conn)
+            if serial is not None:
+                serial.poll()
+            if announcer is not None:
+                announcer.poll()
+            # 关闭空闲超时的 keep-alive 连接
+            now = utime.ticks_ms()
+            for conn in [c for c in clients.values() if c.job is None and
+                         not (c.stream is not None and c.stream.paused) and
+                         utime.ticks_diff(now, c.last) > self.idle_timeout * 1000]:
+                self.close_client(conn)
+
+    def reject(self, client_socket):
+        """Answer 503 to a connection over max_connections and close it."""
+        try:
+            client_socket.settimeout(0.2)
+            # 先把请求收掉, 带着未读数据 close 会让客户端收到 RST 而不是 503
+            client_socket.recv_into(self._buf)
+        except OSError:
+            pass
+        try:
+            client_socket.sendall(self.busy_response())
+        except OSError:
+            pass
+        client_socket.close()
+
+    def serve_connection(self, conn, event):
+        """Answer the request(s) that arrived on ``conn``, closing it when done."""
+        if event & (select.POLLHUP | select.POLLERR):
+            self.close_client(conn)
+            return
         while True:
-            # 接受一个客户端连接
-            client_socket, addr = server_socket.accept()
-            # 处理客户端请求
-            self.handle_request(client_socket)
+            try:
+                ok = self.read_stream(conn) if conn.stream is not None else self.handle_request(conn)
+            except Exception as e:
+                print("request error:", e)
+                ok = False
+            if not ok:
+                self.close_client(conn)
+                return
+            conn.last = utime.ticks_ms()
+            if conn.job is not None:
+                # 挂起: 动作结束前不再读这个连接
+                self._poller.unregister(conn.sock)
+                return
+            if conn.stream is not None or not conn.pending:
+                # 请求体还没收完 (等下一次 poll), 或者没有流水线的请求
+                return
+            # 流水线: 下一个请求已经 (部分) 收到了, 接着处理
+
+    def close_client(self, conn):
+        sock = conn.sock
+        if conn.stream is not None:
+            # 请求体收不完了: 正在等帧的动作出错结束
+            conn.stream.feed.close("connection closed")
+            conn.stream = None
+        try:
+            self._poller.unregister(sock)
+        except (KeyError, OSError, ValueError):
+            pass    # 挂起的连接已经不在 poll 里了
+        del self._clients[sock]
+        if hasattr(sock, 'fileno'):
+            self._fds.pop(sock.fileno(), None)
+        sock.close()
+
+
+class Connection:
+    """State of one client connection of the blocking server."""
+
+    __slots__ = ('sock', 'last', 'served', 'pending', 'job', 'keep', 'stream')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.last = utime.ticks_ms()     # 最后活动时间
+        self.served = 0                  # 已回复的请求数
+        self.pending = b''               # 已收到的下一个 (流水线) 请求的字节
+        self.job = None                  # 挂起的请求在等的动作
+        self.keep = False                # 挂起的请求回复后是否保持连接
+        self.stream = None               # 正在接收的流式请求体 (BodyStream)
+
+
+class BodyStream:
+    """A /control body that is still arriving, fed frame by frame to a customize_action."""
+
+    __slots__ = ('scanner', 'feed', 'length', 'received', 'held', 'paused', 'wait', 'job', 'response', 'error')
+
+    def __init__(self, length):
+        self.scanner = FrameScanner()
+        self.feed = FrameFeed()
+        self.length = length
+        self.received = 0
+        self.held = False       # "command" 在 "params" 后面, 帧先留在 scanner 里
+        self.paused = False     # feed 满了, 暂时不收
+        self.wait = True
+        self.job = None
+        self.response = None    # 拒绝时的回复, 请求体收完再发
+        self.error = None
+
+    def finished(self):
+        """The whole body was received, or receiving it failed."""
+        return self.error is not None or self.received >= self.length
@@ -0,0 +1,179 @@
+# -- 异步 HTTP 服务器 (ESP32 上用 uasyncio, Linux 上用 asyncio)
+#
+# RobotWifi.create_server 一次只处理一个请求, 而且整个步态在 handle_request
+# 里跑完才回复, 一个慢的 TCP 客户端就能卡住所有人。这里每个连接一个协程, 读请求有超时; 动作在 MotionQueue 的
+# 后台线程执行, 运动期间仍然可以应答 OPTIONS / GET / status。
+#
+# 用法 (main.py):
+#     from robot_wifi_async import AsyncRobotWifi
+#     robot_wifi = AsyncRobotWifi(robot=robot)
+#     ...
+#     robot_wifi.create_server()
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from robot_wifi import BACKLOG, BodyStream, RobotWifi
+from request_stream import content_length, keep_alive
+
+ANNOUNCE_POLL_S = 0.1   # 多久检查一次发现查询和广播时间 (见 announce.py)
+
+
+async def open_reader(stream):
+    """A StreamReader on a serial stream: uasyncio wraps it directly, asyncio needs a pipe transport."""
+    if not hasattr(asyncio, 'StreamReaderProtocol'):
+        return asyncio.StreamReader(stream)
+    reader = asyncio.StreamReader()
+    await asyncio.get_event_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream)
+    return reader
+
+
+class AsyncRobotWifi(RobotWifi):
+
+    def __init__(self, robot, html_path='index.html', timeout=5, max_body=16 * 1024, **kwargs):
+        # timeout: 每个连接读请求的超时 (秒); keep-alive 的参数见 RobotWifi
+        super().__init__(robot, html_path, max_body=max_body, timeout=timeout, **kwargs)
+        self.connections = 0
+
+    async def read_head(self, reader, timeout=None):
+        """Read the request line and headers.
+
+        Returns ``(method, path, version, headers)``, or None on EOF. The
+        request line may take ``timeout`` seconds (the keep-alive idle time).
+        """
+        line = await asyncio.wait_for(reader.readline(), timeout or self.timeout)
+        if not line:
+            return None
+        method, path, version = line.decode('utf-8').split()
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if not line or line == b'\r\n':
+                break
+            name, _, value = line.decode('utf-8').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, path, version, headers
+
+    async def read_body(self, reader, length):
+        if length > self.max_body:
+            raise ValueError('body too large')
+        if length <= 0:
+            return b''
+        return await asyncio.wait_for(reader.readexactly(length), self.timeout)
+
+    async def stream_control(self, reader, length):
+        """Async version of RobotWifi.advance_stream: returns ``(response, complete)``."""
+        stream = BodyStream(length)
+        try:
+            while not stream.finished():
+                chunk = await asyncio.wait_for(
+                    reader.read(min(len(self._buf), length - stream.received)), self.timeout)
+                if not chunk:
+                    stream.error = "connection closed"
+                    break
+                self.stream_data(stream, chunk)
+                while not self.stream_pump(stream):
+                    await asyncio.sleep(0.005)
+        except asyncio.TimeoutError:
+            stream.error = "timeout"
+        while not self.stream_pump(stream):
+            await asyncio.sleep(0.005)
+        response = self.finish_stream(stream)
+        if response is None:
+            response = self.job_response(await self.jobs.wait_async(stream.job))
+        return response, stream.received >= length
+
+    async def serve_request(self, reader, writer, served):
+        """Answer one request, returns True when the connection stays open."""
+        request = await self.read_head(reader, self.idle_timeout if served else None)
+        if request is None:
+            return False
+        method, path, version, headers = request
+        length = content_length(headers)
+        keep = keep_alive(version, headers) and served + 1 < self.max_requests
+        if self.is_stream_request(method, path, headers, length):
+            response, complete = await self.stream_control(reader, length)
+            keep = keep and complete
+        elif self.is_motion_request(method, path):
+            job, response = self.submit(method, path, await self.read_body(reader, length))
+            if job is not None:
+                response = self.job_response(await self.jobs.wait_async(job))
+        else:
+            response = self.respond(method, path, await self.read_body(reader, length))
+            if response is None:
+                await self.send_page(writer, headers, keep, served + 1)
+                return keep
+        writer.write(self.frame_response(response, keep, served + 1))
+        await writer.drain()
+        return keep
+
+    async def send_page(self, writer, headers, keep, served):
+        """Async version of RobotWifi.handle_get_request."""
+        response, path = self.page.head(headers)
+        writer.write(self.frame_response(response, keep, served))
+        await writer.drain()
+        if path is not None:
+            for chunk in self.page.chunks(path):
+                # 复制一份: 流可能在 drain 之后才真正发送, 而缓冲区马上会被下一块覆盖
+                writer.write(bytes(chunk))
+                await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        self.connections += 1
+        try:
+            if self.connections > self.max_connections:
+                # 先把请求收掉, 带着未读数据 close 会让客户端收到 RST 而不是 503
+                try:
+                    await asyncio.wait_for(reader.read(len(self._buf)), 0.2)
+                except asyncio.TimeoutError:
+                    pass
+                writer.write(self.busy_response())
+                await writer.drain()
+                return
+            served = 0
+            # keep-alive: 同一个连接上依次处理请求, 流水线的请求由 StreamReader 缓冲
+            while await self.serve_request(reader, writer, served):
+                served += 1
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            print("request error:", e)
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def serve(self, port=80, backlog=BACKLOG):
+        self.port = port
+        self.server = await asyncio.start_server(self.handle_client, '0.0.0.0', port, backlog=backlog)
+        print('HTTP server (async) started!')
+        if self.serial is not None:
+            asyncio.create_task(self.serve_serial())
+        while self.announcer is not None:
+            self.announcer.poll()
+            await asyncio.sleep(ANNOUNCE_POLL_S)
+        while True:
+            await asyncio.sleep(3600)
+
+    async def serve_serial(self):
+        """串口的帧在事件循环里处理 (见 serial_link.py), 不和 HTTP 请求并发。"""
+        serial = self.serial
+        reader = await open_reader(serial.stream)
+        while True:
+            data = await reader.read(64)
+            if not data:
+                return      # 串口被关闭 (Linux 上的伪终端)
+            for seq, job in serial.feed(data):
+                asyncio.create_task(self.reply_serial(seq, job))
+
+    async def reply_serial(self, seq, job):
+        await self.jobs.wait_async(job)
+        self.serial.reply(seq, job)
+
+    def create_server(self, port=80, backlog=BACKLOG):
+        asyncio.run(self.serve(port, backlog))
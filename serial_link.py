@@ -0,0 +1,192 @@
+# -- USB 串口控制通道
+#
+# 一个教室里几十台机器人连同一个 AP 时, HTTP 控制的延迟会大到没法用。这里在
+# USB 串口 (和 REPL 共用的那个 UART) 上跑一个带帧头的二进制协议, 命令和
+# POST /control 完全一样 (JSON 或 binproto 请求体, 交给
+# RobotWifi.handle_post_request), 回复是同样的 JSON。
+#
+# 帧格式 (两个方向相同, 小端):
+#     sync 0xA5 0x5A | kind u8 | seq u8 | length u16 | payload | crc32 u32
+# crc32 覆盖 kind 到 payload 结尾。帧之间的其它字节 (print 的输出等) 直接跳过。
+#     kind 1 control: payload 是 /control 请求体
+#     kind 2 status:  payload 为空, 回复 GET /status 的内容
+#     kind 3 pose:    payload 为空, 回复 GET /pose 的内容
+#     kind 4 clock:   payload 为空, 回复 GET /clock 的内容
+#     回复的 kind 是请求的 kind | 0x80, seq 相同, payload 是 JSON 回复体
+#
+# 帧在 HTTP 服务器自己的循环里处理 (RobotWifi 把串口和 socket 一起 poll,
+# AsyncRobotWifi 用一个协程轮询), 不另开线程: ActionCache、录制器和动作队列
+# 都没有加锁, 不能和 HTTP 请求同时调用。动作请求不会阻塞串口: 等动作结束的
+# 请求先挂起, 期间照常处理 stop / status。
+# 启动后 Ctrl-C 不再打断程序 (字节 0x03 可能出现在帧里), 要回到 REPL 请复位。
+
+try:
+    import uselect as select
+except ImportError:
+    import select
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
+import json
+import struct
+
+SYNC = b'\xa5\x5a'
+HEADER_FMT = '<BBH'     # kind, seq, length (在 sync 之后)
+HEADER_SIZE = 6
+CRC_SIZE = 4
+CONTROL = 1
+STATUS = 2
+POSE = 3
+CLOCK = 4
+REPLY = 0x80
+
+
+def _crc(head, payload):
+    return binascii.crc32(payload, binascii.crc32(head)) & 0xFFFFFFFF
+
+
+def encode(kind, seq, payload):
+    """One frame around ``payload`` (bytes)."""
+    head = struct.pack(HEADER_FMT, kind, seq, len(payload))
+    return SYNC + head + payload + struct.pack('<I', _crc(head, payload))
+
+
+class FrameReader:
+    """Incremental frame decoder fed one byte at a time."""
+
+    def __init__(self, max_payload):
+        self.max_payload = max_payload
+        self.errors = 0
+        self._head = bytearray(HEADER_SIZE - 2)
+        self._body = None
+        self._pos = 0
+
+    def feed(self, byte):
+        """Consume one byte; returns ``(kind, seq, payload)`` when a frame is complete."""
+        pos = self._pos
+        if pos < 2:
+            if byte == SYNC[pos]:
+                self._pos = pos + 1
+            else:
+                self._pos = 1 if byte == SYNC[0] else 0
+            return None
+        if pos < HEADER_SIZE:
+            self._head[pos - 2] = byte
+            self._pos = pos + 1
+            if self._pos == HEADER_SIZE:
+                length = struct.unpack_from('<H', self._head, 2)[0]
+                if length > self.max_payload:
+                    self.errors += 1
+                    self._pos = 0
+                    return None
+                self._body = bytearray(length + CRC_SIZE)
+            return None
+        body = self._body
+        body[pos - HEADER_SIZE] = byte
+        self._pos = pos + 1
+        if self._pos < HEADER_SIZE + len(body):
+            return None
+        self._pos = 0
+        self._body = None
+        n = len(body) - CRC_SIZE
+        payload = bytes(body[:n])
+        if _crc(self._head, payload) != struct.unpack_from('<I', body, n)[0]:
+            self.errors += 1
+            return None
+        return self._head[0], self._head[1], payload
+
+
+class SerialLink:
+    """Serve /control over a byte stream, by default the USB UART (stdin / stdout).
+
+    ``server`` is the RobotWifi (or AsyncRobotWifi) whose handlers run the
+    commands; both transports share its motion queue and caches. The
+    server's loop hands it the bytes: RobotWifi calls receive() when
+    ``stream`` is readable and poll() on every round, AsyncRobotWifi reads
+    the stream itself and calls feed() and reply().
+    """
+
+    def __init__(self, server, stream=None, out=None):
+        if stream is None:
+            import sys
+            import micropython
+            micropython.kbd_intr(-1)
+            stream = sys.stdin.buffer
+            out = sys.stdout.buffer
+        self.server = server
+        self.stream = stream
+        self.out = out if out is not None else stream
+        self.reader = FrameReader(server.max_body)
+        self.served = 0
+        self.parked = []    # (seq, job): 同步动作请求, 动作结束后回复
+        self._poller = select.poll()
+        self._poller.register(stream, select.POLLIN)
+
+    def start(self):
+        """Serve on the server's loop (next to the WiFi clients), from create_server() on."""
+        self.server.serial = self
+
+    def send(self, kind, seq, response):
+        """Reply with the JSON body of the HTTP ``response`` string."""
+        body = response[response.find('\r\n\r\n') + 4:]
+        self.out.write(encode(kind | REPLY, seq, body.encode('utf-8')))
+        self.served += 1
+
+    def handle(self, kind, seq, payload):
+        """Run one request; returns the job to wait for, or None once answered."""
+        server = self.server
+        if kind == CONTROL:
+            job, response = server.handle_post_request(payload)
+            if job is not None:
+                return job
+        elif kind == STATUS:
+            response = server.json_response(server.handle_status_request())
+        elif kind == POSE:
+            response = server.json_response(server.handle_pose_request())
+        elif kind == CLOCK:
+            response = server.json_response(server.handle_clock_request())
+        else:
+            response = server.json_response('{"status": "400", "msg": "unknown kind"}')
+        self.send(kind, seq, response)
+        return None
+
+    def feed(self, data):
+        """Handle the frames completed by ``data``; returns ``(seq, job)`` of the motions to answer later."""
+        parked = []
+        for byte in data:
+            frame = self.reader.feed(byte)
+            if frame is None:
+                continue
+            kind, seq, _ = frame
+            try:
+                job = self.handle(*frame)
+            except Exception as e:
+                # 不能 print: 这个 UART 就是协议通道, 错误作为这一帧的回复发回去
+                self.send(kind, seq, self.server.json_response(
+                    json.dumps({"status": "500", "msg": "serial error: " + str(e)})))
+                continue
+            if job is not None:
+                parked.append((seq, job))
+        return parked
+
+    def receive(self):
+        """Handle the bytes waiting on the stream (RobotWifi's loop); False once it is closed."""
+        while self._poller.poll(0):
+            data = self.stream.read(1)
+            if not data:
+                return False    # 串口被关闭 (Linux 上的伪终端)
+            self.parked.extend(self.feed(data))
+        return True
+
+    def reply(self, seq, job):
+        """Answer a parked motion request once its job is done."""
+        self.send(CONTROL, seq, self.server.job_response(job))
+
+    def poll(self):
+        """Answer the parked motion requests whose job is done."""
+        for item in self.parked[:]:
+            seq, job = item
+            if job.done():
+                self.parked.remove(item)
+                self.reply(seq, job)
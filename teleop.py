@@ -0,0 +1,166 @@
+# -- UDP 遥控通道 (摇杆 / 姿态)
+#
+# 控制页面每按一次按钮就是一个新的 TCP 连接加一个阻塞的步态调用, 不适合实时
+# 遥控。这里在 UDP 端口上接收固定格式的小数据报, 由动作线程以控制频率
+# (默认 50 Hz) 直接驱动舵机:
+#   * 速度设定 (前进 / 转向), 步态相位在本地连续推进;
+#   * 完整的 8 个舵机角度。
+# 每个数据报带序号, 旧的或乱序到达的直接丢弃; 超过 HOLD_MS 没收到数据就停止
+# 迈步 (死人开关), 超过 SESSION_MS 结束遥控并回到 home。stop 会打断遥控,
+# 之后要等发送端停下 SESSION_MS 才会重新开始。
+#
+# 数据报 16 字节 (小端):
+#     magic u8 'T' | kind u8 | seq u32 | 负载 10 字节
+#     kind 1 速度: vx int16, wz int16 (千分比 -1000..1000), 步态周期 u16 ms (0 = 默认), 4 字节保留
+#     kind 2 姿态: 8 x 角度 u8, 2 字节保留
+#     kind | 0x80: 请求确认, 数据报生效的那个控制周期回复 6 字节 magic | 3 | seq
+
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+import math
+import struct
+import utime
+
+TELEOP_PORT = 8888
+MAGIC = 0x54
+VELOCITY = 1
+POSE = 2
+ACK = 3
+ACK_REQUEST = 0x80
+HEADER_FMT = '<BBI'
+HEADER_SIZE = 6
+DATAGRAM_SIZE = 16
+VELOCITY_FMT = '<hhH'
+POSE_FMT = '<8B'
+
+CONTROL_MS = 20        # 控制周期
+HOLD_MS = 300          # 速度设定的有效期 (死人开关)
+SESSION_MS = 1000      # 这么久没有数据报就结束遥控
+GAIT_PERIOD = 800      # 默认步态周期 (ms), 同 Quad.forward
+
+
+class Teleop:
+    """UDP setpoint listener plus the control loop that applies it.
+
+    ``poll()`` is the MotionQueue idle hook: when a fresh datagram arrives
+    while the robot is idle it queues ``run()`` as a "teleop" job, which then
+    reads the socket itself every control tick. The job ends (and goes home)
+    when the sender goes quiet, when an HTTP motion is queued, or on stop.
+    """
+
+    def __init__(self, robot, jobs, port=TELEOP_PORT):
+        self.robot = robot
+        self.jobs = jobs
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', port))
+        self.sock.setblocking(False)
+        self.kind = None
+        self.vx = 0
+        self.wz = 0
+        self.period = GAIT_PERIOD
+        self.pose = bytearray([90] * 8)
+        self.received = 0
+        self.dropped = 0
+        self._seq = None
+        self._last_rx = utime.ticks_ms()
+        self._fresh = False
+        self._ack = None
+        self._suspended = False
+
+    def receive(self):
+        """Drain the socket and keep the newest valid setpoint."""
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(DATAGRAM_SIZE)
+            except OSError:
+                return
+            if len(data) != DATAGRAM_SIZE:
+                self.dropped += 1
+                continue
+            magic, kind, seq = struct.unpack_from(HEADER_FMT, data)
+            ack = kind & ACK_REQUEST
+            kind &= 0x7F
+            if magic != MAGIC or kind not in (VELOCITY, POSE) or not self._newer(seq):
+                self.dropped += 1
+                continue
+            if self._suspended:
+                # stop 之后, 发送端停下来之前的数据报都不执行
+                self._seq = seq
+                self._last_rx = utime.ticks_ms()
+                self.dropped += 1
+                continue
+            self._seq = seq
+            self._last_rx = utime.ticks_ms()
+            self.received += 1
+            self.kind = kind
+            if kind == VELOCITY:
+                self.vx, self.wz, period = struct.unpack_from(VELOCITY_FMT, data, HEADER_SIZE)
+                self.period = period or GAIT_PERIOD
+            else:
+                for i, a in enumerate(struct.unpack_from(POSE_FMT, data, HEADER_SIZE)):
+                    self.pose[i] = a if a <= 180 else 180
+            self._fresh = True
+            self._ack = (seq, addr) if ack else None
+
+    def _newer(self, seq):
+        if self._seq is None or utime.ticks_diff(utime.ticks_ms(), self._last_rx) > SESSION_MS:
+            # 新的遥控会话 (或发送端重启了), 任何序号都接受
+            return True
+        d = (seq - self._seq) & 0xFFFFFFFF
+        return 0 < d < 0x80000000
+
+    def poll(self):
+        """MotionQueue idle hook: start a teleop job on a fresh setpoint."""
+        if self._suspended and utime.ticks_diff(utime.ticks_ms(), self._last_rx) > SESSION_MS:
+            self._suspended = False
+        self.receive()
+        if self._fresh:
+            self._fresh = False
+            self.jobs.submit("teleop", self.run)
+
+    def _send_ack(self):
+        if self._ack is not None:
+            seq, addr = self._ack
+            self._ack = None
+            try:
+                self.sock.sendto(struct.pack(HEADER_FMT, MAGIC, ACK, seq), addr)
+            except OSError:
+                pass
+
+    def run(self):
+        """Control loop, runs as a motion job until the session ends."""
+        robot = self.robot
+        angles = [90] * 8
+        phase = 0.0
+        last = utime.ticks_ms()
+        try:
+            while True:
+                start = utime.ticks_ms()
+                self.receive()
+                silent = utime.ticks_diff(start, self._last_rx)
+                if silent > SESSION_MS or self.jobs.queued:
+                    break
+                if self.kind == POSE:
+                    robot.set_pose(self.pose)
+                else:
+                    vx, wz = (self.vx, self.wz) if silent <= HOLD_MS else (0, 0)
+                    if vx or wz:
+                        phase += 2 * math.pi * utime.ticks_diff(start, last) / self.period
+                    robot.gait_pose(vx / 1000, wz / 1000, phase, angles)
+                    robot.set_pose(angles)
+                last = start
+                self._fresh = False
+                self._send_ack()
+                robot.wait(max(1, CONTROL_MS - utime.ticks_diff(utime.ticks_ms(), start)))
+            robot.home()
+        except Exception:
+            job = self.jobs.running
+            if job is not None and job.cancelled:
+                # 被 stop 打断: 发送端停下 SESSION_MS 之前不再自动开始遥控
+                self._suspended = True
+                self._fresh = False
+            # 其它异常是真正的错误, MotionQueue 记成 job 出错并打印
+            raise
@@ -0,0 +1,74 @@
+from action import HOME, HOME_DURATION, compile_action, compile_frames
+
+LEGS = {'FR': (115, 120), 'FL': (65, 60)}
+
+
+def resolve(legs):
+    angles = list(HOME)
+    if 'FR' in legs:
+        angles[0], angles[3] = legs['FR']
+    if 'FL' in legs:
+        angles[1], angles[2] = legs['FL']
+    return angles
+
+
+def played(action):
+    # frames() 复用同一个列表, 要复制
+    return [(d, list(a)) for d, a in action.frames()]
+
+
+def test_round_trip_angles():
+    params = [
+        {'duration': 300, 'angles': [90, 90, 90, 90, 90, 90, 90, 90]},
+        {'duration': 200, 'angles': [115, 115, 120, 120, 90, 90, 60, 60]},
+        {'duration': 400, 'angles': [40, 140, 30, 150, 90, 90, 90, 90]},
+    ]
+    action = compile_action(params, resolve)
+    assert played(action) == [(f['duration'], f['angles']) for f in params]
+    assert action.home
+    assert action.duration_ms() == 900 + HOME_DURATION
+
+
+def test_round_trip_semantic_legs():
+    action = compile_action([{'duration': 250, 'legs': LEGS}, {'angles': list(HOME)}], resolve)
+    assert played(action) == [(250, resolve(LEGS)), (500, list(HOME))]
+    assert not action.home
+
+
+def test_clamps_angles_and_defaults_duration():
+    action = compile_action([{'duration': 0, 'angles': [-10, 200, 90, 90, 90, 90, 90, 90]}], resolve)
+    assert played(action) == [(500, [0, 180, 90, 90, 90, 90, 90, 90])]
+
+
+def test_collinear_frames_merge():
+    a = [90] * 8
+    b = [100] * 8
+    c = [110] * 8
+    action = compile_frames([(100, a), (100, b), (100, c)])
+    assert played(action) == [(100, a), (200, c)]
+
+
+def test_large_delta_is_split():
+    action = compile_frames([(100, [0] * 8), (300, [180] * 8)])
+    frames = played(action)
+    assert len(frames) == 3
+    assert frames[-1][1] == [180] * 8
+    assert sum(d for d, _ in frames[1:]) == 300
+    assert action.duration_ms() == 400 + HOME_DURATION
+
+
+def test_long_first_frame_is_split_not_truncated():
+    pose = [120] * 8
+    action = compile_frames([(150000, pose), (1000, list(HOME))])
+    frames = played(action)
+    assert [d for d, _ in frames] == [50000, 50000, 50000, 1000]
+    # 只有第 1 份移动到起点, 后面几份原地保持
+    assert all(angles == pose for _, angles in frames[:3])
+    assert frames[-1][1] == list(HOME)
+    assert action.duration_ms() == 151000
+
+
+def test_empty_program_only_goes_home():
+    action = compile_frames([])
+    assert len(action) == 0
+    assert action.duration_ms() == HOME_DURATION
@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+
+import clock_sync
+from clock_sync import TICK_ERROR_MS, TICKS_PERIOD, RobotClock
+
+
+def probes(monkeypatch, samples):
+    """Patch now_ms; ``samples`` are (t0, robot ticks, t1) per probe, then time stands still."""
+    times = itertools.chain([t for t0, _, t1 in samples for t in (t0, t1)], itertools.repeat(samples[-1][2]))
+    ticks = iter([tick for _, tick, _ in samples])
+    monkeypatch.setattr(clock_sync, 'now_ms', lambda: next(times))
+    return lambda: next(ticks)
+
+
+def test_offset_from_fastest_probe(monkeypatch):
+    clock = RobotClock('r', None, samples=3)
+    # 第 2 次往返最短 (4 ms): offset = 5002 - (1000 + 1004) / 2
+    clock.probe = probes(monkeypatch, [(0, 4000, 30), (1000, 5002, 1004), (2000, 6100, 2020)])
+    clock.sync()
+    assert clock.offset == 4000
+    assert clock.rtt == 4
+    assert clock.synced == 1002
+    assert clock.drift == 0
+    assert clock.to_robot(1500) == 5500
+    assert clock.error_ms(1002) == 2 + TICK_ERROR_MS
+
+
+def test_failed_probes_are_skipped(monkeypatch):
+    clock = RobotClock('r', None, samples=2)
+    ticks = iter([OSError('timeout'), 700])
+    times = iter([0, 100, 102])
+
+    def probe():
+        value = next(ticks)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    monkeypatch.setattr(clock_sync, 'now_ms', lambda: next(times))
+    clock.probe = probe
+    clock.sync()
+    assert (clock.offset, clock.rtt) == (599, 2)
+
+
+def test_all_probes_failing_raises(monkeypatch):
+    clock = RobotClock('r', None, samples=2)
+
+    def probe():
+        raise OSError('unreachable')
+    monkeypatch.setattr(clock_sync, 'now_ms', lambda: 0)
+    clock.probe = probe
+    with pytest.raises(OSError):
+        clock.sync()
+    assert clock.errors == 1 and clock.synced is None
+
+
+def test_drift_across_the_tick_wrap(monkeypatch):
+    clock = RobotClock('r', None, samples=1)
+    start = TICKS_PERIOD - 1000
+    clock.probe = probes(monkeypatch, [(0, start, 2)])
+    clock.sync()
+    # 10 s 后机器人多走了 1 ms (100 ppm), ticks_ms() 已经回绕
+    clock.probe = probes(monkeypatch, [(10000, (start + 10000 + 1) % TICKS_PERIOD, 10002)])
+    clock.sync()
+    assert clock.drift == pytest.approx(1 / 10000)
+    assert clock.to_robot(20001) == pytest.approx((start + 20002) % TICKS_PERIOD, abs=1)
+    assert 0 <= clock.to_robot(20001) < TICKS_PERIOD
@@ -0,0 +1,128 @@
+import json
+import threading
+
+import pytest
+
+from command_queue import QueueFull, RobotQueue
+
+TIMEOUT = 5
+
+
+class Robot:
+    """send() for a RobotQueue; every command blocks until released."""
+
+    def __init__(self):
+        self.sent = []
+        self.started = threading.Semaphore(0)
+        self._release = {}
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def send(self, command, params, binary, at):
+        with self._lock:
+            self.sent.append(command)
+            release = self._release.setdefault(command, threading.Event())
+            if self.closed:
+                release.set()
+        self.started.release()
+        assert release.wait(TIMEOUT)
+        return 200, 'application/json', json.dumps({'msg': command}).encode()
+
+    def release(self, command):
+        with self._lock:
+            self._release.setdefault(command, threading.Event()).set()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            for release in self._release.values():
+                release.set()
+
+    def wait_started(self, n=1):
+        for _ in range(n):
+            assert self.started.acquire(timeout=TIMEOUT)
+
+
+@pytest.fixture
+def robot():
+    robot = Robot()
+    yield robot
+    robot.close()
+
+
+def reply(ticket):
+    assert ticket.pending.wait(TIMEOUT)
+    status, _, body = ticket.wait()
+    return status, json.loads(body)['msg']
+
+
+def test_identical_commands_coalesce(robot):
+    queue = RobotQueue('r', robot.send, window=60)
+    running = queue.submit('dance')
+    robot.wait_started()
+    first = queue.submit('forward', {'steps': 2})
+    second = queue.submit('forward', {'steps': 2})
+    other = queue.submit('forward', {'steps': 3})
+    assert second.coalesced and second.pending is first.pending
+    assert not other.coalesced
+    assert (first.depth, second.depth, other.depth) == (1, 2, 2)
+
+    for command in ('dance', 'forward'):
+        robot.release(command)
+    assert reply(running) == (200, 'dance')
+    assert reply(first) == reply(second) == (200, 'forward')
+    reply(other)
+    assert robot.sent == ['dance', 'forward', 'forward']
+    assert queue.stats()['coalesced'] == 1
+
+
+def test_commands_with_at_never_coalesce(robot):
+    queue = RobotQueue('r', robot.send, window=60)
+    queue.submit('dance')
+    robot.wait_started()
+    first = queue.submit('forward', at=100)
+    second = queue.submit('forward', at=100)
+    assert second.pending is not first.pending
+
+
+def test_home_jumps_the_queue(robot):
+    queue = RobotQueue('r', robot.send, window=0)
+    running = queue.submit('dance')
+    robot.wait_started()
+    waiting = [queue.submit('forward'), queue.submit('backward')]
+    home = queue.submit('home')
+    for ticket in waiting:
+        assert reply(ticket) == (409, 'cancelled: ' + ticket.pending.command)
+    for command in ('dance', 'home'):
+        robot.release(command)
+    reply(running)
+    assert reply(home) == (200, 'home')
+    assert robot.sent == ['dance', 'home']
+
+
+def test_stop_is_sent_beside_the_running_motion(robot):
+    queue = RobotQueue('r', robot.send, window=0)
+    running = queue.submit('dance')
+    robot.wait_started()
+    waiting = queue.submit('forward')
+    stop = queue.submit('stop')
+    assert reply(waiting)[0] == 409
+    robot.wait_started()
+    assert robot.sent == ['dance', 'stop']
+    robot.release('stop')
+    assert reply(stop) == (200, 'stop')
+    assert not running.pending.done()
+    robot.release('dance')
+    reply(running)
+    assert queue.stats()['cancelled'] == 1
+
+
+def test_queue_limit(robot):
+    queue = RobotQueue('r', robot.send, window=0, limit=2)
+    queue.submit('dance')
+    robot.wait_started()
+    queue.submit('forward')
+    queue.submit('backward')
+    with pytest.raises(QueueFull):
+        queue.submit('hello')
+    assert queue.stats()['rejected'] == 1
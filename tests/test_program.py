@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from action import HOME
+from program import ProgramStore
+
+STEPS = [
+    {'kind': 'command', 'command': 'forward', 'params': {'steps': 2, 't': 800}},
+    {'kind': 'repeat', 'times': 2, 'steps': [
+        {'kind': 'command', 'command': 'customize_action', 'params': [{'duration': 300, 'angles': [100] * 8}]},
+        {'kind': 'wait', 'ms': 100},
+    ]},
+]
+
+
+class Robot:
+    def __init__(self):
+        self.calls = []
+
+    def _angles_from_semantic(self, legs):
+        return list(HOME)
+
+    def forward(self, steps, t):
+        self.calls.append(('forward', steps, t))
+
+    def play_action(self, action):
+        self.calls.append(('play', len(action)))
+
+    def wait(self, ms):
+        self.calls.append(('wait', ms))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProgramStore(Robot(), str(tmp_path))
+
+
+def upload(steps, checksum=None):
+    data = {'steps': steps}
+    if checksum is not None:
+        data['checksum'] = checksum
+    return json.dumps(data).encode()
+
+
+def test_same_checksum_is_a_no_op(store):
+    assert store.save('walk', upload(STEPS, 'v1'))
+    assert not store.save('walk', upload(STEPS, 'v1'))
+    # 校验和由客户端决定, 相同就不再写 flash
+    assert not store.save('walk', upload([], 'v1'))
+    assert store.save('walk', upload([], 'v2'))
+    assert store.checksum('walk') == 'v2'
+
+
+def test_body_hash_without_checksum(store):
+    assert store.save('walk', upload(STEPS))
+    checksum = store.checksum('walk')
+    assert len(checksum) == 64
+    assert not store.save('walk', upload(STEPS))
+    assert store.save('walk', upload(STEPS[:1]))
+    assert store.checksum('walk') != checksum
+
+
+def test_index_survives_a_restart(store, tmp_path):
+    store.save('walk', upload(STEPS, 'v1'))
+    again = ProgramStore(store.robot, str(tmp_path))
+    assert not again.save('walk', upload(STEPS, 'v1'))
+    again.run('walk')
+    assert again.robot.calls == [('forward', 2, 800), ('play', 1), ('wait', 100), ('play', 1), ('wait', 100)]
+
+
+def test_invalid_names(store):
+    for name in ('', 'index', 'a/b', 'x' * 33):
+        with pytest.raises(ValueError):
+            store.save(name, upload(STEPS))
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from request_stream import FrameScanner
+
+FRAMES = [
+    {'duration': 300, 'angles': [90, 90, 90, 90, 90, 90, 90, 90]},
+    {'duration': 200, 'legs': {'FR': 'forward'}, 'note': 'a "quoted" ] } string'},
+]
+
+
+def scan(body, chunk):
+    scanner = FrameScanner()
+    for i in range(0, len(body), chunk):
+        scanner.feed(body[i:i + chunk])
+    return scanner
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 4096])
+def test_command_before_params(chunk):
+    body = json.dumps({'command': 'customize_action', 'params': FRAMES, 'at': 1234}).encode()
+    scanner = scan(body, chunk)
+    assert scanner.frames == FRAMES
+    assert scanner.head == {'command': 'customize_action', 'params': []}
+    assert scanner.envelope() == {'command': 'customize_action', 'params': [], 'at': 1234}
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 4096])
+def test_command_after_params(chunk):
+    body = json.dumps({'params': FRAMES, 'command': 'customize_action', 'async': True}).encode()
+    scanner = scan(body, chunk)
+    assert scanner.frames == FRAMES
+    # 数组开始时还没收到 "command", 只能从 envelope() 拿
+    assert scanner.head == {'params': []}
+    assert scanner.envelope() == {'params': [], 'command': 'customize_action', 'async': True}
+
+
+def test_body_without_params():
+    scanner = scan(b'{"command": "forward", "params": {"steps": 2}}', 5)
+    assert scanner.frames == []
+    assert scanner.envelope() == {'command': 'forward', 'params': {'steps': 2}}
+
+
+def test_unterminated_params():
+    scanner = scan(b'{"command": "customize_action", "params": [{"duration": 1}', 3)
+    with pytest.raises(ValueError):
+        scanner.envelope()
+
+
+def test_params_must_hold_objects():
+    with pytest.raises(ValueError):
+        scan(b'{"params": [1, 2]}', 1)
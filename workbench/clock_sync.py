@@ -0,0 +1,160 @@
+"""Offset between the workbench's clock and each robot's ``utime.ticks_ms()``.
+
+Dispatching to several robots at once still leaves WiFi jitter (often
+tens of ms) between their starts. Instead a command can carry ``"at"``,
+a robot-local tick to start on; the robot admits it right away and holds
+until then. To compute that tick the workbench estimates each robot's
+clock NTP-style: a burst of GET /clock probes, each timed on the
+workbench side, keeping the one with the smallest round trip, so
+
+    offset = robot ticks - midpoint of the probe
+    error  <= round trip / 2 + 1 ms (tick resolution) + drift since the burst
+
+Bursts repeat every ``interval`` seconds while a robot is in use; two
+bursts give the drift rate between the crystals.
+"""
+import threading
+import time
+
+TICKS_PERIOD = 1 << 30      # MicroPython ticks_ms() wraps here
+SAMPLES = 8
+INTERVAL = 30.0
+FORGET = 600.0              # stop refreshing a robot unused this long
+TICK_ERROR_MS = 1.0
+LEAD_MS = 250               # "sync": true starts this far ahead
+
+
+def now_ms():
+    return time.monotonic() * 1000
+
+
+def start_time(body):
+    """Workbench time (now_ms) a request wants its motion to start, or None.
+
+    ``"startAt"`` is wall-clock ms (JavaScript Date.now()), ``"startIn"``
+    ms from now, ``"sync": true`` means LEAD_MS from now. Raises ValueError.
+    """
+    try:
+        if body.get('startAt') is not None:
+            return now_ms() + float(body['startAt']) - time.time() * 1000
+        if body.get('startIn') is not None:
+            return now_ms() + float(body['startIn'])
+    except (TypeError, ValueError):
+        raise ValueError('startAt / startIn must be numbers')
+    if body.get('sync'):
+        return now_ms() + LEAD_MS
+    return None
+
+
+def _wrap(delta):
+    """``delta`` folded into [-TICKS_PERIOD / 2, TICKS_PERIOD / 2)."""
+    return (delta + TICKS_PERIOD // 2) % TICKS_PERIOD - TICKS_PERIOD // 2
+
+
+class RobotClock:
+    """Clock estimate for one robot. ``probe()`` returns its ticks_ms()."""
+
+    def __init__(self, target, probe, samples=SAMPLES):
+        self.target = target
+        self.probe = probe
+        self.samples = samples
+        self.offset = None      # robot ticks - workbench ms, at ``synced``
+        self.rtt = None
+        self.drift = 0.0        # ms of offset change per ms
+        self.synced = None
+        self.used = now_ms()
+        self.syncs = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """One burst of probes; raises when none of them got an answer."""
+        best = None
+        failure = None
+        for _ in range(self.samples):
+            t0 = now_ms()
+            try:
+                ticks = self.probe()
+            except Exception as e:
+                failure = e
+                continue
+            t1 = now_ms()
+            if best is None or t1 - t0 < best[0]:
+                best = (t1 - t0, ticks - (t0 + t1) / 2, (t0 + t1) / 2)
+        if best is None:
+            self.errors += 1
+            raise failure
+        rtt, offset, at = best
+        with self._lock:
+            if self.synced is not None and at - self.synced > 1000:
+                # 两次校准之间偏差的变化就是两个晶振的频率差, 取滑动平均
+                drift = _wrap(offset - self.offset) / (at - self.synced)
+                self.drift = drift if self.syncs < 2 else (self.drift + drift) / 2
+            self.offset, self.rtt, self.synced = offset, rtt, at
+            self.syncs += 1
+
+    def to_robot(self, ms):
+        """Robot ticks_ms() at workbench time ``ms`` (see now_ms)."""
+        with self._lock:
+            self.used = now_ms()
+            return int(round(ms + self.offset + self.drift * (ms - self.synced))) % TICKS_PERIOD
+
+    def error_ms(self, ms=None):
+        """Upper bound of the estimate's error at workbench time ``ms``."""
+        if self.synced is None:
+            return None
+        age = (now_ms() if ms is None else ms) - self.synced
+        # 漂移率本身也只是估计, 按它的一半计入误差
+        return self.rtt / 2 + TICK_ERROR_MS + abs(self.drift) * age / 2
+
+    def stats(self):
+        if self.synced is None:
+            return {'synced': False, 'syncs': self.syncs, 'errors': self.errors}
+        return {'synced': True, 'offset_ms': round(self.offset % TICKS_PERIOD, 1), 'rtt_ms': round(self.rtt, 2),
+                'drift_ppm': round(self.drift * 1e6, 1), 'error_ms': round(self.error_ms(), 2),
+                'age_s': round((now_ms() - self.synced) / 1000, 1), 'syncs': self.syncs, 'errors': self.errors}
+
+
+class ClockSync:
+    """RobotClock per robot target, refreshed every ``interval`` seconds."""
+
+    def __init__(self, interval=INTERVAL, samples=SAMPLES):
+        self.interval = interval
+        self.samples = samples
+        self._clocks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def clock(self, target, probe):
+        """The robot's synchronized clock; the first call runs a burst (blocking)."""
+        with self._lock:
+            clock = self._clocks.get(target)
+            if clock is None:
+                clock = self._clocks[target] = RobotClock(target, probe, self.samples)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._refresh, daemon=True)
+                self._thread.start()
+        if clock.synced is None:
+            clock.sync()
+        return clock
+
+    def get(self, target):
+        return self._clocks.get(target)
+
+    def _refresh(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                clocks = list(self._clocks.values())
+            for clock in clocks:
+                if now_ms() - clock.used > FORGET * 1000:
+                    continue
+                try:
+                    clock.sync()
+                except Exception as e:
+                    print(f'clock sync {clock.target}: {e}')
+
+    def stats(self):
+        with self._lock:
+            clocks = list(self._clocks.values())
+        return {c.target: c.stats() for c in clocks}
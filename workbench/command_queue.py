@@ -0,0 +1,216 @@
+"""Per-robot command queue in the workbench proxy.
+
+A robot runs one motion at a time (and by default answers 503 to a second
+synchronous one), so forwarding concurrent /api/control requests for the
+same robot in parallel only moves the queue into the robot's TCP backlog,
+where nobody can see or cancel it. Here every robot gets one ordered queue
+and one sender thread:
+
+* a command identical to the last pending one (same command, params and
+  encoding) that arrives within ``window`` of it rides along and gets the
+  same reply, so ten quick clicks on one button become one motion;
+* ``home`` cancels everything pending and goes next; ``stop`` cancels
+  everything pending and is sent at once, beside the running motion, so
+  the robot can preempt it;
+* each request learns the queue depth it found and how long it waited.
+
+A command may carry ``at``, the robot-local tick to start on
+(clock_sync.py); such commands are never coalesced.
+"""
+import collections
+import json
+import threading
+import time
+
+COALESCE_WINDOW = 0.3   # seconds
+QUEUE_LIMIT = 16        # pending commands per robot before QueueFull
+LINGER = 30.0           # an idle sender thread waits this long for more commands
+
+JUMP = ('home',)        # cancels pending commands and runs next
+PREEMPT = ('stop',)     # cancels pending commands and is sent right away
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Pending:
+    """One command to send; every request coalesced into it shares the reply."""
+
+    def __init__(self, command, params, binary, at=None):
+        self.command = command
+        self.params = params
+        self.binary = binary
+        self.at = at
+        self.queued = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.riders = 0
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def finish(self, result=None, error=None):
+        with self._lock:
+            self.finished = time.monotonic()
+            self.result = result
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def add_done_callback(self, fn):
+        """Call ``fn(pending)`` when the reply is there (from the sender thread)."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """True once the reply is there."""
+        return self._done.wait(timeout)
+
+
+class Ticket:
+    """A request's view of its queued command."""
+
+    def __init__(self, pending, depth, coalesced):
+        self.pending = pending
+        self.arrived = time.monotonic()
+        self.depth = depth
+        self.coalesced = coalesced
+
+    def wait(self, timeout=None):
+        """``(status, content type, body)``; raises the transport error, if any."""
+        self.pending.wait(timeout)
+        if self.pending.error is not None:
+            raise self.pending.error
+        return self.pending.result
+
+    def wait_ms(self):
+        started = self.pending.started
+        return 0 if started is None else max(0, round((started - self.arrived) * 1000))
+
+    def headers(self):
+        return {'X-Queue-Depth': str(self.depth), 'X-Queue-Wait-Ms': str(self.wait_ms()),
+                'X-Queue-Coalesced': '1' if self.coalesced else '0'}
+
+
+def _cancelled(command):
+    body = json.dumps({'status': '409', 'msg': 'cancelled: ' + command}).encode('utf-8')
+    return 409, 'application/json', body
+
+
+class RobotQueue:
+    """Ordered commands for one robot target (base URL or serial port).
+
+    ``send(command, params, binary, at)`` forwards one command and returns
+    ``(status, content type, body)``; it runs on the queue's thread.
+    """
+
+    def __init__(self, target, send, window=COALESCE_WINDOW, limit=QUEUE_LIMIT):
+        self.target = target
+        self.send = send
+        self.window = window
+        self.limit = limit
+        self.running = None
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = None
+        self.counts = {'submitted': 0, 'sent': 0, 'coalesced': 0, 'cancelled': 0, 'rejected': 0}
+        self.max_wait_ms = 0
+
+    def submit(self, command, params=None, binary=False, at=None):
+        """Queue a command; returns a Ticket, raises QueueFull."""
+        with self._lock:
+            self.counts['submitted'] += 1
+            depth = len(self._pending) + (self.running is not None)
+            if command in JUMP or command in PREEMPT:
+                self._cancel_pending()
+            if command in PREEMPT:
+                item = Pending(command, params, binary)
+                threading.Thread(target=self._send, args=(item,), daemon=True).start()
+                return Ticket(item, depth, False)
+            last = self._pending[-1] if self._pending else None
+            if (last is not None and last.command == command and last.params == params and last.binary == binary
+                    and at is None and last.at is None and time.monotonic() - last.queued <= self.window):
+                last.riders += 1
+                self.counts['coalesced'] += 1
+                return Ticket(last, depth, True)
+            if len(self._pending) >= self.limit:
+                self.counts['rejected'] += 1
+                raise QueueFull(f'{len(self._pending)} commands pending for {self.target}')
+            item = Pending(command, params, binary, at)
+            self._pending.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True)
+                self._thread.start()
+            else:
+                self._wake.notify()
+            return Ticket(item, depth, False)
+
+    def _cancel_pending(self):
+        while self._pending:
+            item = self._pending.popleft()
+            self.counts['cancelled'] += 1 + item.riders
+            item.finish(_cancelled(item.command))
+
+    def _work(self):
+        # 空闲时线程不退出, 下一条命令 (比如多台机器人同时发送) 不用等新线程启动
+        while True:
+            with self._lock:
+                if not self._wake.wait_for(lambda: self._pending, LINGER):
+                    self._thread = None
+                    return
+                item = self._pending.popleft()
+                self.running = item
+            self._send(item)
+            with self._lock:
+                self.running = None
+
+    def _send(self, item):
+        item.started = time.monotonic()
+        with self._lock:
+            self.counts['sent'] += 1
+            self.max_wait_ms = max(self.max_wait_ms, round((item.started - item.queued) * 1000))
+        try:
+            result = self.send(item.command, item.params, item.binary, item.at)
+        except Exception as e:
+            item.finish(error=e)
+        else:
+            item.finish(result)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, depth=len(self._pending), max_wait_ms=self.max_wait_ms,
+                        running=self.running.command if self.running is not None else None)
+
+
+class CommandQueues:
+    """RobotQueue per robot target."""
+
+    def __init__(self, window=COALESCE_WINDOW, limit=QUEUE_LIMIT):
+        self.window = window
+        self.limit = limit
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def queue(self, target, send):
+        with self._lock:
+            queue = self._queues.get(target)
+            if queue is None:
+                queue = self._queues[target] = RobotQueue(target, send, self.window, self.limit)
+            return queue
+
+    def stats(self):
+        with self._lock:
+            queues = list(self._queues.values())
+        return {q.target: q.stats() for q in queues}
@@ -0,0 +1,311 @@
+"""Finding robots on the LAN: UDP announcements plus a subnet scan.
+
+Robots (announce.py) broadcast their GET /info to ANNOUNCE_PORT every
+2 s; Listener records them and, when it starts, asks every robot to
+answer at once (QUERY to DISCOVERY_PORT). Robots on older firmware, or on
+networks that drop broadcasts, are found by Scanner: GET /info (then
+/status) on every address of a subnet, at most ``concurrency`` probes at
+a time and ``rate`` new connections per second so a scan does not flood a
+small access point. The periodic scan is a fallback: it is skipped while
+announcements arrive, unless a network to scan was given. Both feed a
+Registry whose entries expire when a robot has not been heard from for
+its TTL.
+"""
+import concurrent.futures
+import http.client
+import ipaddress
+import json
+import socket
+import threading
+import time
+
+ANNOUNCE_PORT = 8890        # same numbers as announce.py
+DISCOVERY_PORT = 8889
+QUERY = b'QUAD?'
+TTL = 10.0                  # announcements without a "ttl"
+SCAN_INTERVAL = 60.0
+QUERY_WAIT = 1.0            # replies to the start-up query arrive before the first scan decision
+SCAN_TTL = 150.0            # robots only the scan finds: two missed scans
+CONCURRENCY = 64
+RATE = 250.0                # new probe connections per second
+PROBE_TIMEOUT = 0.6
+MAX_HOSTS = 1024            # /22 at most
+
+
+def base_url(host, port):
+    return f'http://{host}' if port in (None, 80) else f'http://{host}:{port}'
+
+
+class Registry:
+    """Robots by base URL, each dropped ``ttl`` seconds after it was last seen."""
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self._robots = {}
+        self._lock = threading.Lock()
+        self.last_announce = None
+        self.counts = {'announcements': 0, 'probes_found': 0, 'added': 0, 'expired': 0}
+
+    def seen(self, host, info, source, ttl=None):
+        """Record ``info`` (GET /info reply) from the robot at ``host``."""
+        port = info.get('port') or 80
+        url = base_url(host, port)
+        try:
+            ttl = float(ttl if ttl is not None else info.get('ttl') or self.ttl)
+        except (TypeError, ValueError):
+            ttl = self.ttl
+        now = time.monotonic()
+        with self._lock:
+            self.counts['announcements' if source == 'announce' else 'probes_found'] += 1
+            if source == 'announce':
+                self.last_announce = now
+            entry = self._robots.get(url)
+            if entry is None:
+                self.counts['added'] += 1
+                entry = self._robots[url] = {'baseUrl': url, 'first_seen': time.time()}
+            entry.update(name=info.get('name'), ip=host, port=port, firmware=info.get('firmware'),
+                         commands=info.get('commands'), source=source, last_seen=time.time())
+            # 广播和扫描都找到时, 以更长的有效期为准
+            entry['_expires'] = max(entry.get('_expires', 0), now + ttl)
+
+    def announced(self, within):
+        """True when an announcement arrived in the last ``within`` seconds."""
+        last = self.last_announce
+        return last is not None and time.monotonic() - last < within
+
+    def _expire(self, now):
+        for url in [u for u, e in self._robots.items() if e['_expires'] <= now]:
+            del self._robots[url]
+            self.counts['expired'] += 1
+
+    def robots(self):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entries = sorted(self._robots.values(), key=lambda e: (e['name'] or '', e['baseUrl']))
+            return [dict({k: v for k, v in e.items() if k != '_expires'},
+                         expires_in_s=round(e['_expires'] - now, 1)) for e in entries]
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return dict(self.counts, robots=len(self._robots))
+
+
+class Listener:
+    """Receives robot announcements on ``port`` (a daemon thread)."""
+
+    def __init__(self, registry, port=ANNOUNCE_PORT, query_port=DISCOVERY_PORT):
+        self.registry = registry
+        self.port = port
+        self.query_port = query_port
+        self.sock = None
+        self.invalid = 0
+
+    def start(self):
+        """Bind and start listening; raises OSError when the port is taken."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(('', self.port))
+        self.sock = sock
+        threading.Thread(target=self._run, daemon=True).start()
+        self.query()
+
+    def query(self, target='255.255.255.255'):
+        """Ask every robot to announce itself now (replies come to ``port``)."""
+        try:
+            self.sock.sendto(QUERY, (target, self.query_port))
+        except OSError as e:
+            print(f'discovery query: {e}')
+
+    def _run(self):
+        while True:
+            data, addr = self.sock.recvfrom(4096)
+            try:
+                info = json.loads(data)
+            except ValueError:
+                info = None
+            if not isinstance(info, dict) or info.get('robot') is None:
+                self.invalid += 1
+                continue
+            self.registry.seen(addr[0], info, 'announce')
+
+
+class _Pacer:
+    """Spaces calls to ``wait()`` at least ``1 / rate`` seconds apart (any thread)."""
+
+    def __init__(self, rate):
+        self.gap = 1.0 / rate
+        self.next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = self.next = max(self.next, now)
+            self.next += self.gap
+        if at > now:
+            time.sleep(at - now)
+
+
+def probe(host, port=80, timeout=PROBE_TIMEOUT):
+    """GET /info info of a robot at ``host``, or None when it is not one.
+
+    Firmware without /info answers /status, which is recognized by its
+    "busy" field.
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        for path in ('/info', '/status'):
+            conn.request('GET', path)
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status != 200:
+                continue
+            try:
+                info = json.loads(body)
+            except ValueError:
+                # 老固件对不认识的 GET 回复控制页面
+                continue
+            if isinstance(info, dict) and info.get('robot') is not None:
+                return info
+            if isinstance(info, dict) and 'busy' in info:
+                return {'robot': 'quad', 'port': port}
+        return None
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+
+
+def hosts(network):
+    """Host addresses of ``network`` (e.g. '192.168.2.0/24'); raises ValueError."""
+    net = ipaddress.ip_network(network, strict=False)
+    if net.version != 4:
+        raise ValueError('only IPv4 networks can be scanned')
+    if net.num_addresses > MAX_HOSTS + 2:
+        raise ValueError(f'{network} has more than {MAX_HOSTS} hosts')
+    return [str(h) for h in net.hosts()] or [str(net.network_address)]
+
+
+def local_network():
+    """The /24 of the interface that routes to the outside, or None."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # connect() on UDP sends nothing, it only picks the route
+        sock.connect(('10.255.255.255', 1))
+        ip = sock.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        sock.close()
+    if ip.startswith('127.'):
+        return None
+    return str(ipaddress.ip_network(ip + '/24', strict=False))
+
+
+class ScanBusy(Exception):
+    pass
+
+
+class Scanner:
+    """Probes every host of a subnet with bounded concurrency and rate."""
+
+    def __init__(self, registry, port=80, concurrency=CONCURRENCY, rate=RATE, timeout=PROBE_TIMEOUT,
+                 ttl=SCAN_TTL):
+        self.registry = registry
+        self.port = port
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.ttl = ttl
+        self.last = None
+        self._lock = threading.Lock()
+
+    def scan(self, network):
+        """Scan ``network`` and return a summary; raises ScanBusy during another scan."""
+        targets = hosts(network)
+        if not self._lock.acquire(blocking=False):
+            raise ScanBusy('a scan is already running')
+        try:
+            started = time.monotonic()
+            pacer = _Pacer(self.rate)
+
+            def check(host):
+                pacer.wait()
+                info = probe(host, self.port, self.timeout)
+                if info is not None:
+                    self.registry.seen(host, info, 'scan', self.ttl)
+                return info is not None
+
+            workers = min(self.concurrency, len(targets))
+            with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='scan') as pool:
+                found = sum(pool.map(check, targets))
+            self.last = {'network': network, 'hosts': len(targets), 'found': found,
+                         'seconds': round(time.monotonic() - started, 2), 'at': time.time()}
+            return self.last
+        finally:
+            self._lock.release()
+
+
+class Discovery:
+    """Registry fed by a Listener and a Scanner repeated every ``scan_interval`` seconds.
+
+    ``listen_port=None`` turns announcements off, ``scan_interval=0`` the
+    periodic scan (POST /api/robots/scan still works). Without ``network``
+    the periodic scan probes the local /24, and only while no robot has
+    announced itself within TTL; with it, every time.
+    """
+
+    def __init__(self, listen_port=ANNOUNCE_PORT, network=None, scan_interval=SCAN_INTERVAL, scan_port=80,
+                 concurrency=CONCURRENCY, rate=RATE):
+        self.registry = Registry()
+        self.listener = Listener(self.registry, listen_port) if listen_port else None
+        self.network = network
+        self.scan_interval = scan_interval
+        self.scanner = Scanner(self.registry, scan_port, concurrency, rate,
+                               ttl=max(SCAN_TTL, 2.5 * scan_interval))
+        self.skipped = 0
+
+    def start(self):
+        if self.listener is not None:
+            try:
+                self.listener.start()
+            except OSError as e:
+                print(f'discovery: cannot listen on UDP {self.listener.port} ({e}), scan only')
+                self.listener = None
+        if self.scan_interval:
+            threading.Thread(target=self._rescan, daemon=True).start()
+
+    def _rescan(self):
+        if self.listener is not None:
+            time.sleep(QUERY_WAIT)
+        while True:
+            if self.network or not self.registry.announced(TTL):
+                try:
+                    self.scan()
+                except (ScanBusy, ValueError) as e:
+                    print(f'discovery scan: {e}')
+            else:
+                # 机器人在广播, 不用每分钟探测整个子网
+                self.skipped += 1
+            time.sleep(self.scan_interval)
+
+    def scan(self, network=None):
+        """Scan ``network`` (default: --scan or the local /24); raises ValueError, ScanBusy."""
+        network = network or self.network or local_network()
+        if network is None:
+            raise ValueError('no network to scan, pass one')
+        if self.listener is not None:
+            self.listener.query()
+        return self.scanner.scan(network)
+
+    def robots(self):
+        return self.registry.robots()
+
+    def stats(self):
+        return dict(self.registry.stats(), listening=self.listener is not None,
+                    invalid=self.listener.invalid if self.listener is not None else 0,
+                    network=self.network or local_network(), last_scan=self.scanner.last,
+                    scans_skipped=self.skipped)
@@ -0,0 +1,110 @@
+"""One /api/control command or program for several robots at once.
+
+A request names its robots with ``"baseUrls": [...]`` or a ``"group"``
+defined on the command line (``--group dance=http://10.0.0.5,http://10.0.0.6``)
+instead of ``"baseUrl"``. The command goes into every robot's command
+queue back to back, so each queue's sender thread dispatches it as soon as
+that robot is free; the reply lists every robot's result, its latency and
+how long after the first robot it was sent (the dispatch spread).
+"""
+MAX_ROBOTS = 32
+
+
+def parse_groups(specs, normalize):
+    """``['name=url,url', ...]`` -> ``{name: [base urls]}``; raises ValueError."""
+    groups = {}
+    for spec in specs or ():
+        name, sep, urls = spec.partition('=')
+        if not sep or not name.strip():
+            raise ValueError(f'group must be NAME=URL[,URL...]: {spec!r}')
+        groups[name.strip()] = _robots([u for u in urls.split(',') if u.strip()], normalize)
+    return groups
+
+
+def _robots(urls, normalize):
+    robots = []
+    for url in urls:
+        base_url = normalize(url) if isinstance(url, str) else ''
+        if not base_url:
+            raise ValueError(f'invalid robot url: {url!r}')
+        if base_url not in robots:
+            robots.append(base_url)
+    if not robots:
+        raise ValueError('no robots')
+    if len(robots) > MAX_ROBOTS:
+        raise ValueError(f'more than {MAX_ROBOTS} robots')
+    return robots
+
+
+def targets(body, groups, normalize):
+    """Robots named by a request body, or None for a single-robot request.
+
+    Raises ValueError for an unknown group or a bad list.
+    """
+    if body.get('group') is not None:
+        robots = groups.get(body['group'])
+        if robots is None:
+            raise ValueError(f'unknown group: {body["group"]!r}')
+        return robots
+    urls = body.get('baseUrls')
+    if urls is None:
+        return None
+    if not isinstance(urls, list):
+        raise ValueError('baseUrls must be a list')
+    return _robots(urls, normalize)
+
+
+def summarize(robots, tickets, decode, clocks=None):
+    """Aggregate reply for a fanned-out command.
+
+    ``tickets`` holds, per robot, the command queue Ticket or the
+    exception that kept the command out of the queue (QueueFull).
+    ``decode`` turns a robot's reply body into an object. With ``clocks``
+    (a timed start, clock_sync.RobotClock per robot) every robot also
+    gets the estimated error of its start time.
+    """
+    started = [t.pending.started for t in tickets if not isinstance(t, Exception) and t.pending.started]
+    first = min(started) if started else None
+    results = []
+    for robot, ticket in zip(robots, tickets):
+        if isinstance(ticket, Exception):
+            results.append({'robot': robot, 'status': 429, 'ok': False, 'msg': str(ticket)})
+            continue
+        pending = ticket.pending
+        entry = {'robot': robot, 'wait_ms': ticket.wait_ms(), 'coalesced': ticket.coalesced}
+        if pending.started is not None:
+            entry['dispatch_ms'] = round((pending.started - first) * 1000, 1)
+        if not pending.done():
+            entry.update(status=504, msg='timeout')
+        elif pending.error is not None:
+            entry.update(status=502, msg=str(pending.error))
+        else:
+            status, _, body = pending.result
+            entry.update(status=status, reply=decode(body))
+            entry['latency_ms'] = round((pending.finished - pending.started) * 1000, 1)
+        entry['ok'] = entry['status'] < 400
+        results.append(entry)
+    ok = sum(r['ok'] for r in results)
+    reply = {
+        'status': '200' if ok == len(results) else '207',
+        'ok': ok,
+        'failed': len(results) - ok,
+        'spread_ms': round((max(started) - first) * 1000, 1) if started else None,
+        'robots': results,
+    }
+    if clocks:
+        for entry, clock in zip(results, clocks):
+            entry['sync_error_ms'] = round(clock.error_ms(), 1)
+        # 两台机器人之间最多相差各自误差之和
+        errors = sorted(entry['sync_error_ms'] for entry in results)
+        reply['sync_error_ms'] = round(errors[-1] + (errors[-2] if len(errors) > 1 else 0), 1)
+    return reply
+
+
+def timeout(body, default):
+    """Per-robot timeout of a request in seconds (``"timeout"``, at most ``default``)."""
+    try:
+        seconds = float(body.get('timeout', default))
+    except (TypeError, ValueError):
+        return default
+    return min(max(seconds, 0.0), default)
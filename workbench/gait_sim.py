@@ -0,0 +1,275 @@
+"""Timing-accurate previews of robot commands (POST /api/simulate).
+
+The page's "simulate only" mode used to wait a fixed 120 ms per block, so
+its timeline had nothing to do with how long forward(steps=3, t=800) or
+frog_jump() take on the robot. Here the robot's own quad.py, oscillator.py
+and action.py run unchanged in the proxy process, with ``utime``,
+``machine`` and ``micropython`` replaced by stubs: ``utime`` is a virtual
+clock that only moves when the gait code sleeps, so a 2.4 s gait takes a
+few ms of CPU and its duration is exactly what the control loop asks for.
+Servo writes are tapped (Oscillator.SetTap, like recorder.py) for the
+final pose and an optional timeline.
+
+WiFi, the robot's job queue and the robot's own CPU time per control tick
+are not modelled: durations are those of the gait code on an ideal clock.
+Every command starts from a freshly initialized robot (durations and
+final poses of the gaits do not depend on the start pose), so results are
+cached per (command, params). Editing quad.py, oscillator.py or action.py
+reloads them and empties the cache.
+"""
+import builtins
+import collections
+import json
+import os
+import threading
+
+from runner import compile_steps
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCES = ('action', 'recorder', 'oscillator', 'quad', 'program')
+PINS = (12, 16, 25, 18, 13, 17, 26, 19)     # same as main.py; the stub PWM ignores them
+# commands that move the robot; init, start_recording, replay etc. are not previewed
+COMMANDS = (
+    'home', 'customize_action', 'forward', 'backward', 'turn_L', 'turn_R', 'omni_walk',
+    'dance', 'front_back', 'moonwalk_L', 'up_down', 'push_up', 'hello', 'wave_hand',
+    'hide', 'scared', 'relax', 'relax2', 'frog_jump', 'walk',
+)
+MAX_MS = 60000          # virtual time of one command, like runner.MAX_WAIT_MS
+SPIN_CALLS = 1000       # ticks_ms() calls without a sleep count as 1 ms of busy-waiting
+CACHE_SIZE = 256
+
+
+class SimulationTooLong(ValueError):
+    pass
+
+
+class VirtualClock:
+    """Stands in for ``utime`` (and ``time`` in oscillator.py): ms advance only in sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._spins = 0
+
+    def reset(self):
+        self.now = 0.0
+        self._spins = 0
+
+    def _advance(self, ms):
+        self.now += ms
+        self._spins = 0
+        if self.now > MAX_MS:
+            raise SimulationTooLong(f'motion longer than {MAX_MS // 1000} s')
+
+    def ticks_ms(self):
+        self._spins += 1
+        if self._spins > SPIN_CALLS:
+            self._advance(1)
+        return int(self.now)
+
+    def ticks_us(self):
+        return int(self.now * 1000)
+
+    def ticks_add(self, ticks, delta):
+        return ticks + delta
+
+    def ticks_diff(self, a, b):
+        return a - b
+
+    def sleep_ms(self, ms):
+        self._advance(max(0, ms))
+
+    def sleep_us(self, us):
+        self._advance(max(0, us) / 1000)
+
+    def sleep(self, seconds):
+        self._advance(max(0, seconds) * 1000)
+
+
+class _PWM:
+    def __init__(self, pin, freq=50):
+        self.freq = freq
+
+    def duty(self, value=None):
+        return 0
+
+    def deinit(self):
+        pass
+
+
+class _Machine:
+    @staticmethod
+    def Pin(pin, *args, **kwargs):
+        return pin
+
+    PWM = _PWM
+
+
+class _MicroPython:
+    @staticmethod
+    def const(value):
+        return value
+
+
+class _Tap:
+    """Oscillator tap: the 8 commanded angles, one timeline entry per ms with writes."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.pose = [90] * 8
+        self.timeline = []
+
+    def write(self, index, angle):
+        now = int(self.clock.now)
+        self.pose[index] = int(angle)
+        if self.timeline and self.timeline[-1][0] == now:
+            self.timeline[-1][1][index] = int(angle)
+        else:
+            self.timeline.append([now, list(self.pose)])
+
+
+def _load(clock):
+    """quad.py and the robot modules it imports, as private modules bound to ``clock``."""
+    stubs = {'utime': clock, 'time': clock, 'machine': _Machine, 'micropython': _MicroPython}
+    modules = {}
+
+    def robot_import(name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in stubs:
+            return stubs[name]
+        if level == 0 and name in modules:
+            return modules[name]
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    env = dict(vars(builtins), __import__=robot_import)
+    for name in SOURCES:
+        path = os.path.join(ROOT, name + '.py')
+        with open(path, encoding='utf-8') as f:
+            code = compile(f.read(), path, 'exec')
+        module = type(builtins)('_sim_' + name)
+        module.__file__ = path
+        module.__builtins__ = env
+        exec(code, module.__dict__)
+        modules[name] = module
+    return modules
+
+
+class Simulator:
+    """Runs commands on a stubbed Quad and caches the results (thread safe)."""
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = VirtualClock()
+        self._modules = None
+        self._mtimes = None
+        self.counts = {'hits': 0, 'misses': 0, 'reloads': 0, 'errors': 0}
+
+    def _sources_changed(self):
+        mtimes = tuple(os.stat(os.path.join(ROOT, name + '.py')).st_mtime_ns for name in SOURCES)
+        changed = mtimes != self._mtimes
+        self._mtimes = mtimes
+        return changed
+
+    def simulate(self, command, params=None):
+        """``{"command", "duration_ms", "segments", "final_pose", "timeline"}``; raises ValueError.
+
+        The returned dict is shared with the cache, do not modify it.
+        """
+        if command not in COMMANDS:
+            raise ValueError(f'cannot simulate {command!r}')
+        try:
+            key = (command, json.dumps(params, sort_keys=True))
+        except (TypeError, ValueError):
+            raise ValueError('params must be JSON')
+        with self._lock:
+            if self._sources_changed():
+                if self._modules is not None:
+                    self.counts['reloads'] += 1
+                self._modules = _load(self._clock)
+                self._cache.clear()
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.counts['hits'] += 1
+                return result
+            self.counts['misses'] += 1
+            try:
+                result = self._run(command, params)
+            except Exception as e:
+                self.counts['errors'] += 1
+                if isinstance(e, ValueError):
+                    raise
+                # 参数名或类型不对 (TypeError 等), 和机器人上一样是请求的问题
+                raise ValueError(f'{command}: {e}')
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return result
+
+    def _run(self, command, params):
+        clock = self._clock
+        clock.reset()
+        quad = self._modules['quad'].Quad()
+        quad.init(*PINS)
+        tap = _Tap(clock)
+        for i, servo in enumerate(quad._servo):
+            servo.SetTap(tap, i)
+        segments = []
+        depth = [0]
+
+        def timed(kind, fn):
+            def run(*args, **kwargs):
+                depth[0] += 1
+                started = clock.now
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    depth[0] -= 1
+                    if depth[0] == 0:
+                        segments.append({'kind': kind, 'at_ms': int(started), 'ms': int(clock.now - started)})
+            return run
+
+        # 实例属性覆盖类的方法, quad.py 内部的 self.xxx() 调用也会经过这里
+        quad.oscillateServos = timed('oscillate', quad.oscillateServos)
+        quad._moveServos = timed('move', quad._moveServos)
+        quad.wait = timed('wait', quad.wait)
+        self._modules['program'].call_command(quad, command, params)
+        return {'command': command, 'duration_ms': int(clock.now), 'segments': segments,
+                'final_pose': quad.pose(), 'timeline': tap.timeline}
+
+    def simulate_steps(self, steps):
+        """A compiled program (runner.compile_steps): each step's start, duration and pose."""
+        out, now, pose = [], 0, [90] * 8
+        for index, step in enumerate(steps):
+            if step['kind'] == 'wait':
+                out.append({'index': index, 'kind': 'wait', 'at_ms': now, 'ms': step['ms']})
+                now += step['ms']
+                continue
+            result = self.simulate(step['command'], step.get('params'))
+            pose = result['final_pose']
+            out.append({'index': index, 'kind': 'command', 'command': step['command'], 'at_ms': now,
+                        'ms': result['duration_ms'], 'final_pose': pose})
+            now += result['duration_ms']
+        return {'duration_ms': now, 'steps': out, 'final_pose': pose}
+
+    def preview(self, body):
+        """The POST /api/simulate reply to ``body``; raises ValueError.
+
+        ``{"command", "params"}`` (plus ``"timeline": true`` for the servo
+        angles over time) or a program ``{"steps": [...]}``.
+        """
+        if not isinstance(body, dict):
+            raise ValueError('body must be a JSON object')
+        if 'steps' in body:
+            return self.simulate_steps(compile_steps(body['steps']))
+        command = body.get('command')
+        if not command or not isinstance(command, str):
+            raise ValueError('missing command')
+        result = self.simulate(command, body.get('params'))
+        if body.get('timeline'):
+            return dict(result)
+        return {k: v for k, v in result.items() if k != 'timeline'}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, cached=len(self._cache))
@@ -0,0 +1,292 @@
+"""Prometheus text-format metrics of the workbench proxy (GET /metrics).
+
+Counters and histograms are updated on every proxied command from many
+threads (one per connection in server.py, one sender per robot queue).
+To keep that off any shared lock each thread writes to its own shard, a
+plain dict only that thread mutates, and a scrape adds the shards up;
+copying a dict or list is a single step under the GIL, so the scrape
+never sees half an update. Shards of finished threads are folded into a
+base shard at the next scrape, or when new threads have doubled the
+number of shards, so a proxy nobody scrapes does not keep one per
+finished connection. Values that already live elsewhere
+(static cache, queue depths) are read by collectors at scrape time only.
+"""
+import bisect
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# seconds: WiFi round trips are ms to s, proxy overhead is µs to ms
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_LABEL_VALUES = 64
+FOLD_SHARDS = 64        # fold finished threads' shards once there are this many (and then twice as many)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) or abs(value) >= 1e15 else str(int(value))
+    return str(value)
+
+
+class LabelValues:
+    """Caps the distinct values of a client-supplied label (robot URLs, commands).
+
+    The first ``limit`` values are kept, later ones become ``other``.
+    """
+
+    def __init__(self, limit=MAX_LABEL_VALUES, allowed=None):
+        self.limit = limit
+        self.allowed = set(allowed) if allowed is not None else None
+        self._seen = set()
+
+    def __call__(self, value):
+        value = '' if value is None else str(value)
+        if self.allowed is not None:
+            return value if value in self.allowed else 'other'
+        if value in self._seen:
+            return value
+        if len(self._seen) >= self.limit:
+            return 'other'
+        # set.add 在 GIL 下是原子的; 并发时最多多放进一两个值
+        self._seen.add(value)
+        return value
+
+
+class _Metric:
+    def __init__(self, registry, name, kind, help, labels, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = buckets
+
+
+class Counter(_Metric):
+    def inc(self, *labels, amount=1):
+        shard = self.registry._shard()
+        key = (self.name,) + labels
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """Up/down count (in-flight requests); every thread's inc() and dec() add up."""
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    def observe(self, value, *labels):
+        shard = self.registry._shard()
+        key = (self.name,) + labels
+        counts = shard.get(key)
+        if counts is None:
+            # 每个桶各自计数 (最后一个是 +Inf), 末尾是总和; 输出时再累加
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._local = threading.local()
+        self._shards = []           # (thread, shard)
+        self._base = {}
+        self._fold_at = FOLD_SHARDS
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self, name, 'counter', help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(self, name, 'gauge', help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._add(Histogram(self, name, 'histogram', help, labels, tuple(buckets)))
+
+    def collector(self, fn):
+        """``fn()`` returns ``[(name, kind, help, label names, [(label values, value), ...]), ...]``."""
+        self._collectors.append(fn)
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= self._fold_at:
+                    # 每个连接一个线程: 没人抓取时也要回收结束了的线程的 shard
+                    self._fold()
+                    self._fold_at = max(FOLD_SHARDS, 2 * len(self._shards))
+            return shard
+
+    def _fold(self):
+        """Merge the shards of finished threads into the base shard (holding ``_lock``)."""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                # 线程已结束, 不会再写这个 shard
+                self._merge(self._base, shard)
+        self._shards = alive
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in shard.items():
+            if isinstance(value, list):
+                total = into.get(key)
+                if total is None:
+                    into[key] = list(value)
+                else:
+                    for i, v in enumerate(value):
+                        total[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def snapshot(self):
+        """``{(name, *label values): value or bucket list}`` summed over all threads."""
+        with self._lock:
+            self._fold()
+            alive = list(self._shards)
+            totals = {}
+            self._merge(totals, self._base)
+        for _, shard in alive:
+            self._merge(totals, {k: list(v) if isinstance(v, list) else v for k, v in dict(shard).items()})
+        return totals
+
+    def render(self):
+        """The exposition text for GET /metrics."""
+        totals = self.snapshot()
+        by_name = {}
+        for key, value in totals.items():
+            by_name.setdefault(key[0], []).append((key[1:], value))
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for values, value in sorted(by_name.get(metric.name, ()), key=lambda item: item[0]):
+                if metric.kind != 'histogram':
+                    lines.append(f'{metric.name}{_labels(metric.labels, values)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value):
+                    cumulative += count
+                    le = 'le="%s"' % (bound if bound == '+Inf' else _number(float(bound)))
+                    lines.append(f'{metric.name}_bucket{_labels(metric.labels, values, le)} {cumulative}')
+                lines.append(f'{metric.name}_sum{_labels(metric.labels, values)} {_number(value[-1])}')
+                lines.append(f'{metric.name}_count{_labels(metric.labels, values)} {cumulative}')
+        for collect in self._collectors:
+            for name, kind, help, names, samples in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for values, value in samples:
+                    lines.append(f'{name}{_labels(names, values)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class ProxyMetrics:
+    """The workbench proxy's metrics; server.py and server_async.py share them."""
+
+    def __init__(self, commands=None):
+        self.registry = Registry()
+        self.robot_label = LabelValues()
+        self.command_label = LabelValues(allowed=commands)
+        r = self.registry
+        self.requests = r.counter('workbench_requests_total', 'API requests by route and response status',
+                                  ('route', 'status'))
+        self.commands = r.counter('workbench_commands_total',
+                                  '/api/control commands by robot and the status returned for it',
+                                  ('command', 'robot', 'status'))
+        self.robot_seconds = r.histogram('workbench_robot_seconds',
+                                         'Time the robot took to answer a forwarded command', ('robot',))
+        self.queue_seconds = r.histogram('workbench_queue_wait_seconds',
+                                         'Time a command waited in its robot queue', ('robot',))
+        self.overhead_seconds = r.histogram('workbench_proxy_overhead_seconds',
+                                            'Request time spent in the proxy (excluding queue wait and robot time)',
+                                            ('route',))
+        self.inflight = r.gauge('workbench_inflight_requests', 'POST /api requests being handled')
+
+    def robot_call(self, robot, seconds):
+        self.robot_seconds.observe(seconds, self.robot_label(robot))
+
+    def command(self, command, robot, status, ticket=None):
+        """One command's outcome; ``ticket`` (command_queue.Ticket) adds its queue wait."""
+        robot = self.robot_label(robot)
+        self.commands.inc(self.command_label(command), robot, str(int(status)))
+        if ticket is not None and ticket.pending.started is not None:
+            self.queue_seconds.observe(max(0.0, ticket.pending.started - ticket.arrived), robot)
+
+    def request(self, route, status, seconds=None, tickets=()):
+        """One API request; for proxied commands the overhead is what ``tickets`` do not explain."""
+        if route is None:
+            return
+        self.requests.inc(route, str(int(status)))
+        if seconds is None:
+            return
+        spent = 0.0
+        for ticket in tickets:
+            pending = ticket.pending
+            if pending.finished is not None:
+                # 同时发给多台时, 以最慢的一台为准
+                spent = max(spent, pending.finished - ticket.arrived)
+        self.overhead_seconds.observe(max(0.0, seconds - spent), route)
+
+
+def route(method, path):
+    """Bounded route label of an API request path, None for static files."""
+    path = path.split('?', 1)[0].rstrip('/')
+    if path.startswith('/api/program/'):
+        return method + ' /api/program/:id' + ('/events' if path.endswith('/events') else
+                                                '/cancel' if path.endswith('/cancel') else '')
+    if path in ('/api/control', '/api/program', '/api/robots', '/api/robots/scan', '/api/groups',
+                '/api/simulate', '/api/stats', '/api/telemetry', '/metrics'):
+        return method + ' ' + path
+    return method + ' /api/other' if path.startswith('/api/') else None
+
+
+def static_collector(cache):
+    """Collector for a static_cache.StaticCache."""
+    def collect():
+        stats = cache.stats()
+        return [
+            ('workbench_static_requests_total', 'counter', 'Static file requests answered from the cache',
+             ('result',), [(('200',), stats['requests'] - stats['not_modified']),
+                           (('304',), stats['not_modified'])]),
+            ('workbench_static_loads_total', 'counter', 'Static files (re)read from disk (cache misses)',
+             (), [((), stats['loads'])]),
+            ('workbench_static_sent_bytes_total', 'counter', 'Static body bytes sent (after compression)',
+             (), [((), stats['bytes_sent'])]),
+        ]
+    return collect
+
+
+def queue_collector(queues):
+    """Collector for a command_queue.CommandQueues."""
+    def collect():
+        stats = queues.stats()
+        return [
+            ('workbench_queue_depth', 'gauge', 'Commands waiting per robot', ('robot',),
+             [((robot,), s['depth']) for robot, s in sorted(stats.items())]),
+            ('workbench_queue_coalesced_total', 'counter', 'Commands merged into an identical pending one',
+             ('robot',), [((robot,), s['coalesced']) for robot, s in sorted(stats.items())]),
+        ]
+    return collect
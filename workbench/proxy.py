@@ -0,0 +1,735 @@
+"""What the two workbench servers share: routes, replies, metrics and the robot side.
+
+server.py (ThreadingHTTPServer) and server_async.py (asyncio) only move
+bytes: they parse a request into a Request, hand it to Workbench.handle()
+and write back the ``(status, headers, body)`` it returns, or run the
+event stream it asks for. handle() is a generator; work that blocks (a
+clock sync, a subnet scan, a simulation, waiting for queued robot
+replies) is a Call or Wait step that the server runs in its own way:
+drive() runs it in the request's thread, server_async.py on an executor
+or as an awaited future.
+"""
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from http import HTTPStatus
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)    # the robot's binproto.py and serial_link.py
+
+import binproto  # noqa: E402
+import clock_sync  # noqa: E402
+import fanout  # noqa: E402
+import gait_sim  # noqa: E402
+import metrics  # noqa: E402
+import serial_link  # noqa: E402
+from command_queue import CommandQueues, QueueFull  # noqa: E402
+from discovery import Discovery, ScanBusy  # noqa: E402
+from runner import ProgramRegistry, compile_steps  # noqa: E402
+from static_cache import StaticCache  # noqa: E402
+from telemetry import POLL_HZ, TelemetryHub  # noqa: E402
+
+try:
+    import termios
+    import tty
+except ImportError:     # Windows: no serial transport
+    termios = tty = None
+
+
+# Binary control protocol and USB serial framing: the robot's own binproto.py
+# and serial_link.py, so the tables cannot drift apart.
+BINARY_CONTENT_TYPE = binproto.CONTENT_TYPE
+BINARY_FLAG_ASYNC = binproto.FLAG_ASYNC
+BINARY_COMMANDS = binproto.COMMANDS
+# positional order of keyword params, the robot side receives int16 args
+BINARY_ARGS = {
+    'forward': ('steps', 't'), 'backward': ('steps', 't'),
+    'turn_L': ('steps', 't'), 'turn_R': ('steps', 't'),
+    'omni_walk': ('steps', 't', 'side', 'turn_factor'),
+    'dance': ('steps', 't'), 'front_back': ('steps', 't'),
+    'moonwalk_L': ('steps', 't'), 'up_down': ('steps', 't'),
+    'push_up': ('steps', 't'), 'wave_hand': ('steps', 't'),
+    'hide': ('steps', 't'), 'frog_jump': ('steps',), 'walk': ('t',),
+}
+INT16 = range(-0x8000, 0x8000)
+UINT16 = range(0x10000)
+ANGLES = range(181)         # binproto.frames rejects angles above 180
+
+
+def _int_in(value, valid):
+    """``value`` as an int if it is a whole number in ``valid``, else None."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        return None
+    value = int(value)
+    return value if value in valid else None
+
+
+def to_binary(command, params=None, is_async=False):
+    """Translate a JSON /control command into a binary request body.
+
+    Returns None when the command cannot be expressed in binary (unknown
+    command, semantic ``legs`` frames, unsupported params, values that are
+    not whole numbers or do not fit the packed fields); the caller then
+    sends JSON instead and the robot reports any error itself.
+    """
+    if command not in BINARY_COMMANDS:
+        return None
+    flags = BINARY_FLAG_ASYNC if is_async else 0
+    if command == 'customize_action':
+        frames = params or []
+        if not isinstance(frames, list):
+            return None
+        packed = []
+        for frame in frames:
+            angles = frame.get('angles') if isinstance(frame, dict) else None
+            if not isinstance(angles, list) or len(angles) != 8:
+                return None
+            duration = _int_in(frame.get('duration', 500), UINT16)
+            angles = [_int_in(a, ANGLES) for a in angles]
+            if duration is None or None in angles:
+                return None
+            packed.append({'duration': duration, 'angles': angles})
+        if len(packed) not in UINT16:
+            return None
+        return binproto.encode(command, packed, flags)
+
+    names = BINARY_ARGS.get(command, ())
+    params = params or {}
+    if not isinstance(params, dict) or set(params) - set(names):
+        return None
+    args = []
+    for name in names:
+        if name not in params:
+            break
+        args.append(_int_in(params[name], INT16))
+    if len(args) != len(params) or None in args:
+        # keyword params must be a prefix of the positional order
+        return None
+    return binproto.encode(command, args, flags)
+
+
+SERIAL_CONTROL = serial_link.CONTROL
+SERIAL_STATUS = serial_link.STATUS
+SERIAL_POSE = serial_link.POSE
+SERIAL_CLOCK = serial_link.CLOCK
+SERIAL_REPLY = serial_link.REPLY
+SERIAL_MAX_PAYLOAD = 16 * 1024     # replies larger than this are line noise
+serial_frame = serial_link.encode
+
+
+class SerialBridge:
+    """Send /control bodies to a robot on a serial port instead of over HTTP.
+
+    Uses termios directly (POSIX only), so a pseudo-terminal works as well
+    as /dev/ttyUSB0. One request at a time; bytes between frames (the
+    robot's print output) are skipped.
+    """
+
+    def __init__(self, path, baudrate=115200, fd=None):
+        if termios is None:
+            raise RuntimeError('serial transport needs a POSIX system')
+        self.path = path
+        # fd: an already open descriptor, e.g. the master side of a pseudo-terminal
+        self.fd = fd if fd is not None else os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[4] = attrs[5] = getattr(termios, f'B{baudrate}')
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._buf = bytearray()
+
+    def request(self, body, kind=SERIAL_CONTROL, timeout=15):
+        """Send one request, returns the robot's JSON reply (bytes)."""
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xFF
+            data = memoryview(serial_frame(kind, self._seq, body))
+            while data:
+                data = data[os.write(self.fd, data):]
+            deadline = time.monotonic() + timeout
+            while True:
+                for reply_kind, seq, payload in self._frames():
+                    # replies to earlier requests that timed out are dropped here
+                    if reply_kind == kind | SERIAL_REPLY and seq == self._seq:
+                        return payload
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f'no reply from {self.path}')
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+                if ready:
+                    chunk = os.read(self.fd, 4096)
+                    if not chunk:
+                        raise ConnectionError(f'{self.path} closed')
+                    self._buf += chunk
+
+    def _frames(self):
+        buf = self._buf
+        while True:
+            i = buf.find(serial_link.SYNC)
+            if i < 0:
+                del buf[:max(0, len(buf) - 1)]
+                return
+            del buf[:i]
+            if len(buf) < serial_link.HEADER_SIZE:
+                return
+            kind, seq, length = struct.unpack_from(serial_link.HEADER_FMT, buf, 2)
+            if length > SERIAL_MAX_PAYLOAD:
+                del buf[:1]
+                continue
+            end = serial_link.HEADER_SIZE + length + serial_link.CRC_SIZE
+            if len(buf) < end:
+                return
+            crc = struct.unpack_from('<I', buf, end - serial_link.CRC_SIZE)[0]
+            if zlib.crc32(bytes(buf[2:end - serial_link.CRC_SIZE])) != crc:
+                del buf[:1]
+                continue
+            payload = bytes(buf[serial_link.HEADER_SIZE:end - serial_link.CRC_SIZE])
+            del buf[:end]
+            yield kind, seq, payload
+
+
+MAX_BODY = 1024 * 1024      # request bodies above this get 413
+SSE_PING = 15.0     # comment line on an idle event stream, keeps proxies from closing it
+EXPOSE_HEADERS = 'X-Queue-Depth, X-Queue-Wait-Ms, X-Queue-Coalesced, X-Clock-Error-Ms'
+# CORS 头只加在 /api 回复上, 静态文件不需要
+CORS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Expose-Headers': EXPOSE_HEADERS,
+}
+
+
+class PoolError(Exception):
+    pass
+
+
+class Saturated(Exception):
+    """Too much load: answered right away with ``status`` and Retry-After."""
+
+    def __init__(self, status, msg):
+        super().__init__(msg)
+        self.status = status
+
+
+class Request:
+    """One browser request; ``headers`` has lower-case names."""
+    __slots__ = ('method', 'target', 'path', 'query', 'headers', 'body', 'client', 'started', 'tickets', 'command')
+
+    def __init__(self, method, target, headers, body=b'', client=''):
+        split = urllib.parse.urlsplit(target)
+        self.method = method
+        self.target = target
+        self.path = split.path
+        self.query = urllib.parse.parse_qs(split.query)
+        self.headers = headers
+        self.body = body
+        self.client = client
+        # 转发的命令, 回复时记入 /metrics (见 Workbench.observe)
+        self.started = time.perf_counter()
+        self.tickets = ()
+        self.command = None
+
+
+def json_reply(status, payload, extra=None):
+    headers = {'Content-Type': 'application/json; charset=utf-8'}
+    headers.update(CORS)
+    if extra:
+        headers.update(extra)
+    return int(status), headers, json.dumps(payload).encode('utf-8')
+
+
+def content_length(headers):
+    """Body length of a request: ``(length, None)``, or ``(None, reply)`` for a bad or too large one."""
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        length = -1
+    if length < 0:
+        return None, json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'bad Content-Length'})
+    if length > MAX_BODY:
+        return None, json_reply(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                {'status': '413', 'msg': f'body over {MAX_BODY} bytes'})
+    return length, None
+
+
+def normalize_base_url(base_url):
+    base_url = (base_url or '').strip()
+    if not base_url:
+        return ''
+    if base_url.endswith('/'):
+        base_url = base_url[:-1]
+    parsed = urllib.parse.urlparse(base_url)
+    if parsed.scheme not in ('http', 'https'):
+        return ''
+    if not parsed.netloc:
+        return ''
+    return f'{parsed.scheme}://{parsed.netloc}'
+
+
+def reply_object(body):
+    try:
+        return json.loads(body)
+    except ValueError:
+        return {'msg': body.decode('utf-8', errors='ignore')}
+
+
+def retry_after(body):
+    """Retry-After of a robot's 503 reply, rounded up from its ``remaining_ms`` as the robot does.
+
+    Computed from the body because serial replies have no headers.
+    """
+    reply = reply_object(body)
+    remaining = reply.get('remaining_ms') if isinstance(reply, dict) else None
+    if isinstance(remaining, bool) or not isinstance(remaining, int):
+        return '1'
+    return str((remaining + 999) // 1000)
+
+
+class Call:
+    """Step of Workbench.handle(): run ``fn(*args)``, which blocks, and send back its result."""
+    __slots__ = ('fn', 'args')
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+
+class Wait:
+    """Step of Workbench.handle(): wait until the tickets' replies are there, ``timeout`` s at most."""
+    __slots__ = ('tickets', 'timeout')
+
+    def __init__(self, tickets, timeout=None):
+        self.tickets = tickets
+        self.timeout = timeout
+
+
+def drive(steps):
+    """Run a Workbench.handle() generator in this thread, returns its reply."""
+    value = error = None
+    while True:
+        try:
+            step = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        value = error = None
+        try:
+            if isinstance(step, Call):
+                value = step.fn(*step.args)
+            else:
+                until = None if step.timeout is None else time.monotonic() + step.timeout
+                for ticket in step.tickets:
+                    ticket.pending.wait(None if until is None else max(0.0, until - time.monotonic()))
+        except Exception as e:
+            error = e
+
+
+class EventStream:
+    """A program's events as Server-Sent Events, from event ``index`` on."""
+    __slots__ = ('run', 'index')
+
+    def __init__(self, run, index):
+        self.run = run
+        self.index = index
+
+    def read(self, timeout):
+        """New events, waiting up to ``timeout`` s for them: ``(SSE bytes, finished)``."""
+        events, finished = self.run.wait_events(self.index, timeout)
+        chunks = []
+        for event, data in events:
+            chunks.append(f'id: {self.index}\nevent: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8'))
+            self.index += 1
+        return b''.join(chunks), finished
+
+
+class TelemetryStream:
+    """A robot's pose feed for one viewer, at most one snapshot per ``interval`` s."""
+    __slots__ = ('feed', 'interval')
+
+    def __init__(self, feed, interval):
+        self.feed = feed
+        self.interval = interval
+
+
+class Workbench:
+    """State and routes of the workbench proxy.
+
+    ``pool.request(base_url, method, path, body, headers)`` reaches the
+    robots; robot_request() calls it from a worker thread (a command
+    queue, program run or telemetry poller) and blocks. ``max_inflight``
+    bounds the /api/control requests waiting for robots (None: no bound).
+    """
+
+    def __init__(self, directory, pool, serial=None, binary=False, max_inflight=None, telemetry_hz=POLL_HZ,
+                 queues=None, groups=None, clocks=None, discovery=None, traffic=None):
+        self.static_files = StaticCache(directory)
+        self.pool = pool
+        self.serial = serial
+        self.binary = binary
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.rejected = 0
+        self.queues = queues or CommandQueues()
+        self.groups = groups or {}
+        self.clocks = clocks or clock_sync.ClockSync()
+        self.discovery = discovery or Discovery(listen_port=None, scan_interval=0)
+        self.traffic = traffic
+        self.programs = ProgramRegistry()
+        self.simulator = gait_sim.Simulator()
+        self.telemetry = TelemetryHub(telemetry_hz)
+        self.metrics = metrics.ProxyMetrics(BINARY_COMMANDS)
+        self.metrics.registry.collector(metrics.static_collector(self.static_files))
+        self.metrics.registry.collector(metrics.queue_collector(self.queues))
+        self._lock = threading.Lock()   # inflight / rejected, server.py routes from many threads
+
+    # -- routes
+    def handle(self, req):
+        """Route ``req``: a generator of Call / Wait steps that returns the reply.
+
+        The reply is ``(status, headers, body)``, an EventStream or a
+        TelemetryStream for the server to run, or None for a path the
+        static cache does not have.
+        """
+        self.record(req)
+        if req.method == 'OPTIONS':
+            return HTTPStatus.NO_CONTENT, dict(CORS), b''
+        if req.method == 'GET':
+            return self.get(req)
+        if req.method == 'HEAD':
+            return self.static(req)
+        if req.method != 'POST':
+            return json_reply(HTTPStatus.METHOD_NOT_ALLOWED, {'status': '405', 'msg': req.method})
+        self.metrics.inflight.inc()
+        try:
+            return (yield from self.post(req))
+        finally:
+            self.metrics.inflight.dec()
+
+    def get(self, req):
+        path = req.path.rstrip('/')
+        if path == '/api/groups':
+            return json_reply(HTTPStatus.OK, {'status': '200', 'groups': self.groups})
+        if path == '/api/robots':
+            return json_reply(HTTPStatus.OK, {'status': '200', 'robots': self.discovery.robots()})
+        if path == '/metrics':
+            return HTTPStatus.OK, {'Content-Type': metrics.CONTENT_TYPE}, self.metrics.registry.render().encode()
+        if path == '/api/stats':
+            return json_reply(HTTPStatus.OK, self.stats())
+        if path.startswith('/api/telemetry'):
+            return self.telemetry_stream(req)
+        if path.startswith('/api/program/'):
+            run_id, _, action = path[len('/api/program/'):].partition('/')
+            run = self.programs.get(int(run_id)) if run_id.isdigit() else None
+            if run is None:
+                return json_reply(HTTPStatus.NOT_FOUND, {'status': '404', 'msg': 'no program ' + run_id})
+            if action == 'events':
+                return self.event_stream(req, run)
+            return json_reply(HTTPStatus.OK, dict(run.to_dict(), status='200'))
+        return self.static(req)
+
+    def stats(self):
+        return {'status': '200', 'pool': self.pool.stats(), 'queues': self.queues.stats(),
+                'static': self.static_files.stats(), 'telemetry': self.telemetry.stats(),
+                'clocks': self.clocks.stats(), 'discovery': self.discovery.stats(),
+                'simulator': self.simulator.stats(),
+                'server': {'inflight': self.inflight, 'max_inflight': self.max_inflight, 'rejected': self.rejected}}
+
+    def static(self, req):
+        """Files from the StaticCache, logged with bytes sent and time taken."""
+        started = time.perf_counter()
+        reply = self.static_files.respond(req.path, req.headers.get('accept-encoding'),
+                                          req.headers.get('if-none-match'), req.headers.get('if-modified-since'))
+        if reply is None:
+            return None
+        status, fields, body = reply
+        sys.stderr.write('"%s %s" %d %s %d B %.2f ms\n' % (
+            req.method, req.path, status, fields.get('Content-Encoding', '-'),
+            0 if req.method == 'HEAD' else len(body), (time.perf_counter() - started) * 1000))
+        return reply
+
+    def post(self, req):
+        path = req.path.rstrip('/')
+        if (path not in ('/api/control', '/api/program', '/api/robots/scan', '/api/simulate')
+                and not path.startswith('/api/program/')):
+            return json_reply(HTTPStatus.NOT_FOUND, {'status': '404', 'msg': 'not found'})
+        try:
+            body = json.loads(req.body.decode('utf-8') if req.body else '{}')
+        except Exception:
+            body = None
+        if not isinstance(body, dict):
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'invalid json'})
+
+        if path == '/api/robots/scan':
+            # {"network": "192.168.2.0/24"}: 立即扫描一个子网, 要几秒
+            try:
+                result = yield Call(self.discovery.scan, body.get('network'))
+            except ScanBusy as e:
+                return json_reply(HTTPStatus.CONFLICT, {'status': '409', 'msg': str(e)})
+            except (ValueError, AttributeError) as e:
+                return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+            return json_reply(HTTPStatus.OK, {'status': '200', 'scan': result, 'robots': self.discovery.robots()})
+
+        if path == '/api/simulate':
+            # 没有缓存时要运行一遍步态代码 (几 ms 到几十 ms)
+            try:
+                result = yield Call(self.simulator.preview, body)
+            except ValueError as e:
+                return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+            return json_reply(HTTPStatus.OK, dict(result, status='200'))
+
+        if path.startswith('/api/program/'):
+            run_id, _, action = path[len('/api/program/'):].partition('/')
+            run = self.programs.get(int(run_id)) if run_id.isdigit() else None
+            if run is None:
+                return json_reply(HTTPStatus.NOT_FOUND, {'status': '404', 'msg': 'no program ' + run_id})
+            if action != 'cancel':
+                return json_reply(HTTPStatus.NOT_FOUND, {'status': '404', 'msg': 'not found'})
+            # cancel 会向机器人发送 stop
+            cancelled = yield Call(run.cancel)
+            return json_reply(HTTPStatus.OK, dict(run.to_dict(), status='200', cancelled=cancelled))
+
+        try:
+            robots = fanout.targets(body, self.groups, normalize_base_url)
+        except ValueError as e:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+        base_url = normalize_base_url(body.get('baseUrl') or os.environ.get('ROBOT_BASE_URL'))
+        if robots is None and not base_url and self.serial is None:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'missing baseUrl'})
+        if path == '/api/program':
+            return (yield from self.start_program(body, robots or [base_url]))
+
+        command = body.get('command')
+        if not command or not isinstance(command, str):
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'missing command'})
+        with self._lock:
+            if self.max_inflight is not None and self.inflight >= self.max_inflight:
+                self.rejected += 1
+                return json_reply(HTTPStatus.SERVICE_UNAVAILABLE,
+                                  {'status': '503', 'msg': 'workbench proxy is saturated'}, {'Retry-After': '1'})
+            self.inflight += 1
+        try:
+            if robots is not None:
+                return (yield from self.fan_out(req, body, robots, command))
+            return (yield from self.control(req, body, base_url, command))
+        finally:
+            with self._lock:
+                self.inflight -= 1
+
+    def control(self, req, body, base_url, command):
+        """/api/control for one robot: queue the command and pass its reply through."""
+        req.command = (command, base_url or self.serial.path)
+        try:
+            ats, clocks = yield Call(self.schedule, body, [base_url])
+        except ValueError as e:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+        except Exception as e:
+            return json_reply(HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': 'clock sync failed: ' + str(e)})
+        try:
+            ticket = self.robot_queue(base_url).submit(command, body.get('params'), body.get('binary', self.binary),
+                                                       ats[0] if ats else None)
+        except QueueFull as e:
+            return json_reply(HTTPStatus.TOO_MANY_REQUESTS, {'status': '429', 'msg': str(e)}, {'Retry-After': '1'})
+        req.tickets = (ticket,)
+        yield Wait([ticket])
+        headers = ticket.headers()
+        if clocks:
+            headers['X-Clock-Error-Ms'] = '%.1f' % clocks[0].error_ms()
+        try:
+            status, resp_type, resp_body = ticket.wait(0)
+        except Saturated as e:
+            return json_reply(e.status, {'status': str(int(e.status)), 'msg': str(e)},
+                              dict(headers, **{'Retry-After': '1'}))
+        except Exception as e:
+            return json_reply(HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': str(e)}, headers)
+        if status == 409:
+            # 排队时被 stop / home 取消, 原样返回 409
+            return json_reply(HTTPStatus.CONFLICT, reply_object(resp_body), headers)
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            # 机器人正忙: 原样返回 503 和 remaining_ms, 浏览器按 Retry-After 重试
+            headers['Retry-After'] = retry_after(resp_body)
+        elif status >= 400:
+            msg = resp_body.decode('utf-8', errors='ignore')
+            return json_reply(HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': msg or 'bad gateway'}, headers)
+        fields = {'Content-Type': resp_type}
+        fields.update(CORS)
+        fields.update(headers)
+        return status, fields, resp_body
+
+    def fan_out(self, req, body, robots, command):
+        """/api/control for several robots: queue everywhere, then wait for all."""
+        try:
+            ats, clocks = yield Call(self.schedule, body, robots)
+        except ValueError as e:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+        except Exception as e:
+            return json_reply(HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': 'clock sync failed: ' + str(e)})
+        binary = body.get('binary', self.binary)
+        tickets = []
+        for i, base_url in enumerate(robots):
+            try:
+                tickets.append(self.robot_queue(base_url).submit(command, body.get('params'), binary,
+                                                                 ats[i] if ats else None))
+            except QueueFull as e:
+                tickets.append(e)
+        req.tickets = [t for t in tickets if not isinstance(t, Exception)]
+        yield Wait(req.tickets, fanout.timeout(body, self.pool.read_timeout))
+        result = fanout.summarize(robots, tickets, reply_object, clocks)
+        for entry, ticket in zip(result['robots'], tickets):
+            self.metrics.command(command, entry['robot'], entry['status'],
+                                 None if isinstance(ticket, Exception) else ticket)
+        return json_reply(int(result['status']), result)
+
+    def start_program(self, body, robots):
+        try:
+            steps = compile_steps(body.get('steps'))
+        except ValueError as e:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+        try:
+            ats, _ = yield Call(self.schedule, body, robots)
+        except ValueError as e:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': str(e)})
+        except Exception as e:
+            return json_reply(HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': 'clock sync failed: ' + str(e)})
+        binary = body.get('binary', self.binary)
+
+        def robot(base_url, at):
+            queue = self.robot_queue(base_url)
+            start = {'at': at}
+
+            def send(command, params):
+                # 定时启动只作用于第一条命令, 之后各机器人按自己的节奏执行
+                status, _, reply = queue.submit(command, params, binary, start.pop('at', None)).wait()
+                return status, reply_object(reply)
+
+            def stop():
+                queue.submit('stop').wait()
+
+            return queue.target, send, stop
+
+        runs, busy = self.programs.start_group([robot(u, ats[i] if ats else None) for i, u in enumerate(robots)],
+                                               steps, bool(body.get('continueOnError')))
+        if runs is None:
+            target = self.programs.get(busy).target
+            return json_reply(HTTPStatus.CONFLICT,
+                              {'status': '409', 'msg': f'program {busy} is running on {target}', 'program': busy})
+        if len(runs) == 1:
+            return json_reply(HTTPStatus.ACCEPTED, dict(runs[0].to_dict(), status='202'))
+        return json_reply(HTTPStatus.ACCEPTED, {'status': '202', 'programs': [r.to_dict() for r in runs]})
+
+    def event_stream(self, req, run):
+        """GET /api/program/<id>/events: start, wait, step and a final end event."""
+        try:
+            index = int(req.headers.get('last-event-id', '-1')) + 1
+        except ValueError:
+            index = 0
+        events, finished = run.wait_events(index, 0)
+        if finished and not events:
+            # EventSource reconnects after the stream closes; 204 tells it to stop
+            return HTTPStatus.NO_CONTENT, dict(CORS), b''
+        return EventStream(run, index)
+
+    def telemetry_stream(self, req):
+        """GET /api/telemetry?robot=<baseUrl>&hz=<n>: pose snapshots as SSE."""
+        base_url = normalize_base_url(req.query.get('robot', [''])[0] or os.environ.get('ROBOT_BASE_URL'))
+        if not base_url and self.serial is None:
+            return json_reply(HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'missing robot'})
+        hub = self.telemetry
+        try:
+            hz = min(float(req.query.get('hz', [hub.hz])[0]), hub.hz)
+        except ValueError:
+            hz = hub.hz
+
+        def fetch():
+            if self.serial is not None:
+                return json.loads(self.serial.request(b'', SERIAL_POSE))
+            status, _, body = self.robot_request(base_url, 'GET', '/pose')
+            if status != 200:
+                raise PoolError(f'HTTP {status}')
+            return json.loads(body)
+
+        return TelemetryStream(hub.feed(base_url or self.serial.path, fetch), 1.0 / max(hz, 0.1))
+
+    # -- bookkeeping
+    def record(self, req):
+        """Append the request to the --record traffic log."""
+        if self.traffic is not None:
+            self.traffic.record(req.client, req.method, req.target, req.body,
+                                'gzip' in req.headers.get('accept-encoding', ''), 'if-none-match' in req.headers)
+
+    def observe(self, req, status):
+        """Count an answered request for /metrics."""
+        self.metrics.request(metrics.route(req.method, req.path), status,
+                             time.perf_counter() - req.started if req.tickets else None, req.tickets)
+        if req.command is not None:
+            self.metrics.command(req.command[0], req.command[1], status, req.tickets[0] if req.tickets else None)
+
+    # -- the robot side, called from worker threads
+    def robot_request(self, base_url, method, path, body=None, headers=None):
+        """One HTTP request to a robot: ``(status, content type, body bytes)``; blocks."""
+        return self.pool.request(base_url, method, path, body, headers)
+
+    def forward(self, base_url, command, params=None, binary=False, at=None):
+        """Send one /control command to the robot, over serial or the pool.
+
+        ``at`` is the robot-local tick to start on (binproto has no field for
+        it, such commands go as JSON). Returns ``(status, content type, body
+        bytes)``; raises on transport errors.
+        """
+        body = to_binary(command, params) if binary and at is None else None
+        content_type = BINARY_CONTENT_TYPE
+        if body is None:
+            payload = {'command': command}
+            if params is not None:
+                payload['params'] = params
+            if at is not None:
+                payload['at'] = at
+            body = json.dumps(payload).encode('utf-8')
+            content_type = 'application/json'
+        if self.serial is not None:
+            reply = self.serial.request(body)
+            return int(json.loads(reply).get('status', 200)), 'application/json', reply
+        return self.robot_request(base_url, 'POST', '/control', body, {'Content-Type': content_type})
+
+    def robot_queue(self, base_url):
+        """The command queue of the robot at ``base_url`` (or on the serial port)."""
+        target = base_url or self.serial.path
+
+        def send(command, params, binary, at):
+            started = time.perf_counter()
+            try:
+                return self.forward(base_url, command, params, binary, at)
+            finally:
+                self.metrics.robot_call(target, time.perf_counter() - started)
+
+        return self.queues.queue(target, send)
+
+    def robot_clock(self, base_url):
+        """The synchronized clock of the robot at ``base_url`` (or on the serial port)."""
+        def probe():
+            if self.serial is not None:
+                return json.loads(self.serial.request(b'', SERIAL_CLOCK))['t']
+            status, _, body = self.robot_request(base_url, 'GET', '/clock')
+            if status != 200:
+                raise PoolError(f'HTTP {status}')
+            return json.loads(body)['t']
+
+        return self.clocks.clock(base_url or self.serial.path, probe)
+
+    def schedule(self, body, robots):
+        """Robot-local start ticks of a timed request: ``(ticks, clocks)``, or ``(None, None)``.
+
+        Raises ValueError for a bad start time and the transport error when a
+        robot's clock cannot be read.
+        """
+        if clock_sync.start_time(body) is None:
+            return None, None
+        clocks = [self.robot_clock(base_url) for base_url in robots]
+        # startIn 从时钟都校准好之后算起 (第一次校准要几次往返)
+        start = clock_sync.start_time(body)
+        return [clock.to_robot(start) for clock in clocks], clocks
@@ -0,0 +1,51 @@
+"""Load robot motion recordings (see recorder.py on the robot) into NumPy.
+
+Usage:  python3 workbench/recording.py motion.rec
+"""
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'QREC'
+VERSION = 1
+HEADER_FMT = '<4sBBH'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+
+
+def record_dtype(servos=8):
+    return np.dtype([('dt', '<u2'), ('angles', 'u1', (servos,))])
+
+
+def load_recording(path):
+    """Return ``(t_ms, angles)`` for the recording at ``path``.
+
+    ``t_ms`` is an int64 array of milliseconds since the first record and
+    ``angles`` an ``(N, servos)`` uint8 array of commanded servo angles.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE:
+        raise ValueError(f'{path}: truncated header')
+    magic, version, servos, _ = struct.unpack_from(HEADER_FMT, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path}: not a v{VERSION} recording')
+    dtype = record_dtype(servos)
+    usable = (len(data) - HEADER_SIZE) // dtype.itemsize * dtype.itemsize
+    records = np.frombuffer(data, dtype=dtype, count=usable // dtype.itemsize, offset=HEADER_SIZE)
+    t_ms = np.cumsum(records['dt'], dtype=np.int64)
+    return t_ms, records['angles'].copy()
+
+
+def main(argv):
+    for path in argv:
+        t_ms, angles = load_recording(path)
+        duration = int(t_ms[-1]) if len(t_ms) else 0
+        print(f'{path}: {len(t_ms)} records, {duration} ms')
+        if len(t_ms):
+            print(f'  min angles: {angles.min(axis=0).tolist()}')
+            print(f'  max angles: {angles.max(axis=0).tolist()}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
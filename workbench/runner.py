@@ -0,0 +1,192 @@
+"""Server-side execution of whole workbench programs (POST /api/program).
+
+The page used to walk the block program itself and await one /api/control
+round trip per step, so every step also paid the browser's timers and the
+browser -> proxy hop. Here the proxy runs the compiled step list on its
+own thread and the page only watches progress (Server-Sent Events).
+"""
+import itertools
+import threading
+import time
+
+MAX_STEPS = 1000
+MAX_WAIT_MS = 60000
+MAX_REPEAT = 100
+MAX_DEPTH = 8
+KEEP_FINISHED = 16
+
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+
+def compile_steps(steps, limit=MAX_STEPS):
+    """Validate a program and flatten its ``repeat`` steps.
+
+    Steps are ``{"kind": "command", "command": ..., "params": ...}``,
+    ``{"kind": "wait", "ms": ...}`` and ``{"kind": "repeat", "times": ...,
+    "steps": [...]}``. Raises ValueError for a malformed program.
+    """
+    out = []
+
+    def walk(items, depth):
+        if not isinstance(items, list):
+            raise ValueError('steps must be a list')
+        if depth > MAX_DEPTH:
+            raise ValueError('repeat nested too deep')
+        for step in items:
+            kind = step.get('kind') if isinstance(step, dict) else None
+            if kind == 'command':
+                command = step.get('command')
+                if not command or not isinstance(command, str):
+                    raise ValueError('step without command')
+                out.append({'kind': 'command', 'command': command, 'params': step.get('params')})
+            elif kind == 'wait':
+                ms = int(step.get('ms', 0))
+                if not 0 <= ms <= MAX_WAIT_MS:
+                    raise ValueError(f'wait out of range: {ms}')
+                out.append({'kind': 'wait', 'ms': ms})
+            elif kind == 'repeat':
+                times = int(step.get('times', 1))
+                if not 1 <= times <= MAX_REPEAT:
+                    raise ValueError(f'repeat out of range: {times}')
+                for _ in range(times):
+                    walk(step.get('steps', []), depth + 1)
+            else:
+                raise ValueError(f'unknown step kind: {kind!r}')
+            if len(out) > limit:
+                raise ValueError('program too long')
+
+    try:
+        walk(steps, 0)
+    except TypeError as e:
+        raise ValueError(str(e))
+    return out
+
+
+class ProgramRun:
+    """One program executing against one robot.
+
+    ``send(command, params)`` returns ``(status, reply)`` and raises on
+    transport errors; ``stop()`` preempts the robot's current motion.
+    Progress is kept as a list of ``(event, data)`` so a reconnecting
+    EventSource can resume from Last-Event-ID.
+    """
+
+    def __init__(self, run_id, target, steps, send, stop, continue_on_error=False):
+        self.id = run_id
+        self.target = target
+        self.steps = steps
+        self.send = send
+        self.stop = stop
+        self.continue_on_error = continue_on_error
+        self.state = RUNNING
+        self.current = None
+        self.events = []
+        self._cond = threading.Condition()
+        self._cancel = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self):
+        """Stop after the current step and preempt the running motion."""
+        if self.state != RUNNING:
+            return False
+        self._cancel.set()
+        try:
+            self.stop()
+        except Exception:
+            pass
+        return True
+
+    def wait_events(self, index, timeout):
+        """Events from ``index`` on, waiting up to ``timeout`` s for new ones.
+
+        Returns ``(events, finished)``.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > index or self.state != RUNNING, timeout)
+            return self.events[index:], self.state != RUNNING
+
+    def to_dict(self):
+        return {'program': self.id, 'target': self.target, 'state': self.state,
+                'steps': len(self.steps), 'current': self.current}
+
+    def _emit(self, event, **data):
+        with self._cond:
+            self.events.append((event, data))
+            self._cond.notify_all()
+
+    def _finish(self, state):
+        with self._cond:
+            self.events.append(('end', {'state': state}))
+            self.state = state
+            self._cond.notify_all()
+
+    def _run(self):
+        self._emit('start', steps=len(self.steps))
+        for index, step in enumerate(self.steps):
+            if self._cancel.is_set():
+                break
+            self.current = index
+            if step['kind'] == 'wait':
+                self._emit('wait', index=index, ms=step['ms'])
+                if self._cancel.wait(step['ms'] / 1000):
+                    break
+                continue
+            started = time.monotonic()
+            try:
+                status, reply = self.send(step['command'], step['params'])
+            except Exception as e:
+                status, reply = 502, {'status': '502', 'msg': str(e)}
+            if self._cancel.is_set():
+                break
+            ok = status < 400
+            self._emit('step', index=index, command=step['command'], ok=ok, status=status,
+                       cost_ms=round((time.monotonic() - started) * 1000), reply=reply)
+            if not ok and not self.continue_on_error:
+                self._finish(ERROR)
+                return
+        self._finish(CANCELLED if self._cancel.is_set() else DONE)
+
+
+class ProgramRegistry:
+    """Runs by id; one running program per robot, the last few finished kept."""
+
+    def __init__(self, keep=KEEP_FINISHED):
+        self.keep = keep
+        self._runs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, target, steps, send, stop, continue_on_error=False):
+        """Start a run; returns ``(run, None)`` or ``(None, id of the busy run)``."""
+        runs, busy = self.start_group([(target, send, stop)], steps, continue_on_error)
+        return (runs[0], None) if runs else (None, busy)
+
+    def start_group(self, robots, steps, continue_on_error=False):
+        """Start the same program on several ``(target, send, stop)`` robots.
+
+        All or nothing: returns ``(runs, None)``, or ``(None, id of a busy
+        run)`` when any of the robots is already running a program.
+        """
+        targets = {target for target, _, _ in robots}
+        with self._lock:
+            for run in self._runs.values():
+                if run.target in targets and run.state == RUNNING:
+                    return None, run.id
+            runs = [ProgramRun(next(self._ids), target, steps, send, stop, continue_on_error)
+                    for target, send, stop in robots]
+            for run in runs:
+                self._runs[run.id] = run
+            finished = [r for r in self._runs.values() if r.state != RUNNING]
+            for old in finished[:max(0, len(finished) - self.keep)]:
+                del self._runs[old.id]
+        for run in runs:
+            run.start()
+        return runs, None
+
+    def get(self, run_id):
+        return self._runs.get(run_id)
@@ -1,124 +1,331 @@
 import argparse
-import json
+import http.client
 import os
+import select
+import socket
 import sys
-import urllib.error
+import threading
+import time
 import urllib.parse
-import urllib.request
 from http import HTTPStatus
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
+import clock_sync
+import discovery
+import fanout
+from command_queue import COALESCE_WINDOW, QUEUE_LIMIT, CommandQueues
+from proxy import (CORS, SSE_PING, EventStream, PoolError, Request, SerialBridge, TelemetryStream, Workbench,
+                   content_length, drive, normalize_base_url)
+from telemetry import POLL_HZ, sse_event
+from traffic_log import TrafficLog
 
-def _read_body(handler):
-    length_raw = handler.headers.get('content-length', '0')
-    try:
-        length = int(length_raw)
-    except ValueError:
-        length = 0
-    if length <= 0:
-        return b''
-    return handler.rfile.read(length)
-
-
-def _send_json(handler, status, payload):
-    data = json.dumps(payload).encode('utf-8')
-    handler.send_response(status)
-    handler.send_header('Content-Type', 'application/json; charset=utf-8')
-    handler.send_header('Content-Length', str(len(data)))
-    handler.send_header('Access-Control-Allow-Origin', '*')
-    handler.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-    handler.send_header('Access-Control-Allow-Headers', 'Content-Type')
-    handler.end_headers()
-    handler.wfile.write(data)
 
+# Pooled keep-alive connections from the proxy to the robots.
+POOL_SIZE = 2           # connections per robot, the robot keeps at most 4 open
+CONNECT_TIMEOUT = 3.0
+READ_TIMEOUT = 15.0     # a synchronous motion answers when it is done
+POOL_IDLE = 4.0         # drop idle connections before the robot does (idle_timeout 5 s)
+# sent again after the connection broke; a POST /control may already be running on the robot
+RETRY_METHODS = ('GET', 'HEAD')
 
-def _normalize_base_url(base_url):
-    base_url = (base_url or '').strip()
-    if not base_url:
-        return ''
-    if base_url.endswith('/'):
-        base_url = base_url[:-1]
-    parsed = urllib.parse.urlparse(base_url)
-    if parsed.scheme not in ('http', 'https'):
-        return ''
-    if not parsed.netloc:
-        return ''
-    return f'{parsed.scheme}://{parsed.netloc}'
 
+class RequestNotSent(ConnectionError):
+    """The connection broke while the request was written, the robot never got all of it."""
 
-class Handler(SimpleHTTPRequestHandler):
-    def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        super().end_headers()
-
-    def do_OPTIONS(self):
-        self.send_response(HTTPStatus.NO_CONTENT)
-        self.end_headers()
 
-    def do_POST(self):
-        if self.path.rstrip('/') != '/api/control':
-            _send_json(self, HTTPStatus.NOT_FOUND, {'status': '404', 'msg': 'not found'})
-            return
+class RobotPool:
+    """Keep-alive ``http.client`` connections keyed by normalized base URL.
 
-        raw = _read_body(self)
+    At most ``size`` requests per robot are in flight; more wait for a free
+    connection. An idle connection that the robot has closed (readable
+    socket, or older than POOL_IDLE) is discarded before use. When a reused
+    connection breaks, the request is sent again once on a fresh one if it
+    is a GET/HEAD or could not be written at all; other requests (the robot
+    may have taken the command before dropping the socket) fail with 502.
+    """
+
+    def __init__(self, size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._lock = threading.Lock()
+        self._robots = {}   # base_url -> _Robot
+
+    def _robot(self, base_url):
+        with self._lock:
+            robot = self._robots.get(base_url)
+            if robot is None:
+                robot = self._robots[base_url] = _Robot(base_url, self.size)
+            return robot
+
+    def request(self, base_url, method, path, body=None, headers=None):
+        """Returns ``(status, content type, body bytes)``."""
+        robot = self._robot(base_url)
+        if not robot.slots.acquire(timeout=self.read_timeout):
+            raise PoolError(f'no free connection to {base_url}')
+        robot.count('requests')
+        robot.count('in_use')
         try:
-            req = json.loads(raw.decode('utf-8') if raw else '{}')
+            conn, reused = robot.checkout(self)
+            try:
+                result, conn = self._send(conn, method, path, body, headers)
+            except (http.client.HTTPException, ConnectionError) as e:
+                conn.close()
+                if (not reused or isinstance(e, http.client.IncompleteRead) or
+                        (method not in RETRY_METHODS and not isinstance(e, RequestNotSent))):
+                    raise
+                # the robot closed the kept-alive connection: retry once on a new one
+                robot.count('retries')
+                conn, _ = robot.checkout(self, fresh=True)
+                result, conn = self._send(conn, method, path, body, headers)
+            if conn is not None:
+                robot.checkin(conn)
+            return result
         except Exception:
-            _send_json(self, HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'invalid json'})
-            return
+            robot.count('errors')
+            raise
+        finally:
+            robot.count('in_use', -1)
+            robot.slots.release()
+
+    def _send(self, conn, method, path, body, headers):
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+        except ConnectionError as e:
+            raise RequestNotSent(str(e)) from e
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.will_close:
+            conn.close()
+            conn = None
+        return (resp.status, resp.getheader('Content-Type', 'application/json'), data), conn
+
+    def stats(self):
+        with self._lock:
+            robots = list(self._robots.values())
+        result = {}
+        for r in robots:
+            with r.lock:
+                result[r.base_url] = dict(r.stats, idle=len(r.idle))
+        return result
+
+
+class _Robot:
+    def __init__(self, base_url, size):
+        parsed = urllib.parse.urlparse(base_url)
+        self.base_url = base_url
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []      # (connection, time returned)
+        self.lock = threading.Lock()
+        self.stats = {'size': size, 'in_use': 0, 'connections': 0, 'requests': 0, 'reused': 0,
+                      'stale': 0, 'retries': 0, 'errors': 0}
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def checkout(self, pool, fresh=False):
+        """An idle live connection, or a new one. Returns (connection, reused)."""
+        now = time.monotonic()
+        while not fresh:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, since = self.idle.pop()
+            if now - since < POOL_IDLE and not _closed_by_peer(conn):
+                self.count('reused')
+                return conn, True
+            self.count('stale')
+            conn.close()
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=pool.connect_timeout)
+        conn.connect()
+        # http.client sends the headers and the body in separate writes
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock.settimeout(pool.read_timeout)
+        self.count('connections')
+        return conn, False
 
-        command = req.get('command')
-        base_url = req.get('baseUrl') or os.environ.get('ROBOT_BASE_URL')
+    def checkin(self, conn):
+        with self.lock:
+            self.idle.append((conn, time.monotonic()))
 
-        if not command or not isinstance(command, str):
-            _send_json(self, HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'missing command'})
+
+def _closed_by_peer(conn):
+    """An idle keep-alive socket is only readable when the robot closed it."""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def _start_stream(handler):
+    """Headers of an event stream; it has no length, so the connection ends with it."""
+    handler.close_connection = True
+    handler.send_response(HTTPStatus.OK)
+    handler.send_header('Content-Type', 'text/event-stream')
+    handler.send_header('Cache-Control', 'no-cache')
+    handler.send_header('Connection', 'close')
+    for name, value in CORS.items():
+        handler.send_header(name, value)
+    handler.end_headers()
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """HTTP side of the proxy: one thread per connection, routes in proxy.Workbench."""
+    protocol_version = 'HTTP/1.1'      # keep-alive: a page load is one connection, not one per file
+    disable_nagle_algorithm = True     # 头和 body 分两次写, 否则要等 delayed ACK
+    # 正在回复的请求, 回复时记入 /metrics (见 log_request)
+    _request = None
+
+    def log_request(self, code='-', size='-'):
+        super().log_request(code, size)
+        req, self._request = self._request, None
+        try:
+            code = int(code)
+        except (TypeError, ValueError):
             return
+        if req is not None:
+            self.server.workbench.observe(req, code)
 
-        base_url = _normalize_base_url(base_url)
-        if not base_url:
-            _send_json(self, HTTPStatus.BAD_REQUEST, {'status': '400', 'msg': 'missing baseUrl'})
+    def do_GET(self):
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        length, error = content_length(headers)
+        if error is not None:
+            # 没读的 body 还在连接里, 回复后关闭
+            self.close_connection = True
+            self._request = Request(self.command, self.path, headers, client=self.client_address[0])
+            self._reply(error)
             return
+        body = self.rfile.read(length) if length else b''
+        req = self._request = Request(self.command, self.path, headers, body, self.client_address[0])
+        reply = drive(self.server.workbench.handle(req))
+        if reply is None:
+            # 目录跳转、404 等仍由 SimpleHTTPRequestHandler 处理
+            if self.command == 'HEAD':
+                super().do_HEAD()
+            else:
+                super().do_GET()
+        elif isinstance(reply, EventStream):
+            self._events(reply)
+        elif isinstance(reply, TelemetryStream):
+            self._telemetry(reply)
+        else:
+            self._reply(reply)
+
+    do_HEAD = do_POST = do_OPTIONS = do_GET
 
-        target = f'{base_url}/control'
-        body = json.dumps({'command': command}).encode('utf-8')
-        r = urllib.request.Request(
-            target,
-            data=body,
-            method='POST',
-            headers={'Content-Type': 'application/json'}
-        )
+    def _reply(self, reply):
+        status, fields, body = reply
+        self.send_response(status)
+        for name, value in fields.items():
+            self.send_header(name, value)
+        if status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
 
+    def _telemetry(self, stream):
+        feed = stream.feed
+        feed.subscribe()
         try:
-            with urllib.request.urlopen(r, timeout=15) as resp:
-                resp_body = resp.read()
-                self.send_response(resp.status)
-                self.send_header('Content-Type', resp.headers.get('Content-Type', 'application/json'))
-                self.send_header('Content-Length', str(len(resp_body)))
-                self.end_headers()
-                self.wfile.write(resp_body)
-        except urllib.error.HTTPError as e:
-            msg = ''
-            try:
-                msg = e.read().decode('utf-8', errors='ignore')
-            except Exception:
-                msg = str(e)
-            _send_json(self, HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': msg or 'bad gateway'})
-        except Exception as e:
-            _send_json(self, HTTPStatus.BAD_GATEWAY, {'status': '502', 'msg': str(e)})
+            _start_stream(self)
+            seq = 0
+            while True:
+                newer, snapshot = feed.wait(seq, SSE_PING)
+                if newer == seq:
+                    self.wfile.write(b': ping\n\n')
+                    continue
+                seq = newer
+                self.wfile.write(sse_event(seq, snapshot))
+                # 降采样: 这个页面要的频率比轮询低时, 中间的快照直接跳过
+                time.sleep(stream.interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            feed.unsubscribe()
+
+    def _events(self, stream):
+        _start_stream(self)
+        try:
+            while True:
+                data, finished = stream.read(SSE_PING)
+                self.wfile.write(data or b': ping\n\n')
+                self.wfile.flush()
+                if finished:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            pass
 
 
 def main(argv):
     parser = argparse.ArgumentParser()
     parser.add_argument('--host', default='127.0.0.1')
     parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--binary', action='store_true',
+                        help='send commands to the robot in the binary protocol (application/x-quad)')
+    parser.add_argument('--serial', default=os.environ.get('ROBOT_SERIAL'),
+                        help='send commands over this serial port (e.g. /dev/ttyUSB0) instead of baseUrl')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help='keep-alive connections per robot')
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT)
+    parser.add_argument('--read-timeout', type=float, default=READ_TIMEOUT)
+    parser.add_argument('--coalesce-ms', type=float, default=COALESCE_WINDOW * 1000,
+                        help='merge an identical command arriving this soon after the pending one (0: never)')
+    parser.add_argument('--queue-limit', type=int, default=QUEUE_LIMIT,
+                        help='pending commands per robot before 429')
+    parser.add_argument('--clock-interval', type=float, default=clock_sync.INTERVAL,
+                        help='seconds between clock sync bursts per robot (for startAt / startIn / sync)')
+    parser.add_argument('--discovery-port', type=int, default=discovery.ANNOUNCE_PORT,
+                        help='UDP port for robot announcements (0: off)')
+    parser.add_argument('--scan', metavar='NETWORK',
+                        help='subnet to probe for robots on every scan (default: the local /24, and only while '
+                             'no robot announces itself)')
+    parser.add_argument('--scan-interval', type=float, default=discovery.SCAN_INTERVAL,
+                        help='seconds between subnet scans (0: only POST /api/robots/scan)')
+    parser.add_argument('--scan-port', type=int, default=80, help='robot HTTP port probed by the scan')
+    parser.add_argument('--scan-concurrency', type=int, default=discovery.CONCURRENCY)
+    parser.add_argument('--scan-rate', type=float, default=discovery.RATE, help='new probe connections per second')
+    parser.add_argument('--group', action='append', metavar='NAME=URL[,URL...]',
+                        help='named group of robots, used as {"group": NAME} instead of baseUrl')
+    parser.add_argument('--telemetry-hz', type=float, default=POLL_HZ,
+                        help='pose polls per second per watched robot')
+    parser.add_argument('--record', metavar='FILE',
+                        help='append every request to FILE (JSON lines) for bench/classroom_load.py --replay')
     args = parser.parse_args(argv)
 
     directory = os.path.abspath(os.path.dirname(__file__))
     handler = lambda *h_args, **h_kwargs: Handler(*h_args, directory=directory, **h_kwargs)
 
+    try:
+        groups = fanout.parse_groups(args.group, normalize_base_url)
+    except ValueError as e:
+        parser.error(str(e))
+
     httpd = ThreadingHTTPServer((args.host, args.port), handler)
+    httpd.workbench = Workbench(
+        directory,
+        RobotPool(args.pool_size, args.connect_timeout, args.read_timeout),
+        serial=SerialBridge(args.serial, args.baud) if args.serial else None,
+        binary=args.binary or os.environ.get('ROBOT_BINARY') == '1',
+        telemetry_hz=args.telemetry_hz,
+        queues=CommandQueues(args.coalesce_ms / 1000, args.queue_limit),
+        groups=groups,
+        clocks=clock_sync.ClockSync(args.clock_interval),
+        discovery=discovery.Discovery(args.discovery_port, args.scan, args.scan_interval, args.scan_port,
+                                      args.scan_concurrency, args.scan_rate),
+        traffic=TrafficLog(args.record) if args.record else None,
+    )
+    httpd.workbench.discovery.start()
+    if args.serial:
+        print(f'Robot on serial port {args.serial} ({args.baud} baud)')
     print(f'Serving workbench on http://{args.host}:{args.port}/')
     print('Tip: open /?robot=http://192.168.x.x to prefill robot address')
     try:
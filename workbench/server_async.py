@@ -0,0 +1,410 @@
+"""asyncio version of the workbench server (workbench/server.py).
+
+Same routes and replies (both serve proxy.Workbench; this file is the
+HTTP parsing, the event streams and an asyncio robot pool).
+ThreadingHTTPServer holds an OS thread for every request that waits on a
+robot, and a synchronous motion can take 15 s; with a classroom of
+browsers on a few robots that is hundreds of parked threads. Here every connection is a coroutine, and
+load is bounded explicitly:
+
+* per robot, commands wait in its command queue (command_queue.py), at
+  most ``--queue-limit`` of them, and other robot requests (pose polls)
+  get ``--pool-size`` connections plus ``--robot-queue`` waiting; beyond
+  that the proxy answers 429 at once;
+* across all robots, at most ``--max-inflight`` /api/control requests
+  waiting; beyond that 503 at once.
+
+Both carry ``Retry-After: 1``. Program runs and telemetry pollers keep
+their threads (one per program / watched robot) and call into the event
+loop for robot requests.
+
+Run:  python3 workbench/server_async.py --port 8001
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+import urllib.parse
+from http import HTTPStatus
+
+import clock_sync
+import fanout
+from command_queue import COALESCE_WINDOW, QUEUE_LIMIT, CommandQueues
+from discovery import ANNOUNCE_PORT, CONCURRENCY, RATE, SCAN_INTERVAL, Discovery
+from proxy import (CORS, SSE_PING, Call, EventStream, PoolError, Request, Saturated, SerialBridge,
+                   TelemetryStream, Workbench, content_length, json_reply, normalize_base_url)
+from server import CONNECT_TIMEOUT, POOL_IDLE, POOL_SIZE, READ_TIMEOUT, RETRY_METHODS, RequestNotSent
+from telemetry import POLL_HZ, sse_event
+from traffic_log import TrafficLog
+
+ROBOT_QUEUE = 8         # requests per robot waiting for a free connection
+MAX_INFLIGHT = 256      # proxied requests across all robots
+BACKLOG = 1024
+KEEPALIVE = 30.0        # idle browser connections are closed after this
+EVENT_POLL = 0.05       # how often an SSE stream looks for new program events
+
+
+class _Conn:
+    __slots__ = ('reader', 'writer')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class _AsyncRobot:
+    def __init__(self, base_url, size):
+        parsed = urllib.parse.urlparse(base_url)
+        self.base_url = base_url
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.host_header = parsed.netloc
+        self.slots = asyncio.Semaphore(size)
+        self.waiting = 0
+        self.idle = []      # (connection, time returned)
+        self.stats = {'size': size, 'in_use': 0, 'connections': 0, 'requests': 0, 'reused': 0,
+                      'stale': 0, 'retries': 0, 'errors': 0, 'rejected': 0}
+
+
+class AsyncRobotPool:
+    """Keep-alive connections to robots on asyncio streams, see RobotPool."""
+
+    def __init__(self, size=POOL_SIZE, queue=ROBOT_QUEUE, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT):
+        self.size = size
+        self.queue = queue
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._robots = {}
+
+    def _robot(self, base_url):
+        robot = self._robots.get(base_url)
+        if robot is None:
+            robot = self._robots[base_url] = _AsyncRobot(base_url, self.size)
+        return robot
+
+    async def request(self, base_url, method, path, body=b'', headers=None):
+        """Returns ``(status, content type, body bytes)``, raises Saturated when full."""
+        robot = self._robot(base_url)
+        if robot.stats['in_use'] + robot.waiting >= self.size + self.queue:
+            robot.stats['rejected'] += 1
+            raise Saturated(HTTPStatus.TOO_MANY_REQUESTS, f'too many requests for {base_url}')
+        robot.waiting += 1
+        try:
+            await asyncio.wait_for(robot.slots.acquire(), self.read_timeout)
+        except asyncio.TimeoutError:
+            raise PoolError(f'no free connection to {base_url}')
+        finally:
+            robot.waiting -= 1
+        robot.stats['requests'] += 1
+        robot.stats['in_use'] += 1
+        try:
+            conn, reused = await self._checkout(robot)
+            try:
+                result, keep = await self._send(robot, conn, method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                conn.close()
+                if not reused or (method not in RETRY_METHODS and not isinstance(e, RequestNotSent)):
+                    raise
+                # the robot closed the kept-alive connection: retry once on a new one
+                robot.stats['retries'] += 1
+                conn, _ = await self._checkout(robot, fresh=True)
+                result, keep = await self._send(robot, conn, method, path, body, headers)
+            if keep:
+                robot.idle.append((conn, time.monotonic()))
+            else:
+                conn.close()
+            return result
+        except Exception:
+            robot.stats['errors'] += 1
+            raise
+        finally:
+            robot.stats['in_use'] -= 1
+            robot.slots.release()
+
+    async def _checkout(self, robot, fresh=False):
+        now = time.monotonic()
+        while robot.idle and not fresh:
+            conn, since = robot.idle.pop()
+            if now - since < POOL_IDLE and not conn.reader.at_eof():
+                robot.stats['reused'] += 1
+                return conn, True
+            robot.stats['stale'] += 1
+            conn.close()
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(robot.host, robot.port, ssl=robot.https or None), self.connect_timeout)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        robot.stats['connections'] += 1
+        return _Conn(reader, writer), False
+
+    async def _send(self, robot, conn, method, path, body, headers):
+        try:
+            return await asyncio.wait_for(self._exchange(robot, conn, method, path, body, headers),
+                                          self.read_timeout)
+        except BaseException:
+            conn.close()
+            raise
+
+    async def _exchange(self, robot, conn, method, path, body, headers):
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {robot.host_header}', f'Content-Length: {len(body)}']
+        lines += [f'{k}: {v}' for k, v in (headers or {}).items()]
+        try:
+            conn.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await conn.writer.drain()
+        except ConnectionError as e:
+            raise RequestNotSent(str(e)) from e
+        head = await conn.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+        version, status = status_line.split(' ', 2)[:2]
+        fields = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            fields[name.strip().lower()] = value.strip()
+        keep = version == 'HTTP/1.1' and fields.get('connection', '').lower() != 'close'
+        if 'content-length' in fields:
+            data = await conn.reader.readexactly(int(fields['content-length']))
+        else:
+            data = await conn.reader.read()
+            keep = False
+        return (int(status), fields.get('content-type', 'application/json'), data), keep
+
+    def stats(self):
+        return {r.base_url: dict(r.stats, idle=len(r.idle), waiting=r.waiting) for r in self._robots.values()}
+
+
+class WorkbenchServer(Workbench):
+    """proxy.Workbench on asyncio: one coroutine per browser connection."""
+
+    def __init__(self, directory, pool, max_inflight=MAX_INFLIGHT, **kwargs):
+        super().__init__(directory, pool, max_inflight=max_inflight, **kwargs)
+        self.loop = None
+
+    async def serve(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=BACKLOG)
+        async with server:
+            await server.serve_forever()
+
+    # -- HTTP/1.1 with keep-alive, one coroutine per browser connection
+    async def handle_connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = (writer.get_extra_info('peername') or ('',))[0]
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    return
+                request_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ')
+                except ValueError:
+                    return
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                length, reply = content_length(headers)
+                if reply is not None:
+                    # 没读的 body 还在连接里, 回复后关闭
+                    req = Request(method, target, headers, client=client)
+                    keep = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    req = Request(method, target, headers, body, client)
+                    reply = await self.drive(self.handle(req))
+                if isinstance(reply, (EventStream, TelemetryStream)):
+                    # 事件流没有长度, 连接随它结束
+                    self.observe(req, HTTPStatus.OK)
+                    if isinstance(reply, EventStream):
+                        await self.program_events(reply, reader, writer)
+                    else:
+                        await self.telemetry_events(reply, writer)
+                    return
+                if reply is None:
+                    reply = json_reply(HTTPStatus.NOT_FOUND, {'status': '404', 'msg': 'not found'})
+                status, fields, data = reply
+                self.observe(req, status)
+                if status not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED):
+                    fields['Content-Length'] = str(len(data))
+                fields['Connection'] = 'keep-alive' if keep else 'close'
+                writer.write(_head(status, fields) + (b'' if method == 'HEAD' else data))
+                await writer.drain()
+                if not keep:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def drive(self, steps):
+        """proxy.drive() without blocking the loop: Call steps on an executor, Wait steps awaited."""
+        value = error = None
+        while True:
+            try:
+                step = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            value = error = None
+            try:
+                if isinstance(step, Call):
+                    value = await self.loop.run_in_executor(None, step.fn, *step.args)
+                elif step.tickets:
+                    waits = [asyncio.ensure_future(self.wait_pending(t.pending)) for t in step.tickets]
+                    _, late = await asyncio.wait(waits, timeout=step.timeout)
+                    for task in late:
+                        task.cancel()
+            except Exception as e:
+                error = e
+
+    async def wait_pending(self, pending):
+        """Wait for a queued command's reply without holding a thread."""
+        future = self.loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+
+        pending.add_done_callback(lambda _: self.loop.call_soon_threadsafe(resolve))
+        await future
+
+    def robot_request(self, base_url, method, path, body=None, headers=None):
+        """Run the pool's request on the event loop from a queue / runner / telemetry thread."""
+        coro = self.pool.request(base_url, method, path, body or b'', headers)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def program_events(self, stream, reader, writer):
+        writer.write(_sse_head())
+        idle = 0.0
+        while not reader.at_eof():
+            data, finished = stream.read(0)
+            if data:
+                writer.write(data)
+                idle = 0.0
+            elif idle >= SSE_PING:
+                writer.write(b': ping\n\n')
+                idle = 0.0
+            await writer.drain()
+            if finished:
+                break
+            await asyncio.sleep(EVENT_POLL)
+            idle += EVENT_POLL
+
+    async def telemetry_events(self, stream, writer):
+        feed = stream.feed
+        feed.subscribe()
+        try:
+            writer.write(_sse_head())
+            seq = 0
+            idle = 0.0
+            while not writer.is_closing():
+                if feed.seq > seq:
+                    seq = feed.seq
+                    writer.write(sse_event(seq, feed.snapshot))
+                    idle = 0.0
+                elif idle >= SSE_PING:
+                    writer.write(b': ping\n\n')
+                    idle = 0.0
+                await writer.drain()
+                # 降采样: 只发最新的快照, 中间的跳过
+                await asyncio.sleep(stream.interval)
+                idle += stream.interval
+        except ConnectionError:
+            pass
+        finally:
+            feed.unsubscribe()
+
+
+def _head(status, fields):
+    lines = [f'HTTP/1.1 {int(status)} {HTTPStatus(status).phrase}']
+    lines += [f'{k}: {v}' for k, v in fields.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def _sse_head():
+    fields = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'Connection': 'close'}
+    fields.update(CORS)
+    return _head(HTTPStatus.OK, fields)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--binary', action='store_true',
+                        help='send commands to the robot in the binary protocol (application/x-quad)')
+    parser.add_argument('--serial', default=os.environ.get('ROBOT_SERIAL'),
+                        help='send commands over this serial port (e.g. /dev/ttyUSB0) instead of baseUrl')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help='keep-alive connections per robot')
+    parser.add_argument('--robot-queue', type=int, default=ROBOT_QUEUE,
+                        help='requests per robot waiting for a connection before 429')
+    parser.add_argument('--max-inflight', type=int, default=MAX_INFLIGHT,
+                        help='proxied requests across all robots before 503')
+    parser.add_argument('--connect-timeout', type=float, default=CONNECT_TIMEOUT)
+    parser.add_argument('--read-timeout', type=float, default=READ_TIMEOUT)
+    parser.add_argument('--coalesce-ms', type=float, default=COALESCE_WINDOW * 1000,
+                        help='merge an identical command arriving this soon after the pending one (0: never)')
+    parser.add_argument('--queue-limit', type=int, default=QUEUE_LIMIT,
+                        help='pending commands per robot before 429')
+    parser.add_argument('--clock-interval', type=float, default=clock_sync.INTERVAL,
+                        help='seconds between clock sync bursts per robot (for startAt / startIn / sync)')
+    parser.add_argument('--discovery-port', type=int, default=ANNOUNCE_PORT,
+                        help='UDP port for robot announcements (0: off)')
+    parser.add_argument('--scan', metavar='NETWORK',
+                        help='subnet to probe for robots on every scan (default: the local /24, and only while '
+                             'no robot announces itself)')
+    parser.add_argument('--scan-interval', type=float, default=SCAN_INTERVAL,
+                        help='seconds between subnet scans (0: only POST /api/robots/scan)')
+    parser.add_argument('--scan-port', type=int, default=80, help='robot HTTP port probed by the scan')
+    parser.add_argument('--scan-concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--scan-rate', type=float, default=RATE, help='new probe connections per second')
+    parser.add_argument('--group', action='append', metavar='NAME=URL[,URL...]',
+                        help='named group of robots, used as {"group": NAME} instead of baseUrl')
+    parser.add_argument('--telemetry-hz', type=float, default=POLL_HZ,
+                        help='pose polls per second per watched robot')
+    parser.add_argument('--record', metavar='FILE',
+                        help='append every request to FILE (JSON lines) for bench/classroom_load.py --replay')
+    args = parser.parse_args(argv)
+    try:
+        groups = fanout.parse_groups(args.group, normalize_base_url)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = WorkbenchServer(
+        os.path.dirname(os.path.abspath(__file__)),
+        AsyncRobotPool(args.pool_size, args.robot_queue, args.connect_timeout, args.read_timeout),
+        serial=SerialBridge(args.serial, args.baud) if args.serial else None,
+        binary=args.binary or os.environ.get('ROBOT_BINARY') == '1',
+        max_inflight=args.max_inflight,
+        telemetry_hz=args.telemetry_hz,
+        queues=CommandQueues(args.coalesce_ms / 1000, args.queue_limit),
+        groups=groups,
+        clocks=clock_sync.ClockSync(args.clock_interval),
+        discovery=Discovery(args.discovery_port, args.scan, args.scan_interval, args.scan_port,
+                            args.scan_concurrency, args.scan_rate),
+        traffic=TrafficLog(args.record) if args.record else None,
+    )
+    server.discovery.start()
+    print(f'Serving workbench (asyncio) on http://{args.host}:{args.port}/')
+    print('Tip: open /?robot=http://192.168.x.x to prefill robot address')
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,150 @@
+"""In-memory cache of the workbench's static files.
+
+index.html and index-apple.html are ~60 KB each and were read from disk
+and sent uncompressed on every page load. Here each file is read once,
+compressed once (gzip and zlib ``deflate``, plus brotli when the
+``brotli`` module is installed) and kept with an ETag and
+Last-Modified. A stat() per request notices edits, so changing a page
+still only needs a browser refresh.
+"""
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+import urllib.parse
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS = 512      # smaller files are always sent as they are
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+def _compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE)
+
+
+class Asset:
+    """One file: body, precompressed variants and validators."""
+
+    def __init__(self, path, stat, data):
+        self.path = path
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self.mtime = int(stat.st_mtime)
+        self.data = data
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/'):
+            self.content_type += '; charset=utf-8'
+        self.etag = '"%s"' % hashlib.sha1(data).hexdigest()[:16]
+        self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+        self.variants = {}
+        if len(data) >= MIN_COMPRESS and _compressible(self.content_type):
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(data)
+            self.variants['gzip'] = gzip.compress(data, 9, mtime=0)
+            self.variants['deflate'] = zlib.compress(data, 9)
+
+    def select(self, accept_encoding):
+        """``(encoding or None, body)`` for an Accept-Encoding header."""
+        accepted = set()
+        for item in (accept_encoding or '').split(','):
+            name, _, q = item.partition(';')
+            try:
+                if float(q.strip()[2:] or 1) <= 0:
+                    continue
+            except ValueError:
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip', 'deflate'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding, self.variants[encoding]
+        return None, self.data
+
+    def not_modified(self, if_none_match, if_modified_since):
+        """True when the request's validators still match (answer 304)."""
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(',')]
+            return '*' in tags or any(t.replace('W/', '', 1) == self.etag for t in tags)
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return self.mtime <= since
+        return False
+
+
+class StaticCache:
+    """Assets under ``directory`` by URL path, reloaded when the file changes."""
+
+    def __init__(self, directory):
+        self.directory = os.path.realpath(directory)
+        self._assets = {}
+        self._lock = threading.Lock()
+        self.counts = {'requests': 0, 'not_modified': 0, 'loads': 0, 'bytes_sent': 0, 'bytes_plain': 0}
+
+    def resolve(self, url_path):
+        """File system path for ``url_path``, or None outside the directory."""
+        rel = posixpath.normpath(urllib.parse.unquote(urllib.parse.urlsplit(url_path).path)).lstrip('/')
+        full = os.path.realpath(os.path.join(self.directory, *[p for p in rel.split('/') if p not in ('', '.')]))
+        if os.path.isdir(full):
+            full = os.path.join(full, 'index.html')
+        if full != self.directory and not full.startswith(self.directory + os.sep):
+            return None
+        return full
+
+    def get(self, url_path):
+        """The Asset for ``url_path``, or None when there is no such file."""
+        full = self.resolve(url_path)
+        if full is None:
+            return None
+        try:
+            stat = os.stat(full)
+        except OSError:
+            return None
+        if not os.path.isfile(full):
+            return None
+        asset = self._assets.get(full)
+        if asset is not None and asset.key == (stat.st_mtime_ns, stat.st_size):
+            return asset
+        with open(full, 'rb') as f:
+            data = f.read()
+        asset = Asset(full, stat, data)
+        with self._lock:
+            self._assets[full] = asset
+            self.counts['loads'] += 1
+        return asset
+
+    def respond(self, url_path, accept_encoding=None, if_none_match=None, if_modified_since=None):
+        """``(status, header dict, body)`` for a GET, or None for no such file."""
+        asset = self.get(url_path)
+        if asset is None:
+            return None
+        fields = {'ETag': asset.etag, 'Last-Modified': asset.last_modified,
+                  'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if asset.not_modified(if_none_match, if_modified_since):
+            self._count(0, 0, True)
+            return 304, fields, b''
+        encoding, body = asset.select(accept_encoding)
+        fields['Content-Type'] = asset.content_type
+        if encoding is not None:
+            fields['Content-Encoding'] = encoding
+        self._count(len(body), len(asset.data), False)
+        return 200, fields, body
+
+    def _count(self, sent, plain, not_modified):
+        with self._lock:
+            self.counts['requests'] += 1
+            self.counts['not_modified'] += not_modified
+            self.counts['bytes_sent'] += sent
+            self.counts['bytes_plain'] += plain
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, cached=len(self._assets), brotli=brotli is not None)
@@ -0,0 +1,108 @@
+"""Live pose telemetry from robots, fanned out to any number of viewers.
+
+One poller thread per robot reads GET /pose (or the serial pose frame) at
+a fixed rate while someone is watching and caches the latest snapshot.
+Every viewer (an SSE stream in server.py) waits on that cache and takes
+snapshots at its own, lower or equal, rate, so N open tabs cost the robot
+one query per tick.
+"""
+import json
+import threading
+import time
+
+POLL_HZ = 10.0
+LINGER = 5.0        # keep polling this long after the last viewer left
+ERROR_BACKOFF = 1.0
+
+
+class RobotFeed:
+    """Snapshot cache plus poller for one robot.
+
+    ``fetch()`` returns the robot's pose reply as a dict and raises on
+    errors. Snapshots are numbered; viewers wait for a newer ``seq``.
+    """
+
+    def __init__(self, target, fetch, hz=POLL_HZ):
+        self.target = target
+        self.fetch = fetch
+        self.interval = 1.0 / hz
+        self.snapshot = None
+        self.seq = 0
+        self.viewers = 0
+        self.polls = 0
+        self.errors = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._left = time.monotonic()
+
+    def subscribe(self):
+        with self._cond:
+            self.viewers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self):
+        with self._cond:
+            self.viewers -= 1
+            self._left = time.monotonic()
+
+    def wait(self, seq, timeout):
+        """The cached snapshot once it is newer than ``seq``: ``(seq, snapshot)``."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > seq, timeout)
+            return self.seq, self.snapshot
+
+    def stats(self):
+        with self._cond:
+            return {'viewers': self.viewers, 'polls': self.polls, 'errors': self.errors,
+                    'seq': self.seq, 'polling': self._thread is not None}
+
+    def _poll(self):
+        next_at = time.monotonic()
+        while True:
+            with self._cond:
+                if self.viewers <= 0 and time.monotonic() - self._left > LINGER:
+                    self._thread = None
+                    return
+            failed = False
+            try:
+                snapshot = self.fetch()
+                snapshot['received'] = time.time()
+            except Exception as e:
+                snapshot = {'status': '502', 'msg': str(e), 'received': time.time()}
+                failed = True
+            delay = max(self.interval, ERROR_BACKOFF) if failed else self.interval
+            with self._cond:
+                self.polls += 1
+                self.errors += failed
+                self.snapshot = snapshot
+                self.seq += 1
+                self._cond.notify_all()
+            next_at = max(next_at + delay, time.monotonic())
+            time.sleep(next_at - time.monotonic())
+
+
+class TelemetryHub:
+    """RobotFeed per robot target (base URL or serial port)."""
+
+    def __init__(self, hz=POLL_HZ):
+        self.hz = hz
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def feed(self, target, fetch):
+        with self._lock:
+            feed = self._feeds.get(target)
+            if feed is None:
+                feed = self._feeds[target] = RobotFeed(target, fetch, self.hz)
+            return feed
+
+    def stats(self):
+        with self._lock:
+            feeds = list(self._feeds.values())
+        return {f.target: f.stats() for f in feeds}
+
+
+def sse_event(seq, snapshot):
+    return f'id: {seq}\nevent: pose\ndata: {json.dumps(snapshot)}\n\n'.encode('utf-8')
@@ -0,0 +1,40 @@
+"""Request log for replaying real classroom traffic (``--record FILE``).
+
+Every browser request is appended to a JSON-lines file as it arrives:
+time, client address, method, path, body and whether the browser asked
+for gzip or revalidated a cached page. bench/classroom_load.py --replay
+groups the lines by client into sessions and plays them back with the
+same think times against mock robots.
+
+record() only queues the entry; a writer thread does the file write, so
+server_async.py's event loop never waits on the disk.
+"""
+import json
+import queue
+import threading
+import time
+
+
+class TrafficLog:
+    def __init__(self, path):
+        # 行缓冲: 服务器被杀掉时只丢还在队列里的几行
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+        self._queue = queue.SimpleQueue()
+        self.records = 0
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def record(self, client, method, path, body=b'', gzip=False, revalidate=False):
+        entry = {'t': round(time.time(), 3), 'client': client, 'method': method, 'path': path}
+        if body:
+            entry['body'] = body.decode('utf-8', errors='replace')
+        if gzip:
+            entry['gzip'] = True
+        if revalidate:
+            entry['revalidate'] = True
+        self._queue.put(entry)
+
+    def _write(self):
+        while True:
+            entry = self._queue.get()
+            self._file.write(json.dumps(entry) + '\n')
+            self.records += 1